@@ -4,11 +4,18 @@ import socket
 from hashing import consistent_hashing
 
 class nodeAddress:
+	# Immutable: the ring identity is computed once, on construction.
+	__slots__ = ("_address", "_identity")
+
 	def __init__(self,*args):
-		self._address = args[0]
+		object.__setattr__(self, "_address", str(args[0]))
+		object.__setattr__(self, "_identity", consistent_hashing(self._address))
+
+	def __setattr__(self, name, value):
+		raise AttributeError("nodeAddress is immutable")
 
 	def __hash__(self):
-		return consistent_hashing(self._address) 
+		return self._identity
 
 	def __cmp__(self, other):
 		return other.__hash__() < self.__hash__()
@@ -19,6 +26,19 @@ class nodeAddress:
 	def __str__(self):
 		return "{}".format(self._address)
 
+# Virtual nodes of one process share its host:port and are told apart by a
+# suffix, "host:port#i". Virtual node 0 keeps the plain address.
+VNODE_SEPARATOR = "#"
+
+def vnode_address(host_port, index):
+	if index == 0:
+		return str(host_port)
+	return "{}{}{}".format(host_port, VNODE_SEPARATOR, index)
+
+def split_vnode(address):
+	host_port, _, index = str(address).partition(VNODE_SEPARATOR)
+	return host_port, int(index) if index else 0
+
 class networkAddress:
 	def get_host_address(self):
 		host_name = socket.gethostname()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+import queue
+import selectors
+import socket
+import threading
+import time
+from http.server import HTTPServer
+from streams import bodyReader
+import configurations as configs
+
+# Ring maintenance must keep working under load, or an overloaded node also
+# drops out of the ring; it is always admitted, and served by workers of its
+# own. Internal hops (lookups and data hops to an owner or replica) serve
+# requests already admitted elsewhere, so they get their own slots apart
+# from new client requests. Everything else, admin, debug and handoff
+# requests among them, may run long or move a lot of data, and gets a few
+# slots of its own.
+MAINTENANCE = "maintenance"
+INTERNAL = "internal"
+CLIENT = "client"
+ADMIN = "admin"
+
+# By the first segment of the path.
+MAINTENANCE_ROUTES = ("ping", "notify", "neighborhood", "findpredecessor", "informPredecessor", "informSuccessor")
+INTERNAL_ROUTES = ("findsuccessor", "findnext", "local-storage", "replica-storage")
+CLIENT_ROUTES = ("storage",)
+
+def route_class(path):
+    segment = path.partition("?")[0][1:].partition("/")[0]
+    if segment in MAINTENANCE_ROUTES:
+        return MAINTENANCE
+    if segment in INTERNAL_ROUTES:
+        return INTERNAL
+    if segment in CLIENT_ROUTES:
+        return CLIENT
+    return ADMIN
+
+class admissionControl:
+    """Per route class request slots. Acquiring never blocks: a request that
+    finds its class full is turned away at once instead of queueing behind
+    the requests that filled it."""
+
+    def __init__(self, internal_slots=None, client_slots=None, admin_slots=None):
+        self._slots = {
+            INTERNAL: configs.ADMIT_INTERNAL_SLOTS if internal_slots is None else internal_slots,
+            CLIENT: configs.ADMIT_CLIENT_SLOTS if client_slots is None else client_slots,
+            ADMIN: configs.ADMIT_ADMIN_SLOTS if admin_slots is None else admin_slots,
+        }
+        self._active = { INTERNAL: 0, CLIENT: 0, ADMIN: 0, MAINTENANCE: 0 }
+        self._rejected = { INTERNAL: 0, CLIENT: 0, ADMIN: 0, "queue": 0 }
+        self._lock = threading.Lock()
+
+    def acquire(self, klass):
+        with self._lock:
+            limit = self._slots.get(klass)
+            if limit is not None and self._active[klass] >= limit:
+                self._rejected[klass] += 1
+                return False
+            self._active[klass] += 1
+            return True
+
+    def release(self, klass):
+        with self._lock:
+            self._active[klass] -= 1
+
+    def reject_connection(self):
+        with self._lock:
+            self._rejected["queue"] += 1
+
+    def serialize(self):
+        with self._lock:
+            return { "slots": dict(self._slots), "active": dict(self._active), "rejected": dict(self._rejected) }
+
+class pooledHandler:
+    """Mixed into the request handler by pooledHttpServer.
+
+    Admits each request by route class, and gives its worker back between
+    requests of a keep-alive connection when other connections are waiting.
+    The connection itself is kept: it is parked until its next request.
+    """
+
+    def handle(self):
+        self.close_connection = True
+        self.parked = False
+        self.handle_one_request()
+        while not self.close_connection:
+            ready = self.server.wait_for_request(self.connection)
+            if not ready:
+                self.parked = ready is None
+                break
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        self._admitted = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self._admitted is not None:
+                self.server.admission.release(self._admitted)
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        klass = route_class(self.path)
+        if not self.server.admission.acquire(klass):
+            # The body is still read so the connection stays usable.
+            bodyReader(self.rfile, self.headers).drain()
+            self.send_whole_response(503, "Overloaded, retry later",
+                    headers={ "Retry-After": str(configs.SERVER_RETRY_AFTER) })
+            return False
+        self._admitted = klass
+        return True
+
+def peek_route(request):
+    # The route class of the request waiting on a connection, read without
+    # consuming it; None when the peer closed the connection. A request line
+    # not all there yet counts as a client request.
+    try:
+        data = request.recv(configs.SERVER_PEEK_BYTES, socket.MSG_PEEK)
+    except OSError:
+        return None
+    if not data:
+        return None
+    line, newline, _ = data.partition(b"\r\n")
+    parts = line.split(b" ")
+    if not newline or len(parts) != 3:
+        return CLIENT
+    return route_class(parts[1].decode("latin-1"))
+
+class pooledHttpServer(HTTPServer):
+    """HTTP server with a fixed number of worker threads.
+
+    A triage thread waits for the next request on new connections, and on
+    keep-alive ones whose worker was given back, and looks at its route:
+    ring maintenance goes to workers of its own, anything else to a bounded
+    queue for the other workers, or, with that queue full, gets 503 and
+    Retry-After and is closed. Requests are then admitted by route class
+    (see admissionControl).
+    """
+
+    def __init__(self, server_address, handler_class, workers=None, backlog=None):
+        self.workers = configs.SERVER_WORKERS if workers is None else workers
+        self.request_queue_size = configs.SERVER_ACCEPT_QUEUE if backlog is None else backlog
+        self.admission = admissionControl()
+        self._pending = queue.Queue(maxsize=self.request_queue_size)
+        self._maintenance = queue.Queue(maxsize=self.request_queue_size)
+        # Connections for the triage thread, and a socket to wake it with.
+        self._arrivals = queue.Queue()
+        self._wakeup, self._wakeup_writer = socket.socketpair()
+        self._local = threading.local()
+        handler_class = type(handler_class.__name__, (pooledHandler, handler_class), {})
+        HTTPServer.__init__(self, server_address, handler_class)
+        self._workers = []
+        lanes = [("http-worker", self._pending, self.workers),
+                 ("http-maintenance", self._maintenance, configs.SERVER_MAINTENANCE_WORKERS)]
+        for name, pending, count in lanes:
+            for i in range(count):
+                worker = threading.Thread(target=self._work, args=(pending,), name="%s-%d" % (name, i))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        triage = threading.Thread(target=self._triage, name="http-triage")
+        triage.daemon = True
+        triage.start()
+
+    def process_request(self, request, client_address):
+        # Nothing is known of a new connection before its first request, so
+        # it starts out parked like an idle one.
+        self.park(request, client_address)
+
+    def park(self, request, client_address):
+        # Hands a connection to the triage thread until its next request.
+        self._arrivals.put((request, client_address))
+        try:
+            self._wakeup_writer.send(b"\0")
+        except OSError:
+            pass
+
+    def _triage(self):
+        # Never blocks on a single connection: it only waits in select, and
+        # writes a 503 without waiting for the peer to take it.
+        parked = {}
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._wakeup, selectors.EVENT_READ)
+            while True:
+                for key, _ in selector.select(configs.SERVER_IDLE_POLL):
+                    if key.fileobj is self._wakeup:
+                        try:
+                            self._wakeup.recv(4096)
+                        except OSError:
+                            return
+                        continue
+                    selector.unregister(key.fileobj)
+                    client_address, _ = parked.pop(key.fileobj)
+                    self._dispatch(key.fileobj, client_address)
+                while True:
+                    try:
+                        request, client_address = self._arrivals.get_nowait()
+                    except queue.Empty:
+                        break
+                    if request is None:
+                        return
+                    parked[request] = (client_address, time.monotonic() + configs.SERVER_KEEPALIVE_TIMEOUT)
+                    selector.register(request, selectors.EVENT_READ)
+                now = time.monotonic()
+                for request in [r for r, (_, deadline) in parked.items() if deadline <= now]:
+                    selector.unregister(request)
+                    del parked[request]
+                    self.shutdown_request(request)
+
+    def _dispatch(self, request, client_address):
+        klass = peek_route(request)
+        if klass is None:
+            self.shutdown_request(request)
+            return
+        try:
+            if klass == MAINTENANCE:
+                self._maintenance.put_nowait((request, client_address))
+            else:
+                self._pending.put_nowait((request, client_address))
+            return
+        except queue.Full:
+            pass
+        self.admission.reject_connection()
+        try:
+            # A 503 fits in any socket buffer; if it does not go out at
+            # once, the peer is not reading and only loses the reason.
+            request.setblocking(False)
+            request.send(("HTTP/1.1 503 Service Unavailable\r\nRetry-After: %d\r\n"
+                          "Content-Length: 0\r\nConnection: close\r\n\r\n" %
+                          configs.SERVER_RETRY_AFTER).encode("latin-1"))
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _work(self, pending):
+        self._local.pending = pending
+        while True:
+            request, client_address = pending.get()
+            if request is None:
+                return
+            parked = False
+            try:
+                handler = self.RequestHandlerClass(request, client_address, self)
+                parked = handler.parked
+            except Exception:
+                self.handle_error(request, client_address)
+            if parked:
+                self.park(request, client_address)
+            else:
+                self.shutdown_request(request)
+
+    def wait_for_request(self, connection):
+        # Between two requests of a keep-alive connection: True once the next
+        # request arrives, False to close the connection when it stays idle
+        # too long, None to park it when other connections are waiting for
+        # a worker of this lane.
+        deadline = time.monotonic() + configs.SERVER_KEEPALIVE_TIMEOUT
+        with selectors.DefaultSelector() as selector:
+            selector.register(connection, selectors.EVENT_READ)
+            while time.monotonic() < deadline:
+                if selector.select(configs.SERVER_IDLE_POLL):
+                    return True
+                if not self._local.pending.empty():
+                    return None
+        return False
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self._arrivals.put((None, None))
+        try:
+            self._wakeup_writer.send(b"\0")
+        except OSError:
+            pass
+        for pending in (self._pending, self._maintenance):
+            for worker in self._workers:
+                try:
+                    pending.put_nowait((None, None))
+                except queue.Full:
+                    break
@@ -147,6 +147,10 @@ class SimpleApiCheck(unittest.TestCase):
         key = "api-test-key-nonexistent-key-{}".format(uuid.uuid4())
         r = do_request(self.node, "GET", "/storage/"+key, accept_statuses=[404])
 
+    def test_malformed_lookup_id_400(self):
+        for path in ("/findsuccessor/abc", "/findnext/abc", "/join/abc"):
+            do_request(self.node, "GET", path, accept_statuses=[400])
+
     def test_kv_put_and_get(self):
         key = "api-test-key-{}".format(uuid.uuid4())
         value = "api-test-value-{}".format(uuid.uuid4())
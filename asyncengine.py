@@ -0,0 +1,719 @@
+#!/usr/bin/env python3
+
+import asyncio
+import contextvars
+import http.client
+import io
+import json
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from connection import rpcResponse
+from finger import finger
+import tracing
+import configurations as configs
+
+class staleConnection(ConnectionResetError):
+    """The peer closed a keep-alive connection before any of the response
+    to the request sent on it arrived."""
+
+# Everything a broken or slow peer can make a request fail with.
+TRANSPORT_ERRORS = (OSError, EOFError, asyncio.TimeoutError, asyncio.LimitOverrunError,
+                    http.client.HTTPException, ValueError)
+
+async def read_head(reader):
+    # Reads a start line and its headers. Returns (None, None) when the peer
+    # closed the connection between two messages.
+    start = await reader.readline()
+    if not start:
+        return None, None
+    lines = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise asyncio.IncompleteReadError(b"", None)
+        if line in (b"\r\n", b"\n"):
+            break
+        lines.append(line)
+        if len(lines) > http.client._MAXHEADERS:
+            raise http.client.HTTPException("got more than %d headers" % http.client._MAXHEADERS)
+    headers = http.client.parse_headers(io.BytesIO(b"".join(lines) + b"\r\n"))
+    return start.decode("latin-1").rstrip("\r\n"), headers
+
+def is_chunked(headers):
+    return "chunked" in headers.get("Transfer-Encoding", "").lower()
+
+class asyncBodyReader:
+    """streams.bodyReader for an asyncio.StreamReader: the body of a message
+    framed by Content-Length, by chunked transfer encoding or, with
+    until_eof, by the end of the connection.
+
+    chunks() hands the body out STREAM_CHUNK_BYTES at a time; read() returns
+    it whole.
+    """
+
+    def __init__(self, reader, headers, until_eof=False):
+        self._reader = reader
+        self.chunked = is_chunked(headers)
+        length = headers.get("Content-Length")
+        if self.chunked or (length is None and until_eof):
+            self.length = None
+        else:
+            self.length = int(length or 0)
+        # Bytes left in the body or in the current chunk; None when the
+        # body runs to the end of the connection.
+        self._left = 0 if self.chunked else self.length
+        self._done = self.length == 0
+
+    async def _next_chunk(self):
+        line = await self._reader.readline()
+        size = int(line.split(b";", 1)[0], 16)
+        if size == 0:
+            while (await self._reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+        return size
+
+    async def read1(self, size=None):
+        # Up to size bytes of the body, b"" once it is all read.
+        if self._done:
+            return b""
+        size = size or configs.STREAM_CHUNK_BYTES
+        if self._left is None:
+            data = await self._reader.read(size)
+            self._done = not data
+            return data
+        if self._left == 0:
+            self._left = await self._next_chunk()
+            if self._left == 0:
+                self._done = True
+                return b""
+        data = await self._reader.readexactly(min(size, self._left))
+        self._left -= len(data)
+        if self._left == 0:
+            if self.chunked:
+                await self._reader.readline()
+            else:
+                self._done = True
+        return data
+
+    async def chunks(self, size=None):
+        while True:
+            data = await self.read1(size)
+            if not data:
+                return
+            yield data
+
+    async def read(self):
+        if self.chunked or self._left is None:
+            return b"".join([data async for data in self.chunks()])
+        return await self.read1(self._left)
+
+class asyncResponseStream:
+    """connection.responseStream for the asyncio pool. The connection goes
+    back to the pool once the body is read to its end, and is closed if the
+    caller gives up before that."""
+
+    def __init__(self, pool, address, conn, body, will_close, timeout):
+        self._pool = pool
+        self._address = address
+        self._conn = conn
+        self._body = body
+        self._will_close = will_close
+        self._timeout = timeout
+        self.length = body.length
+
+    async def chunks(self, size=None):
+        while True:
+            data = await asyncio.wait_for(self._body.read1(size), self._timeout)
+            if not data:
+                break
+            yield data
+        self._finish(self._will_close)
+
+    def _finish(self, close):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if close:
+            conn[1].close()
+        else:
+            self._pool._release(self._address, conn)
+
+    def close(self):
+        self._finish(True)
+
+def in_executor(executor, fn, *args):
+    # run_in_executor, with fn run in a copy of the calling task's context
+    # so that the trace active in the task follows it to the worker thread.
+    return asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, fn, *args)
+
+class asyncConnectionPool:
+    """Non-blocking counterpart of connection.connectionPool.
+
+    Only used from the event loop thread, so it needs no lock. Like the
+    threaded pool, a request that fails on a reused connection is retried
+    once on a fresh one.
+    """
+
+    def __init__(self, max_idle=None, idle_timeout=None, timeout=None):
+        self._max_idle = configs.POOL_MAX_IDLE_PER_PEER if max_idle is None else max_idle
+        self._idle_timeout = configs.POOL_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self._timeout = configs.RPC_TIMEOUT if timeout is None else timeout
+        self._idle = {}
+
+    def _acquire(self, address):
+        now = time.monotonic()
+        idle = self._idle.get(address)
+        while idle:
+            reader, writer, last_used = idle.pop()
+            if now - last_used > self._idle_timeout or reader.at_eof():
+                writer.close()
+                continue
+            return (reader, writer), True
+        return None, False
+
+    def _release(self, address, conn):
+        idle = self._idle.setdefault(address, [])
+        if len(idle) < self._max_idle:
+            idle.append(conn + (time.monotonic(),))
+            return
+        conn[1].close()
+
+    async def _exchange(self, conn, address, method, path, body, headers, stream):
+        reader, writer = conn
+        if isinstance(body, str):
+            body = body.encode("iso-8859-1")
+        body = body or b""
+        head = ["%s %s HTTP/1.1" % (method, path), "Host: " + address, "Content-Length: %d" % len(body)]
+        head.extend("%s: %s" % item for item in (headers or {}).items())
+        try:
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+            start, resp_headers = await read_head(reader)
+        except (ConnectionResetError, BrokenPipeError) as e:
+            raise staleConnection(str(e))
+        if start is None:
+            raise staleConnection("connection closed by " + address)
+        version, status = start.split(" ", 2)[:2]
+        will_close = version == "HTTP/1.0" or \
+                resp_headers.get("Connection", "").lower() == "close" or \
+                (resp_headers.get("Content-Length") is None and not is_chunked(resp_headers))
+        resp_body = asyncBodyReader(reader, resp_headers, until_eof=will_close)
+        if stream and status == "200" and (resp_body.length is None or resp_body.length > configs.STREAM_CHUNK_BYTES):
+            # Left unread for the caller; a body that fits in one piece is
+            # not worth streaming.
+            return rpcResponse(200, resp_headers, resp_body), will_close
+        return rpcResponse(int(status), resp_headers, await resp_body.read()), will_close
+
+    async def request(self, address, method, path, body=None, headers=None, timeout=None, stream=False):
+        # With stream, the body of a large 200 response is left unread and
+        # returned as an asyncResponseStream.
+        address = str(address)
+        timeout = self._timeout if timeout is None else timeout
+        fresh = False
+        while True:
+            conn, reused = (None, False) if fresh else self._acquire(address)
+            try:
+                if conn is None:
+                    host, port = address.rsplit(":", 1)
+                    conn = await asyncio.wait_for(asyncio.open_connection(host, int(port)), timeout)
+                resp, will_close = await asyncio.wait_for(
+                        self._exchange(conn, address, method, path, body, headers, stream), timeout)
+            except TRANSPORT_ERRORS as e:
+                if conn is not None:
+                    conn[1].close()
+                # Like connectionPool.request: a stale keep-alive connection
+                # is retried once on a new one; a timeout never is.
+                if reused and isinstance(e, staleConnection):
+                    fresh = True
+                    continue
+                raise
+
+            if isinstance(resp.body, asyncBodyReader):
+                resp.body = asyncResponseStream(self, address, conn, resp.body, will_close, timeout)
+            elif will_close:
+                conn[1].close()
+            else:
+                self._release(address, conn)
+            return resp
+
+    def discard(self, address):
+        for reader, writer, _ in self._idle.pop(str(address), []):
+            writer.close()
+
+    def close(self):
+        idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for reader, writer, _ in conns:
+                writer.close()
+
+class asyncNode:
+    """Non-blocking lookups and client reads and writes for a baseNode.
+
+    Routing decisions (lookupStep, the route cache, the replica read order)
+    and the peer health table stay in baseNode and are shared with the
+    threaded engine; only the waiting on peers happens on the event loop.
+    Work that blocks, like storing a key and replicating it, runs on the
+    executor.
+    """
+
+    def __init__(self, node, pool, executor):
+        self._node = node
+        self._pool = pool
+        self._executor = executor
+
+    async def run(self, fn, *args):
+        return await in_executor(self._executor, fn, *args)
+
+    async def rpc(self, address, method, path, body=None, probe=False, timeout=None, stream=False):
+        # Same contract as baseNode._rpc.
+        node = self._node
+        address = str(address)
+        if not node.can_contact(address, probe):
+            return None
+        host_port, headers = node.rpc_target(address)
+        name = node.rpc_name(method, path)
+        labels = (("transport", "http"), ("rpc", name))
+        span = node.client_span(name, address)
+        if span is not None:
+            headers = dict(headers or {}, **span.headers())
+        started = time.perf_counter()
+        try:
+            resp = await self._pool.request(host_port, method, path, body, headers, timeout, stream)
+        except TRANSPORT_ERRORS:
+            self._pool.discard(host_port)
+            node.call_failed(address, labels, span)
+            return None
+        node.call_answered(address, labels, span, time.perf_counter() - started, resp.status)
+        return resp
+
+    async def find_successor(self, id, mode=None):
+        started = time.perf_counter()
+        if (mode or configs.LOOKUP_MODE) == "iterative":
+            result, hops, start = await self.find_successor_iterative(id)
+        else:
+            result, hops, start = await self.find_successor_with_hops(id)
+        self._node.recordLookup(result, hops, start)
+        self._node.record_timing("findSuccessor", time.perf_counter() - started)
+        return result
+
+    async def find_successor_with_hops(self, id):
+        # baseNode.findSuccessorWithHops, waiting on the next hop without
+        # holding a thread.
+        node = self._node
+        for attempt in range(configs.M_BITS):
+            done, remote, start = node.lookupStep(id)
+            if done:
+                return remote, 0, start
+
+            node.record_forward("lookup")
+            result, hops, start = await self.find_successor_remote(remote.get_address(), id)
+            if result != None:
+                return result, hops + 1, start
+            if remote.get_address().__hash__() == node.get_successor().get_address().__hash__():
+                break
+        return None, 0, None
+
+    async def find_successor_iterative(self, id):
+        node = self._node
+        hops = 0
+        done, remote, start = node.lookupStep(id)
+        while not done:
+            if hops >= configs.LOOKUP_MAX_HOPS:
+                return None, hops, None
+            hops += 1
+            step = await self.find_next_remote(remote.get_address(), id)
+            if step is None:
+                done, remote, start = node.lookupStep(id)
+            else:
+                done, remote, start = step
+        return remote, hops, start
+
+    async def find_successor_remote(self, address, id):
+        resp = await self.rpc(address, "GET", "/findsuccessor/" + str(id))
+        if resp is None or resp.status != 200:
+            return None, 0, None
+        try:
+            json_data = json.loads(resp.body)
+            return finger(json_data['address']).this(), json_data.get('hops', 0), json_data.get('start')
+        except (ValueError, KeyError):
+            return None, 0, None
+
+    async def find_next_remote(self, address, id):
+        resp = await self.rpc(address, "GET", "/findnext/" + str(id), timeout=configs.LOOKUP_HOP_TIMEOUT)
+        if resp is None or resp.status != 200:
+            return None
+        try:
+            json_data = json.loads(resp.body)
+            return json_data['done'], finger(json_data['address']).this(), json_data.get('start')
+        except (ValueError, KeyError):
+            return None
+
+    async def resolve_owner(self, id, use_cache=True):
+        node = self._node
+        if node.get_predecessor() != None and node.isResponsible(id):
+            return node.this(), False
+        if use_cache:
+            owner = node.cachedOwner(id)
+            if owner != None:
+                return owner, True
+        return await self.find_successor(id), False
+
+    async def route_key(self, id, local, remote):
+        # baseNode.routeKey; local() runs on the executor.
+        node = self._node
+        for use_cache in (True, False):
+            owner, cached = await self.resolve_owner(id, use_cache)
+            if owner is None:
+                return None
+            if owner.get_identity() == node.get_identity():
+                return await self.run(local)
+            node.record_forward("storage")
+            result = await remote(owner.get_address(), cached)
+            if result is not None or not cached:
+                return result
+            node.invalidateRoute(id)
+        return None
+
+    async def get_key(self, key):
+        node = self._node
+        return await self.route_key(node.getKeyHash(key),
+                lambda: node.getLocalKey(key),
+                lambda address, check: self.read_key(address, key, check))
+
+    async def put_key(self, key, value, ttl=None):
+        node = self._node
+        return await self.route_key(node.getKeyHash(key),
+                lambda: node.storeKeyValue(key, value, ttl),
+                lambda address, check: self.send_put(address, key, value, check, ttl))
+
+    async def read_key(self, owner, key, check=False):
+        node = self._node
+        owner = str(owner)
+        # A large value comes back as an asyncResponseStream.
+        for address in node.readOrder(owner):
+            if address == owner:
+                resp = await self.rpc(address, "GET", "/local-storage/" + key + ("?check=1" if check else ""),
+                                      stream=True)
+            else:
+                resp = await self.rpc(address, "GET", "/replica-storage/" + key, stream=True)
+            if resp is None or resp.status >= 500:
+                continue
+            if address == owner:
+                node.learn_replicas(address, resp)
+            if resp.status == 200:
+                return resp.body
+            if address == owner:
+                return None
+        return None
+
+    async def send_put(self, address, key, value, check=False, ttl=None):
+        path = self._node.storagePath("/local-storage/", key, check, ttl)
+        resp = await self.rpc(address, "PUT", path, value)
+        if resp is None or resp.status != 200:
+            return None
+        self._node.learn_replicas(address, resp)
+        return resp.body
+
+class loopReader:
+    """The rfile of a handler run on a worker thread while its request body
+    is still arriving: each read waits on the event loop's StreamReader."""
+
+    def __init__(self, reader, loop):
+        self._reader = reader
+        self._loop = loop
+
+    def _wait(self, coro):
+        future = asyncio.run_coroutine_threadsafe(
+                asyncio.wait_for(coro, configs.SERVER_KEEPALIVE_TIMEOUT), self._loop)
+        try:
+            return future.result()
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+        except (asyncio.TimeoutError, asyncio.LimitOverrunError, ValueError) as e:
+            raise OSError(str(e) or "timed out")
+
+    def read(self, size):
+        return self._wait(self._reader.readexactly(size))
+
+    def readline(self, limit=-1):
+        return self._wait(self._reader.readline())
+
+class loopWriter:
+    """The wfile of a handler run on a worker thread that writes straight to
+    the client through the event loop, for responses relayed as they come."""
+
+    def __init__(self, writer, loop):
+        self._writer = writer
+        self._loop = loop
+        self._written = 0
+
+    async def _write(self, data):
+        self._writer.write(data)
+        await asyncio.wait_for(self._writer.drain(), configs.SERVER_KEEPALIVE_TIMEOUT)
+
+    def write(self, data):
+        future = asyncio.run_coroutine_threadsafe(self._write(data), self._loop)
+        try:
+            future.result()
+        except asyncio.TimeoutError:
+            raise OSError("timed out")
+        self._written += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._written
+
+    def flush(self):
+        pass
+
+class asyncHttpServer:
+    """HTTP/1.1 server on an asyncio event loop, usable in place of the
+    threaded server in storageNode.run_server.
+
+    Lookups and client GET/PUT on /storage are served on the loop through
+    asyncNode. Every other route runs the threaded engine's handler class on
+    a worker thread, against a buffered request and response, so both
+    engines serve the same routes with the same code. A request whose body
+    is over STREAM_MIN_BYTES, or of unknown size, is handed to the handler
+    class with its body still unread, through a loopReader and loopWriter,
+    so it is relayed as it arrives the way the threaded engine does.
+    """
+
+    def __init__(self, server_address, handler_class, nodes):
+        self.server_address = server_address
+        self.socket = socket.create_server(server_address, backlog=socket.SOMAXCONN)
+        self._handler_class = handler_class
+        self._nodes = nodes
+        self._pool = asyncConnectionPool()
+        self._executor = ThreadPoolExecutor(max_workers=configs.ASYNC_WORKERS, thread_name_prefix="async-worker")
+        self._async_nodes = {}
+        self._stopped = None
+        self._loop = None
+        self._done = threading.Event()
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._done.set()
+
+    def shutdown(self):
+        # Called from another thread; returns once serve_forever has exited.
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._stopped.set)
+        self._done.wait()
+
+    async def _serve(self):
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle_connection, sock=self.socket)
+        self._loop = asyncio.get_running_loop()
+        async with server:
+            await self._stopped.wait()
+        self._pool.close()
+        self._executor.shutdown(wait=False)
+
+    def _async_node(self, node):
+        result = self._async_nodes.get(id(node))
+        if result is None:
+            result = asyncNode(node, self._pool, self._executor)
+            self._async_nodes[id(node)] = result
+        return result
+
+    async def _handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info("peername")
+        try:
+            while True:
+                start, headers = await asyncio.wait_for(read_head(reader), configs.SERVER_KEEPALIVE_TIMEOUT)
+                if start is None:
+                    break
+                method, path, version = start.split(" ", 2)
+                body = asyncBodyReader(reader, headers)
+                if body.length is not None and body.length <= configs.STREAM_MIN_BYTES:
+                    handler = self._buffered_handler(client_address, method, path, version, headers,
+                                                     await body.read())
+                    await self._respond(handler)
+                    writer.write(handler.wfile.getvalue())
+                    await writer.drain()
+                    if handler.stream is not None:
+                        await self._relay(handler, writer)
+                else:
+                    handler = self._streaming_handler(client_address, method, path, version, headers,
+                                                      reader, writer)
+                    await in_executor(self._executor, self._run_handler, handler)
+                if handler.close_connection or version != "HTTP/1.1" or \
+                        headers.get("Connection", "").lower() == "close":
+                    break
+        except TRANSPORT_ERRORS:
+            pass
+        except asyncio.CancelledError:
+            # The server is shutting down with this connection still open.
+            pass
+        finally:
+            writer.close()
+
+    def _buffered_handler(self, client_address, method, path, version, headers, body):
+        # A handler instance that never touches a socket: the request is
+        # already parsed and the response is collected in wfile.
+        handler = self._handler_class.__new__(self._handler_class)
+        handler.server = self
+        handler.client_address = client_address
+        handler.command = method
+        handler.path = path
+        handler.request_version = version
+        handler.requestline = "%s %s %s" % (method, path, version)
+        handler.headers = headers
+        handler.rfile = io.BytesIO(body)
+        handler.wfile = io.BytesIO()
+        handler.close_connection = False
+        handler.stream = None
+        return handler
+
+    def _streaming_handler(self, client_address, method, path, version, headers, reader, writer):
+        # Like _buffered_handler, but the body is read from the connection and
+        # the response written to it as the handler goes.
+        handler = self._buffered_handler(client_address, method, path, version, headers, b"")
+        handler.rfile = loopReader(reader, self._loop)
+        handler.wfile = loopWriter(writer, self._loop)
+        return handler
+
+    async def _respond(self, handler):
+        node = handler.get_node()
+        route = None
+        if node is not None and node.get_state() != False and node.running() != False:
+            route = self._native_route(handler.command, handler.path)
+        if route is None:
+            await in_executor(self._executor, self._run_handler, handler)
+            return
+        name = "/" + handler.split_path(handler.path)[0]
+        handler.status = 500
+        handler.trace = handler.start_trace(node, name, name == "/storage")
+        # Each connection runs in a task of its own, with its own context.
+        token = tracing.activate(handler.trace) if handler.trace is not None else None
+        started = time.perf_counter()
+        try:
+            await route(handler, self._async_node(node))
+        except Exception:
+            traceback.print_exc()
+            self._fail(handler)
+        node.record_request(handler.command, name, int(handler.status), time.perf_counter() - started)
+        if handler.trace is not None:
+            tracing.deactivate(token)
+            handler.trace.finish(int(handler.status))
+
+    def _run_handler(self, handler):
+        method = getattr(handler, "do_" + handler.command, None)
+        if method is None:
+            handler.send_error(501, "Unsupported method (%r)" % handler.command)
+            return
+        try:
+            method()
+        except Exception:
+            traceback.print_exc()
+            self._fail(handler)
+
+    def _fail(self, handler):
+        handler.close_connection = True
+        if not handler.wfile.tell():
+            handler.send_whole_response(500, "Internal error")
+
+    def _native_route(self, method, path):
+        # Keyed on the first path segment, like the handler's own tables.
+        segment = path[1:].partition("?")[0].partition("/")[0]
+        if method == "GET":
+            if segment == "findsuccessor":
+                return self._find_successor
+            if segment == "findnext":
+                return self._find_next
+            if segment == "storage":
+                return self._get_storage
+        elif method == "PUT" and segment == "storage":
+            return self._put_storage
+        return None
+
+    async def _find_successor(self, handler, anode):
+        id = handler.parse_id(handler.split_path(handler.path)[1])
+        if id is None:
+            return
+        result, hops, start = await anode.find_successor_with_hops(id)
+        if result is None:
+            handler.send_whole_response(404, { "result": None })
+        else:
+            data = result.serialize()
+            data["hops"] = hops
+            data["start"] = start
+            handler.send_whole_response(200, data)
+
+    async def _find_next(self, handler, anode):
+        id = handler.parse_id(handler.split_path(handler.path)[1])
+        if id is None:
+            return
+        done, result, start = handler.get_node().lookupStep(id)
+        data = result.serialize()
+        data["done"] = done
+        data["start"] = start
+        handler.send_whole_response(200, data)
+
+    async def _get_storage(self, handler, anode):
+        key = handler.split_path(handler.path)[1]
+        result = await anode.get_key(key)
+        if result is None:
+            handler.send_whole_response(404, "No object with key '%s' on this node" % key)
+        elif isinstance(result, asyncResponseStream):
+            self._start_stream(handler, result, 'text/plain')
+        else:
+            handler.send_whole_response(200, result, 'text/plain')
+
+    def _start_stream(self, handler, stream, content_type):
+        # The head of the handler's send_stream_response; the body is
+        # relayed by _relay once the head is out.
+        handler.chunked = stream.length is None and handler.request_version == "HTTP/1.1"
+        handler.send_response(200)
+        handler.send_header('Content-type', content_type)
+        if handler.chunked:
+            handler.send_header('Transfer-Encoding', 'chunked')
+        elif stream.length is not None:
+            handler.send_header('Content-length', stream.length)
+        else:
+            handler.close_connection = True
+        handler.end_headers()
+        handler.stream = stream
+
+    async def _relay(self, handler, writer):
+        # Once the head is out an error can only be reported by closing the
+        # connection early.
+        stream = handler.stream
+        try:
+            async for data in stream.chunks():
+                if handler.chunked:
+                    writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                else:
+                    writer.write(data)
+                await writer.drain()
+            if handler.chunked:
+                writer.write(b"0\r\n\r\n")
+        except TRANSPORT_ERRORS:
+            handler.close_connection = True
+        finally:
+            stream.close()
+
+    async def _put_storage(self, handler, anode):
+        # Only bodies of up to STREAM_MIN_BYTES come here, read in full;
+        # larger ones are streamed by the handler's own put_storage.
+        key = handler.split_path(handler.path)[1]
+        value = handler.rfile.read()
+        try:
+            ttl = handler.extract_ttl(handler.path)
+        except ValueError:
+            handler.send_whole_response(400, "TTL must be a non-negative number of seconds")
+            return
+        result = await anode.put_key(key, value, ttl)
+        if result is None or result == False:
+            data = { "result": "Could not put data with key ({}) to the network.".format(key) }
+            handler.send_whole_response(404, data)
+        else:
+            data = { "result": "Value with key ({}) is stored to the network successfully.".format(key) }
+            handler.send_whole_response(200, data)
@@ -1,30 +1,60 @@
 #!/usr/bin/env python3
 
 import sys
+import base64
+import contextvars
 import http.client
 import json
 import time
 import threading
 import os
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from utility import *
+from address import split_vnode
+from connection import connectionPool
+from health import peerHealth
+from routecache import routeCache
 from finger import finger
-from hashing import hash_to_hex, consistent_hashing
+from metrics import metricsRegistry, histogram_samples
+from profiler import hotTimers, instrument
+from tracing import traceBuffer, traceSpan, span_tree, new_id, current
+from hashing import hash_to_hex, hex_to_identity, consistent_hashing
 from state import nodeState
+from stats import lookupStats, handoffProgress
+from storage import memoryStorage
+from streams import bodyReader
+import wire
 import configurations as configs
 
 class baseNode:
-    def __init__(self, address):
+    def __init__(self, address, pool=None, storage=None, wire_client=None):
         self._identity      = 0
         self._key            = None
         self._address       = address
         self._running       = True
         self._state         = nodeState.STABLE
-        self._storage       = {}
+        self._storage       = storage if storage is not None else memoryStorage()
         self._predecessor   = None
         self._fingerTable   = [None]*configs.M_BITS
-        self.__successors_stack  = []
+        self._successors    = []
         self.__predecessors_stack  = []
         self.__is_stable    = False
+        self._pool          = pool if pool is not None else connectionPool()
+        self._wire          = wire_client
+        self._health        = peerHealth()
+        self._lookup_stats  = lookupStats()
+        self._metrics       = metricsRegistry()
+        self._traces        = traceBuffer(address)
+        self._timings       = None
+        self._route_cache   = routeCache()
+        self._replicator    = ThreadPoolExecutor(max_workers=configs.REPLICATION_WORKERS,
+                                                 thread_name_prefix="replicator")
+        self._fanout        = ThreadPoolExecutor(max_workers=configs.BATCH_WORKERS,
+                                                 thread_name_prefix="fanout")
+        self._handoffs      = {}
+        self._handoff_lock  = threading.Lock()
+        self._last_handoff  = None
         #initial key for  node
         self._key = self._address.__hash__()
 
@@ -38,6 +68,7 @@ class baseNode:
 
     def dispose(self):
         self._running = False
+        self._storage.close()
 
     def getKeyHash(self, key):
         return consistent_hashing(key)
@@ -60,19 +91,26 @@ class baseNode:
     def get_storage(self, index=None):
         storage = self._storage
         if index:
-            try:
-                result = storage[index]
-                return result
-            except:
-                return None
+            return storage.get(index)
         return storage
 
-    def set_storage(self, key, value):
+    def set_storage(self, key, value, ttl=None):
         try:
-            self._storage[key]=value
-            return True
-        except:
+            stored = self._storage.put(key, value, ttl)
+        except OSError as e:
+            print("Could not store key {}: {}".format(key, e))
             return False
+        if self._handoffs:
+            self.handoffTouched(key)
+        return stored
+
+    def delete_storage(self, key):
+        return self._storage.delete(key)
+
+    def get_cache_stats(self):
+        # None unless the node runs in cache mode.
+        stats = getattr(self._storage, "cache_stats", None)
+        return stats() if stats else None
 
     def get_state(self):
         if(self._state == nodeState.STABLE):
@@ -90,6 +128,8 @@ class baseNode:
         return None
         
     def set_predecessor(self, value):
+        if not self._same_node(self._predecessor, value):
+            self._route_cache.clear()
         self._predecessor = value
 
     def get_successor(self):
@@ -100,15 +140,24 @@ class baseNode:
         
     def get_fingertable(self, index=None):
         fingers = self._fingerTable
+        if index is None:
+            return [f.serialize() if f != None else None for f in fingers]
         result = fingers[index]
         if (result !=None):
             return result.this()
         return None
 
     def set_fingertable(self, index, value):
+        if index == 0 and not self._same_node(self._fingerTable[0], value):
+            self._route_cache.clear()
         self._fingerTable[index]=value
         return
 
+    def _same_node(self, a, b):
+        if a is None or b is None:
+            return a is b
+        return a.get_identity() == b.get_identity()
+
     def get_node_info(self):
         succ = None
         pred = None
@@ -123,10 +172,60 @@ class baseNode:
                     "node_key": self.get_identity(),
                     "successor": succ,
                     "others": [pred],
+                    "successors": [str(s.get_address()) for s in self.get_successor_list()],
+                    "last_handoff": self._last_handoff,
+                    "storage": self._storage.serialize(),
                     "sim_crash": not self.get_state(),
                     }
         return node_info
 
+    def get_successor_list(self):
+        return list(self._successors)
+
+    def get_neighborhood(self):
+        pred = self.get_predecessor()
+        result = {
+            "predecessor": pred.serialize() if pred != None else None,
+            "successors": [s.serialize() for s in self.get_successor_list()],
+        }
+        return result
+
+    def update_successor_list(self, succ, remote_successors):
+        # Our list is the successor followed by the head of its own list,
+        # cut short where the ring wraps around to this node. It runs past
+        # SUCCESSOR_LIST_SIZE until it names REPLICATION_FACTOR - 1 physical
+        # nodes besides this one, as vnodes of one host may follow each other.
+        successors = [succ]
+        size = max(configs.SUCCESSOR_LIST_SIZE, configs.REPLICATION_FACTOR - 1)
+        own_host = split_vnode(self.get_address())[0]
+        hosts = set([split_vnode(succ.get_address())[0]]) - set([own_host])
+        for entry in remote_successors:
+            if entry.get_identity() == self.get_identity() or \
+                    (len(successors) >= size and len(hosts) >= configs.REPLICATION_FACTOR - 1):
+                break
+            successors.append(entry)
+            host_port = split_vnode(entry.get_address())[0]
+            if host_port != own_host:
+                hosts.add(host_port)
+        self._successors = successors
+
+    def failover_successor(self):
+        # Promote the first successor still believed alive. With none left
+        # this node is alone until someone notifies it.
+        failed = self.get_successor()
+        candidates = [s for s in self._successors
+                      if failed == None or s.get_identity() != failed.get_identity()]
+        for candidate in candidates:
+            if self._health.is_alive(candidate.get_address()):
+                print("Successor '{}' is not alive, failing over to '{}'.".format(
+                    failed.get_address() if failed != None else None, candidate.get_address()))
+                self._successors = candidates[candidates.index(candidate):]
+                self.set_fingertable(0, candidate)
+                return candidate
+        self._successors = []
+        self.set_fingertable(0, finger(str(self.get_address())))
+        return None
+
     def get_neighbors(self):
         succ = None
         pred = None
@@ -143,30 +242,232 @@ class baseNode:
         l = self.get_fingertable()
         return [str(x.get_address()) for x in l if x]
 
-    def check_address(self, address):
+    def _rpc(self, address, method, path, body=None, probe=False, timeout=None, headers=None, stream=False):
+        # Failure detection comes from the request itself: a transport error
+        # marks the peer dead, and peers known to be dead are not contacted
+        # again until the health table gives them another chance. Probes
+        # (stabilize, checkPredecessor) always go out and refresh the table.
+        address = str(address)
+        if not self.can_contact(address, probe):
+            return None
+        host_port, vnode_headers = self.rpc_target(address)
+        if vnode_headers:
+            headers = dict(headers or {}, **vnode_headers)
+        name = self.rpc_name(method, path)
+        labels = (("transport", "http"), ("rpc", name))
+        span = self.client_span(name, address)
+        if span is not None:
+            headers = dict(headers or {}, **span.headers())
+        started = time.perf_counter()
         try:
-            conn = http.client.HTTPConnection(address)
-            conn.request("GET", "/ping")
-            resp = conn.getresponse()
-            if resp.status == 200:
-                return True
-            return False
-        except (http.client.HTTPException):
-            return False
+            resp = self._pool.request(host_port, method, path, body, headers=headers,
+                                      timeout=timeout, stream=stream)
+        except (http.client.HTTPException, OSError):
+            self._pool.discard(host_port)
+            self.call_failed(address, labels, span)
+            return None
+        self.call_answered(address, labels, span, time.perf_counter() - started, resp.status)
+        return resp
+
+    def _call(self, address, op, payload=b"", probe=False, timeout=None):
+        # _rpc for ring maintenance over the binary protocol of wire.py.
+        # Returns the reply, None on a failure or an error status, or
+        # wire.UNAVAILABLE when the request has to go over HTTP instead.
+        if self._wire is None:
+            return wire.UNAVAILABLE
+        address = str(address)
+        if not self.can_contact(address, probe):
+            return None
+        host_port, vnode = split_vnode(address)
+        name = wire.OP_NAMES.get(op, str(op))
+        labels = (("transport", "wire"), ("rpc", name))
+        span = self.client_span("wire " + name, address)
+        if span is not None:
+            op |= wire.TRACED
+            payload = wire.pack_trace(span.trace_id, span.span_id) + payload
+        started = time.perf_counter()
+        try:
+            reply = self._wire.call(host_port, vnode, op, payload, timeout)
+        except wire.wireUnavailable:
+            return wire.UNAVAILABLE
+        except TimeoutError:
+            # Other requests on the connection may still be answered.
+            self.call_failed(address, labels, span)
+            return None
+        except OSError:
+            self._wire.discard(host_port)
+            self.call_failed(address, labels, span)
+            return None
+        self.call_answered(address, labels, span, time.perf_counter() - started,
+                           wire.STATUS_NAMES.get(reply.status, reply.status))
+        return reply if reply.status == wire.OK else None
+
+    def call_answered(self, address, labels, span, seconds, outcome):
+        # Accounts for an RPC the peer answered; labels are its metric
+        # labels and span its trace span, if any.
+        self._metrics.observe("chord_rpc_duration_seconds", seconds, labels)
+        if span is not None:
+            span.finish(outcome)
+        self.peer_answered(address)
+
+    def call_failed(self, address, labels, span):
+        self._metrics.inc("chord_rpc_failures_total", labels)
+        if span is not None:
+            span.finish("failed")
+        self.peer_failed(address)
+
+    def rpc_name(self, method, path):
+        # The RPC label of a request: its method and first path segment, so
+        # that keys and identifiers stay out of the metrics. POST paths carry
+        # no keys and are kept whole.
+        path = path.partition("?")[0]
+        if method != "POST":
+            path = "/" + path[1:].partition("/")[0]
+        return method + " " + path
+
+    def rpc_target(self, address):
+        # The process an RPC to address goes to, and the headers selecting
+        # the virtual node on it.
+        host_port, vnode = split_vnode(address)
+        headers = { "X-Vnode": str(vnode) } if vnode else None
+        return host_port, headers
+
+    def can_contact(self, address, probe=False):
+        return probe or self._health.is_alive(address)
+
+    def peer_failed(self, address):
+        self._health.mark_dead(address)
+        self.on_peer_failure(address)
+
+    def peer_answered(self, address):
+        self._health.mark_alive(address)
+
+    def on_peer_failure(self, address):
+        # A dead successor is replaced right away from the successor list;
+        # other fingers pointing at the failed peer are dropped until
+        # fixFingers refreshes them.
+        succ = self.get_successor()
+        if succ != None and str(succ.get_address()) == str(address) and \
+                succ.get_identity() != self.get_identity():
+            self.failover_successor()
+        for idx in range(1, configs.M_BITS):
+            entry = self._fingerTable[idx]
+            if entry != None and str(entry.get_address()) == str(address):
+                self.set_fingertable(idx, None)
+        self._route_cache.invalidate_address(address)
+
+    def get_lookup_stats(self):
+        result = self._lookup_stats.serialize()
+        result["route_cache"] = self._route_cache.serialize()
+        return result
+
+    def record_request(self, method, route, code, seconds):
+        self._metrics.inc("chord_http_requests_total", (("method", method), ("route", route), ("code", str(code))))
+        self._metrics.observe("chord_http_request_duration_seconds", seconds, (("method", method), ("route", route)))
+
+    def server_span(self, name, peer, trace_id=None, parent_id=None):
+        # The span of a request served by this node; a request that did not
+        # come with a trace starts one.
+        return traceSpan(self._traces, trace_id or new_id(), parent_id, "server", name, peer)
+
+    def client_span(self, name, address):
+        # The span of a call to a peer, or None outside a traced request.
+        parent = current()
+        if parent is None:
+            return None
+        return traceSpan(self._traces, parent.trace_id, parent.span_id, "client", name, address)
+
+    def get_traces(self, limit):
+        return { "node": str(self.get_address()), "traces": self._traces.recent(limit) }
+
+    def collectTrace(self, trace_id, follow=False):
+        # The spans of a trace recorded here and, following the client spans,
+        # on every peer the request went through.
+        spans = { span["span_id"]: span for span in self._traces.spans(trace_id) }
+        visited = { str(self.get_address()) }
+        pending = [span["peer"] for span in spans.values() if span["kind"] == "client"] if follow else []
+        while pending:
+            address = pending.pop()
+            if address in visited:
+                continue
+            visited.add(address)
+            resp = self._rpc(address, "GET", "/traces?trace=" + trace_id)
+            if resp is None or resp.status != 200:
+                continue
+            try:
+                remote = json.loads(resp.body)["spans"]
+            except (ValueError, KeyError):
+                continue
+            for span in remote:
+                spans.setdefault(span["span_id"], span)
+                if span["kind"] == "client":
+                    pending.append(span["peer"])
+        spans = span_tree(spans.values())
+        return { "trace_id": trace_id, "nodes": sorted({ span["node"] for span in spans }), "spans": spans }
+
+    def enable_timings(self):
+        # Opt-in: counts calls to and time spent in the routing hot path and
+        # in storage access.
+        if self._timings is None:
+            self._timings = hotTimers()
+            instrument(self._timings, self, ("findSuccessor", "closestPrecedingNode"))
+            instrument(self._timings, self._storage, ("get", "put", "delete"), "storage.")
+
+    def get_timings(self):
+        return None if self._timings is None else self._timings.serialize()
+
+    def record_timing(self, name, seconds):
+        # For the hot path functions of the asyncio engine, which cannot be
+        # wrapped by instrument(); does nothing unless timings are enabled.
+        if self._timings is not None:
+            self._timings.record(name, seconds)
+
+    def record_forward(self, kind):
+        self._metrics.inc("chord_forwards_total", (("kind", kind),))
+
+    def render_metrics(self, extra=()):
+        # The recorded metrics, plus the totals kept elsewhere in the node
+        # sampled now.
+        lookups, total_hops, hops = self._lookup_stats.histogram()
+        bounds = range(min(configs.M_BITS, configs.LOOKUP_MAX_HOPS) + 1)
+        counts = [hops.get(n, 0) for n in bounds]
+        counts.append(lookups - sum(counts))
+        samples = [("chord_lookups_total", (), lookups)]
+        samples += histogram_samples("chord_lookup_hops", (), bounds, counts, total_hops, lookups)
+        route_cache = self._route_cache.serialize()
+        samples.append(("chord_route_cache_hits_total", (), route_cache["hits"]))
+        samples.append(("chord_route_cache_misses_total", (), route_cache["misses"]))
+        samples.append(("chord_storage_keys", (), len(self._storage)))
+        cache = self.get_cache_stats()
+        if cache is not None:
+            samples.append(("chord_cache_bytes", (), cache["used_bytes"]))
+            samples.append(("chord_cache_hits_total", (), cache["hits"]))
+            samples.append(("chord_cache_misses_total", (), cache["misses"]))
+            for reason, count in cache["evictions"].items():
+                samples.append(("chord_cache_evictions_total", (("reason", reason),), count))
+        if self._timings is not None:
+            samples += self._timings.samples()
+        return self._metrics.render(samples + list(extra))
+
+    def check_address(self, address):
+        resp = self._rpc(address, "GET", "/ping", probe=True)
+        if resp is not None and resp.status == 200:
+            return True
+        return False
 
     def start_workers(self):
         if not self._fixFingers_thread.is_alive():
-            self._fixFingers_thread = threading.Thread(target=self.fixFingers)
+            self._fixFingers_thread = threading.Thread(target=self.fixFingers, name="fixFingers")
             self._fixFingers_thread.daemon = True
             self._fixFingers_thread.start()
 
         if not self._stabilize_thread.is_alive():
-            self._stabilize_thread = threading.Thread(target=self.stabilize)
+            self._stabilize_thread = threading.Thread(target=self.stabilize, name="stabilize")
             self._stabilize_thread.daemon = True
             self._stabilize_thread.start()
 
         if not self._checkPredecessor_thread.is_alive():
-            self._checkPredecessor_thread = threading.Thread(target=self.checkPredecessor)
+            self._checkPredecessor_thread = threading.Thread(target=self.checkPredecessor, name="checkPredecessor")
             self._checkPredecessor_thread.daemon = True
             self._checkPredecessor_thread.start()
 
@@ -194,37 +495,142 @@ class baseNode:
                 print("The remote address not found")
                 os._exit(1)
 
-            conn = http.client.HTTPConnection(address)
-            conn.request("GET", "/join/"+ str(self.get_identity()))
- 
-            resp = conn.getresponse()
+            resp = self._rpc(address, "GET", "/join/"+ str(self.get_identity()))
 
-            if resp.status != 200:
+            if resp is None or resp.status != 200:
                 self.set_fingertable(0, finger(self.get_address()))
             else:
-                value = resp.read()
-                json_data = json.loads(value)
+                json_data = json.loads(resp.body)
                 self.set_fingertable(0, finger(json_data['address']))
+                self.pullKeys(self.get_successor())
         else:
             self.set_fingertable(0, finger(self.get_address()))
         
         print(self.get_address().__str__() + " joined.")
         self.start_workers()
 
-    def findSuccessor(self, id):
-        succ = self.get_successor().get_identity()
-        inRange = inrange(int(id), self.get_identity(), succ)
-        if (inRange and \
-                (self.get_identity() != self.get_successor().get_identity()) and \
-                (int(id) != self.get_identity())):
+    def findSuccessor(self, id, mode=None):
+        result, hops, start = self.lookup(id, mode)
+        self.recordLookup(result, hops, start)
+        return result
 
-            return self.get_successor()
-        else:
-            remote = self.closestPrecedingNode(id)
-            if self.get_address().__hash__() != remote.get_address().__hash__():
-                return self.findSuccessorRemote(remote.get_address(), id)
+    def recordLookup(self, result, hops, start):
+        # Counts the hops of a finished lookup and remembers the owner's range.
+        self._lookup_stats.record(hops)
+        if result != None and start != None and \
+                result.get_identity() != self.get_identity():
+            self._route_cache.put(start, result)
+
+    def isResponsible(self, id):
+        # Whether id falls in (predecessor, self]; without a known predecessor
+        # this node cannot tell and accepts.
+        pred = self.get_predecessor()
+        if pred == None:
+            return True
+        return inrange_right(int(id), pred.get_identity(), self.get_identity())
+
+    def resolveOwner(self, id, use_cache=True):
+        # Returns the owner of id and whether it came from the routing cache.
+        if self.get_predecessor() != None and self.isResponsible(id):
+            return self.this(), False
+        if use_cache:
+            owner = self.cachedOwner(id)
+            if owner != None:
+                return owner, True
+        return self.findSuccessor(id), False
+
+    def cachedOwner(self, id):
+        return self._route_cache.get(id)
+
+    def invalidateRoute(self, id):
+        self._route_cache.invalidate(id)
+
+    def routeKey(self, id, local, remote):
+        # Runs local() when this node owns id, otherwise remote(address, check).
+        # A request sent over a cached route asks the owner to check it really
+        # owns the key; on a redirect, miss or failure the route is dropped and
+        # the request is retried once after a fresh lookup.
+        for use_cache in (True, False):
+            node, cached = self.resolveOwner(id, use_cache)
+            if node is None:
+                return None
+            if node.get_identity() == self.get_identity():
+                return local()
+            self.record_forward("storage")
+            result = remote(node.get_address(), cached)
+            if result is not None or not cached:
+                return result
+            self.invalidateRoute(id)
+        return None
+
+    def lookup(self, id, mode=None):
+        # mode is "recursive" or "iterative"; defaults to configs.LOOKUP_MODE.
+        if (mode or configs.LOOKUP_MODE) == "iterative":
+            return self.findSuccessorIterative(id)
+        return self.findSuccessorWithHops(id)
+
+    def lookupStep(self, id):
+        # One routing decision: (True, owner, start) when this node knows the
+        # successor of id, where (start, owner] is the owner's range if known,
+        # otherwise (False, next node to ask, None).
+        succ = self.get_successor()
+        if inrange_right(int(id), self.get_identity(), succ.get_identity()):
+            return True, succ, self.get_identity()
+
+        remote = self.closestPrecedingNode(id)
+        if self.get_address().__hash__() == remote.get_address().__hash__():
+            pred = self.get_predecessor()
+            return True, self.this(), pred.get_identity() if pred != None else None
+        return False, remote, None
+
+    def findSuccessorWithHops(self, id):
+        # Recursive lookup. Returns the successor of id together with the
+        # number of remote hops the lookup took. A finger that fails to answer
+        # is invalidated by _rpc, so the next attempt falls back to a closer finger.
+        for attempt in range(configs.M_BITS):
+            done, remote, start = self.lookupStep(id)
+            if done:
+                return remote, 0, start
+
+            self.record_forward("lookup")
+            result, hops, start = self.findSuccessorRemote(remote.get_address(), id)
+            if result != None:
+                return result, hops + 1, start
+            if remote.get_address().__hash__() == self.get_successor().get_address().__hash__():
+                break
+        return None, 0, None
+
+    def findSuccessorIterative(self, id):
+        # Iterative lookup: this node asks every hop for its next step and
+        # carries on itself, so no remote handler thread waits on another node.
+        hops = 0
+        done, remote, start = self.lookupStep(id)
+        while not done:
+            if hops >= configs.LOOKUP_MAX_HOPS:
+                return None, hops, None
+            hops += 1
+            step = self.findNextRemote(remote.get_address(), id)
+            if step is None:
+                # The failed hop has been invalidated; restart from our own table.
+                done, remote, start = self.lookupStep(id)
             else:
-                return self.this()
+                done, remote, start = step
+        return remote, hops, start
+
+    def findNextRemote(self, address, id):
+        try:
+            reply = self._call(address, wire.FIND_NEXT, wire.pack_id(id), timeout=configs.LOOKUP_HOP_TIMEOUT)
+            if reply is not wire.UNAVAILABLE:
+                if reply is None:
+                    return None
+                return bool(reply.u8()), finger(reply.address()).this(), reply.id()
+            resp = self._rpc(address, "GET", "/findnext/" + str(id), timeout=configs.LOOKUP_HOP_TIMEOUT)
+            if resp is None or resp.status != 200:
+                return None
+            json_data = json.loads(resp.body)
+            return json_data['done'], finger(json_data['address']).this(), json_data.get('start')
+        except (ValueError, KeyError):
+            return None
 
     def closestPrecedingNode(self, id):
         for idx in reversed(range(configs.M_BITS)):
@@ -238,31 +644,47 @@ class baseNode:
         return self.this()
 
     def findSuccessorRemote(self, address, id):
-        if (self.check_address(str(address)) == False):
-            return None
-
         try:
-            conn = http.client.HTTPConnection(address)
-            conn.request("GET", "/findsuccessor/" + str(id))
-            resp = conn.getresponse()
-            conn.close()
-            if resp.status != 200:
-                return None
-            value = resp.read()
-            json_data = json.loads(value)
-            return finger(json_data['address']).this()
+            reply = self._call(address, wire.FIND_SUCCESSOR, wire.pack_id(id))
+            if reply is not wire.UNAVAILABLE:
+                if reply is None:
+                    return None, 0, None
+                return finger(reply.address()).this(), reply.u16(), reply.id()
+            resp = self._rpc(address, "GET", "/findsuccessor/" + str(id))
+            if resp is None or resp.status != 200:
+                return None, 0, None
+            json_data = json.loads(resp.body)
+            return finger(json_data['address']).this(), json_data.get('hops', 0), json_data.get('start')
         except:
-            return None
+            return None, 0, None
 
     def fixFingers(self):
+        # Finger 0 is the successor and is maintained by stabilize.
         i = 0
         while self._running:
-            i = i + 1
-            if i > configs.M_BITS:
-                i = 1
-            #self.set_fingertable(i - 1, self.findSuccessor(self.get_identity(2**(i-1))))
+            if configs.FIX_FINGERS_MODE == "all":
+                budget = configs.M_BITS - 1
+            else:
+                budget = min(configs.FIX_FINGERS_BUDGET, configs.M_BITS - 1)
+            for _ in range(budget):
+                i = i + 1
+                if i >= configs.M_BITS:
+                    i = 1
+                self.fix_finger(i)
             time.sleep(configs.INTERVAL)
 
+    def fix_finger(self, index):
+        start = self.get_identity(2**index)
+        previous = self.get_fingertable(index - 1)
+        # If the start of this finger still falls before the previous finger
+        # there is no need for a lookup; on a sparse ring most fingers collapse
+        # onto the same few nodes.
+        if previous != None and inrange_right(start, self.get_identity(), previous.get_identity()):
+            self.set_fingertable(index, previous)
+            return
+        result, _, _ = self.lookup(start)
+        self.set_fingertable(index, result)
+
     def stabilize(self):
         while self._running:
             # if (self.get_predecessor() != None and self.get_successor() != None):
@@ -279,11 +701,22 @@ class baseNode:
 
             print("\n")
 
+            started = time.perf_counter()
             suc = self.get_successor()
             if (suc.get_identity() == self.get_identity() and self.get_predecessor() != None):
                 self.set_fingertable(0, self.get_predecessor())
+            elif suc.get_identity() == self.get_identity():
+                self._successors = []
+                self.__is_stable = True
             else:
-                x = self.findPredecessorRemote(suc.get_address())
+                # One call fetches both the successor's predecessor and its
+                # successor list. A failed call has already failed over.
+                x = None
+                neighborhood = self.getNeighborhoodRemote(suc.get_address())
+                if neighborhood != None:
+                    x, successors = neighborhood
+                    self.update_successor_list(suc, successors)
+                suc = self.get_successor()
                 if x != None and \
                         inrange(x.get_identity(), self.get_identity(), suc.get_identity()) and \
                         (self.get_identity() != suc.get_identity()) and \
@@ -295,38 +728,36 @@ class baseNode:
                     self.__is_stable = True
 
             self.successor_notify(self.get_address())
+            self._metrics.observe("chord_stabilize_duration_seconds", time.perf_counter() - started)
             time.sleep(configs.INTERVAL)
 
-    def findPredecessorRemote(self,address):
-        if (self.check_address(str(address)) == False):
-            return None
-            
+    def getNeighborhoodRemote(self, address):
         try:
-            conn = http.client.HTTPConnection(str(address))
-            conn.request("GET", "/findpredecessor")
-            resp = conn.getresponse()
-            conn.close()
-            if resp.status != 200:
+            reply = self._call(address, wire.NEIGHBORHOOD, probe=True)
+            if reply is not wire.UNAVAILABLE:
+                if reply is None:
+                    return None
+                pred = reply.address()
+                pred = finger(pred).this() if pred != None else None
+                return pred, [finger(reply.address()).this() for _ in range(reply.u8())]
+            resp = self._rpc(address, "GET", "/neighborhood", probe=True)
+            if resp is None or resp.status != 200:
                 return None
-            value = resp.read()
-            json_data = json.loads(value)
-            return finger(json_data['address']).this()
-        except (http.client.HTTPException):
+            json_data = json.loads(resp.body)
+            pred = json_data['predecessor']
+            pred = finger(pred['address']).this() if pred != None else None
+            return pred, [finger(s['address']).this() for s in json_data['successors']]
+        except (ValueError, KeyError, TypeError):
             return None
 
     def successor_notify(self, address):
-        if (self.check_address(str(address)) == False):
-            return
-
-        conn = http.client.HTTPConnection(str(self.get_successor().get_address()))
-        conn.request("POST", "/notify", str(self.get_address()))
-        conn.close()
+        succ = self.get_successor().get_address()
+        if self._call(succ, wire.NOTIFY, wire.pack_address(address), probe=True) is wire.UNAVAILABLE:
+            self._rpc(succ, "POST", "/notify", str(address), probe=True)
 
     def notify(self, remote):
-
-        if (self.check_address(str(remote)) == False):
-            return
-
+        # The remote has just contacted us, so there is no need to ping it back.
+        self._health.mark_alive(remote)
         remote_finger = finger(str(remote))
         if (self.get_predecessor() == None or self.get_predecessor().get_identity() == self.get_identity()) or \
                 ((inrange(remote_finger.get_identity(), self.get_predecessor().get_identity(), self.get_identity())) and \
@@ -336,6 +767,7 @@ class baseNode:
 
             self.set_predecessor(remote_finger.this())
             self.__is_stable = False
+            self.handoffAccepted(remote_finger.get_identity(), str(remote))
         else:
             self.__is_stable = True
 
@@ -349,91 +781,270 @@ class baseNode:
             time.sleep(configs.INTERVAL)
 
     def sendPing(self, remote):
-        try:
-            conn = http.client.HTTPConnection(str(remote))
-            conn.request("GET", "/ping")
-            resp = conn.getresponse()
-            conn.close()
-            if resp.status != 200:
-                return False
-            else:
-                return True
-        except (http.client.HTTPException):
+        reply = self._call(remote, wire.PING, probe=True)
+        if reply is not wire.UNAVAILABLE:
+            return reply is not None
+        resp = self._rpc(remote, "GET", "/ping", probe=True)
+        if resp is None or resp.status != 200:
             return False
+        else:
+            return True
 
     def ping(self):
         return True
 
-    def insertLocalKeyVal(self, key, value):
+    def insertLocalKeyVal(self, key, value, ttl=None):
         hash_key = hash_to_hex(key)
-        return self.set_storage(hash_key, value)
+        return self.set_storage(hash_key, value, ttl)
 
-    def putKeyValue(self, key, value):
+    def getLocalKey(self, key):
+        hash_key = hash_to_hex(key)
+        return self.get_storage(hash_key)
+
+    def get_replica_targets(self):
+        # The next REPLICATION_FACTOR - 1 physical nodes among the successors
+        # hold copies of our range. Further vnodes of this node's host, or of
+        # a host already chosen, would only put a second copy on one machine.
+        targets = []
+        hosts = set([split_vnode(self.get_address())[0]])
+        for succ in self.get_successor_list():
+            if len(targets) >= configs.REPLICATION_FACTOR - 1:
+                break
+            host_port = split_vnode(succ.get_address())[0]
+            if host_port in hosts:
+                continue
+            hosts.add(host_port)
+            targets.append(succ)
+        return targets
+
+    def storeKeyValue(self, key, value, ttl=None):
+        # Stores a key this node owns and replicates it to its successors.
+        if not self.insertLocalKeyVal(key, value, ttl):
+            return False
+        return self.replicate(self.sendReplica, key, value, ttl)
+
+    def replicate(self, send, *args):
+        # Runs send(address, *args) for every replica target. Returns once
+        # WRITE_QUORUM copies (this one included) are written; the remaining
+        # replicas complete in the background.
+        targets = self.get_replica_targets()
+        needed = min(configs.WRITE_QUORUM, len(targets) + 1) - 1
+        # Each copy is sent under the trace of the request that wrote it.
+        futures = [self._replicator.submit(contextvars.copy_context().run, send, t.get_address(), *args)
+                   for t in targets]
+        if needed <= 0:
+            return True
+        acks = 0
+        for future in as_completed(futures):
+            if future.result():
+                acks += 1
+                if acks >= needed:
+                    return True
+        return False
+
+    def sendReplica(self, address, key, value, ttl=None):
+        resp = self._rpc(address, "PUT", self.storagePath("/replica-storage/", key, ttl=ttl), value)
+        return resp is not None and resp.status == 200
+
+    def storagePath(self, route, key, check=False, ttl=None):
+        # route + key, with the ownership check and TTL as query parameters.
+        query = []
+        if check:
+            query.append("check=1")
+        if ttl:
+            query.append("ttl=%g" % ttl)
+        return route + key + ("?" + "&".join(query) if query else "")
+
+    def putKeyValue(self, key, value, ttl=None):
+        # One resolve, then one data hop straight to the owner, which stores
+        # the value without routing it again and replicates it.
         hashkey = self.getKeyHash(key)
-        node = self.findSuccessor(hashkey)
-        if node.get_identity() == self.get_identity():
-            return self.insertLocalKeyVal(key, value)
-        else:
-            #if self.get_successor():
-            return self.sendPutKeyValue_remote(self.get_successor().get_address(), key, value)
-            #else:
-             #   return None
-
-    def sendPutKeyValue_remote(self, address, key, value):
-        if (self.check_address(str(address)) == False):
+        return self.routeKey(hashkey,
+                lambda: self.storeKeyValue(key, value, ttl),
+                lambda address, check: self.sendPutKeyValue_remote(address, key, value, check, ttl))
+
+    def putKeyStream(self, key, body, ttl=None):
+        # putKeyValue for a value relayed to its owner as it arrives, body
+        # being a streams.bodyReader. It can only be sent once, so the owner
+        # comes from a fresh lookup: a cached route could need a retry.
+        node, _ = self.resolveOwner(self.getKeyHash(key), use_cache=False)
+        if node is None:
             return None
-
-        conn = http.client.HTTPConnection(str(address))
-        conn.request("PUT", "/storage/"+key, value)
-        resp = conn.getresponse()
-        conn.close()
+        if node.get_identity() == self.get_identity():
+            return self.storeKeyValue(key, body.read(), ttl)
+        return self.sendPutKeyValue_remote(node.get_address(), key, body, False, ttl)
+
+    def sendPutKeyValue_remote(self, address, key, value, check=False, ttl=None):
+        path = self.storagePath("/local-storage/", key, check, ttl)
+        headers = None
+        if isinstance(value, bodyReader):
+            # Without a length the value goes out with chunked encoding.
+            if value.length is not None:
+                headers = { "Content-Length": str(value.length) }
+            value = value.chunks()
+        resp = self._rpc(address, "PUT", path, value, headers=headers)
         result = None
-        if resp.status == 200:
-            result = resp.read()
+        if resp is not None and resp.status == 200:
+            self.learn_replicas(address, resp)
+            result = resp.body
         return result
 
-    def getKey(self, key):
+    def learn_replicas(self, address, resp):
+        replicas = resp.getheader("X-Replicas")
+        if replicas:
+            self._route_cache.set_replicas(address, replicas.split(","))
+
+    def getKey(self, key, stream=False):
+        # With stream, a value read from another node is returned as a
+        # connection.responseStream to relay instead of being read whole.
         hashkey = self.getKeyHash(key)
-        node = self.findSuccessor(hashkey)
-        if (node.get_identity() == self.get_identity()):
-            hash_key = hash_to_hex(key)
-            value = self.get_storage(hash_key)
-            return value
-        else:
-            if self.get_successor():
-                return self.lookUpKey(key)
+        return self.routeKey(hashkey,
+                lambda: self.getLocalKey(key),
+                lambda address, check: self.readKey(address, key, check, stream))
+
+    def readKey(self, owner, key, check=False, stream=False):
+        # Reads from the owner, or from a random copy when READ_FROM_REPLICAS
+        # is set. A copy that cannot answer is skipped for the next one; a 404
+        # from the owner is authoritative.
+        owner = str(owner)
+        for address in self.readOrder(owner):
+            if address == owner:
+                resp = self._rpc(address, "GET", "/local-storage/" + key + ("?check=1" if check else ""),
+                                 stream=stream)
             else:
+                resp = self._rpc(address, "GET", "/replica-storage/" + key, stream=stream)
+            if resp is None or resp.status >= 500:
+                continue
+            if address == owner:
+                self.learn_replicas(address, resp)
+            if resp.status == 200:
+                return resp.body
+            if address == owner:
                 return None
+        return None
 
-    def lookUpKey(self, key):
-        succ_address= self.get_successor().get_address()
-        conn = http.client.HTTPConnection(str(succ_address))
-        conn.request("GET", "/storage/" + key)
-        resp = conn.getresponse()
-        conn.close()
-        if resp.status != 200:
+    def readOrder(self, owner):
+        # The owner and the replicas it reported, in the order to read them.
+        order = [owner] + self._route_cache.get_replicas(owner)
+        if configs.READ_FROM_REPLICAS:
+            random.shuffle(order)
+        return order
+
+    def groupByOwner(self, keys):
+        # Maps the owner address of each key to (local, check, keys). The
+        # route cache is filled by the first lookup into a range, so keys
+        # sharing an owner mostly resolve without another lookup.
+        groups = {}
+        unresolved = []
+        for key in keys:
+            node, cached = self.resolveOwner(self.getKeyHash(key))
+            if node is None:
+                unresolved.append(key)
+                continue
+            address = str(node.get_address())
+            local = node.get_identity() == self.get_identity()
+            _, check, group = groups.setdefault(address, (local, cached, []))
+            if cached and not check:
+                groups[address] = (local, True, group)
+            group.append(key)
+        return groups, unresolved
+
+    def multiGet(self, keys):
+        # Returns {key: value or None}. One sub-batch goes to each owner, in
+        # parallel; keys an owner turned away or could not serve are read
+        # again one by one through the usual single key path.
+        groups, retry = self.groupByOwner(keys)
+        futures = {}
+        for address, (local, check, group) in groups.items():
+            if local:
+                future = self._fanout.submit(contextvars.copy_context().run, self.getLocalKeys, group)
+            else:
+                future = self._fanout.submit(contextvars.copy_context().run, self.readKeys, address, group, check)
+            futures[future] = group
+        results = {}
+        for future in as_completed(futures):
+            found = future.result() or {}
+            results.update(found)
+            retry.extend(k for k in futures[future] if k not in found)
+        for key in retry:
+            self.invalidateRoute(self.getKeyHash(key))
+            results[key] = self.getKey(key)
+        return results
+
+    def getLocalKeys(self, keys):
+        return { key: self.getLocalKey(key) for key in keys }
+
+    def readKeys(self, address, keys, check=False):
+        # Returns the keys the owner answered for, or None when it failed.
+        body = json.dumps({ "keys": keys, "check": check })
+        resp = self._rpc(address, "POST", "/local-storage/_mget", body)
+        if resp is None or resp.status != 200:
             return None
-        else:
-            value = resp.read()
-            return value
+        self.learn_replicas(address, resp)
+        json_data = json.loads(resp.body)
+        return { key: None if value is None else base64.b64decode(value)
+                 for key, value in json_data['items'].items() }
+
+    def multiPut(self, items, ttl=None):
+        # Stores {key: value} and returns the keys that could not be stored.
+        # Grouped and retried like multiGet.
+        groups, retry = self.groupByOwner(list(items))
+        futures = {}
+        for address, (local, check, group) in groups.items():
+            batch = { key: items[key] for key in group }
+            if local:
+                future = self._fanout.submit(contextvars.copy_context().run, self.storeBatch, batch, ttl)
+            else:
+                future = self._fanout.submit(contextvars.copy_context().run, self.sendPutKeys_remote,
+                                             address, batch, check, ttl)
+            futures[future] = group
+        failed = []
+        for future in as_completed(futures):
+            stored = future.result()
+            if stored is True:
+                continue
+            retry.extend(k for k in futures[future] if not stored or k not in stored)
+        for key in retry:
+            self.invalidateRoute(self.getKeyHash(key))
+            if not self.putKeyValue(key, items[key], ttl):
+                failed.append(key)
+        return failed
+
+    def storeBatch(self, items, ttl=None):
+        # storeKeyValue for many keys owned by this node, replicated as one
+        # batch per replica.
+        for key, value in items.items():
+            if not self.insertLocalKeyVal(key, value, ttl):
+                return False
+        return self.replicate(self.sendReplicaBatch, items, ttl)
+
+    def sendReplicaBatch(self, address, items, ttl=None):
+        encoded = { key: base64.b64encode(value).decode() for key, value in items.items() }
+        body = json.dumps({ "items": encoded, "ttl": ttl })
+        resp = self._rpc(address, "POST", "/replica-storage/_mput", body)
+        return resp is not None and resp.status == 200
+
+    def sendPutKeys_remote(self, address, items, check=False, ttl=None):
+        # Returns the keys the owner stored, or None when it failed.
+        encoded = { key: base64.b64encode(value).decode() for key, value in items.items() }
+        body = json.dumps({ "items": encoded, "check": check, "ttl": ttl })
+        resp = self._rpc(address, "POST", "/local-storage/_mput", body)
+        if resp is None or resp.status != 200:
+            return None
+        self.learn_replicas(address, resp)
+        return set(json.loads(resp.body)['stored'])
 
     def inform_predecessor(self):
         address = str(self.get_predecessor().get_address())
-        if (self.check_address(str(address)) == False):
-            return
-
-        conn = http.client.HTTPConnection(address)
-        conn.request("POST", "/informPredecessor", str(self.get_successor().get_address()))
-        conn.close()
+        succ = self.get_successor().get_address()
+        if self._call(address, wire.INFORM_PREDECESSOR, wire.pack_address(succ)) is wire.UNAVAILABLE:
+            self._rpc(address, "POST", "/informPredecessor", str(succ))
 
     def inform_successor(self):
         address = str(self.get_successor().get_address())
-        if (self.check_address(str(address)) == False):
-            return
-
-        conn = http.client.HTTPConnection(address)
-        conn.request("POST", "/informSuccessor", str(self.get_predecessor().get_address()))
-        conn.close()
+        pred = self.get_predecessor().get_address()
+        if self._call(address, wire.INFORM_SUCCESSOR, wire.pack_address(pred)) is wire.UNAVAILABLE:
+            self._rpc(address, "POST", "/informSuccessor", str(pred))
 
     def changePredecessor(self, address):
         pred_node = finger(str(address))
@@ -443,16 +1054,164 @@ class baseNode:
         succ_node = finger(str(address))
         self.set_fingertable(0,succ_node)
 
-    def put_data(self, address, key, value):
-        conn = http.client.HTTPConnection(str(address))
-        conn.request("PUT", "/storage/"+key, value)
-        conn.close()
+    def pullKeys(self, succ):
+        # On join: pull, in batches, the keys our successor no longer owns now
+        # that we sit in front of it. It keeps serving them, and hands over
+        # the ones written meanwhile, until our first notify reaches it.
+        if succ == None or succ.get_identity() == self.get_identity():
+            return
+        progress = handoffProgress("pull", succ.get_address())
+        offset = 0
+        while offset != None:
+            request = { "identity": self.get_identity(), "offset": offset }
+            resp = self._rpc(succ.get_address(), "POST", "/handoff/pull", json.dumps(request))
+            if resp is None or resp.status != 200:
+                print("Handoff from {} failed.".format(succ.get_address()))
+                break
+            json_data = json.loads(resp.body)
+            size = 0
+            for item in json_data['items']:
+                value = base64.b64decode(item[1])
+                self.set_storage(item[0], value, *item[2:])
+                size += len(value)
+            progress.add(len(json_data['items']), size)
+            offset = json_data['next']
+        else:
+            self._rpc(succ.get_address(), "POST", "/handoff/release",
+                      json.dumps({ "identity": self.get_identity() }))
+        self._last_handoff = progress.finish()
+
+    def handoffBatch(self, identity, offset):
+        # Serves one batch of a pull. The key set is snapshotted when the
+        # pull starts; values are read as each batch goes out.
+        identity = int(identity)
+        with self._handoff_lock:
+            if offset == 0 or identity not in self._handoffs:
+                keys = [k for k in list(self.get_storage().keys())
+                        if not inrange_right(hex_to_identity(k), identity, self.get_identity())]
+                self._handoffs[identity] = { "keys": keys, "dirty": set(), "pulled": False, "accepted": False }
+            keys = self._handoffs[identity]["keys"]
+        items = []
+        for hash_key in keys[offset:offset + configs.HANDOFF_BATCH_SIZE]:
+            value = self.get_storage(hash_key)
+            if value is not None and not self.expired(hash_key):
+                items.append(self.handoffItem(hash_key, value))
+        end = offset + configs.HANDOFF_BATCH_SIZE
+        result = { "items": items, "next": end if end < len(keys) else None, "total": len(keys) }
+        return result
+
+    def handoffTouched(self, hash_key):
+        # A key in the range being handed over that is written before the
+        # handoff completes has to reach the new node again.
+        with self._handoff_lock:
+            for identity, handoff in self._handoffs.items():
+                if not inrange_right(hex_to_identity(hash_key), identity, self.get_identity()):
+                    handoff["dirty"].add(hash_key)
+
+    def handoffRelease(self, identity):
+        # The new node has every batch. We go on owning the keys until it
+        # is our predecessor; see handoffAccepted.
+        identity = int(identity)
+        with self._handoff_lock:
+            handoff = self._handoffs.get(identity)
+            if handoff is not None:
+                handoff["pulled"] = True
+        pred = self.get_predecessor()
+        if pred != None and pred.get_identity() == identity:
+            self.handoffAccepted(identity, str(pred.get_address()))
+
+    def handoffAccepted(self, identity, address):
+        # notify made the node that pulled from us our predecessor: from now
+        # on it owns the keys. Peers that still route its range to us are
+        # given HANDOFF_GRACE seconds to catch up; then it gets the keys
+        # written since the pull started, and we drop our copies.
+        with self._handoff_lock:
+            handoff = self._handoffs.get(identity)
+            if handoff is None or not handoff["pulled"] or handoff["accepted"]:
+                return
+            handoff["accepted"] = True
+        timer = threading.Timer(configs.HANDOFF_GRACE, self.finishHandoff, (identity, address))
+        timer.daemon = True
+        timer.start()
+
+    def finishHandoff(self, identity, address):
+        with self._handoff_lock:
+            handoff = self._handoffs.pop(identity, None)
+        if handoff is None:
+            return
+        dirty = list(handoff["dirty"])
+        progress = handoffProgress("delta", address)
+        for start in range(0, len(dirty), configs.HANDOFF_BATCH_SIZE):
+            items = []
+            size = 0
+            for hash_key in dirty[start:start + configs.HANDOFF_BATCH_SIZE]:
+                value = self.get_storage(hash_key)
+                if value is not None and not self.expired(hash_key):
+                    items.append(self.handoffItem(hash_key, value))
+                    size += len(value)
+            resp = self._rpc(address, "POST", "/handoff/push", json.dumps({ "items": items }))
+            if resp is None or resp.status != 200:
+                # Keep every key: the new node may not have them all.
+                print("Handoff to {} failed.".format(address))
+                return
+            progress.add(len(items), size)
+        progress.finish()
+        # Without replication the keys moved to the new node; with it we stay
+        # one of their replicas and keep them.
+        if configs.REPLICATION_FACTOR > 1:
+            return
+        for hash_key in set(handoff["keys"]) | handoff["dirty"]:
+            if not inrange_right(hex_to_identity(hash_key), identity, self.get_identity()):
+                self.delete_storage(hash_key)
+
+    def pushKeys(self, succ):
+        # On leave: hand every key to our successor, in batches.
+        if succ == None or succ.get_identity() == self.get_identity():
+            return
+        progress = handoffProgress("push", succ.get_address())
+        keys = list(self.get_storage().keys())
+        for start in range(0, len(keys), configs.HANDOFF_BATCH_SIZE):
+            batch = keys[start:start + configs.HANDOFF_BATCH_SIZE]
+            items = []
+            size = 0
+            for hash_key in batch:
+                value = self.get_storage(hash_key)
+                if value is not None and not self.expired(hash_key):
+                    items.append(self.handoffItem(hash_key, value))
+                    size += len(value)
+            resp = self._rpc(succ.get_address(), "POST", "/handoff/push", json.dumps({ "items": items }))
+            if resp is None or resp.status != 200:
+                print("Handoff to {} failed.".format(succ.get_address()))
+                break
+            if not self._storage.persistent:
+                # A persistent node keeps its copy, so it comes back with its
+                # data after a restart; the pull on rejoining refreshes it.
+                for hash_key in batch:
+                    self.delete_storage(hash_key)
+            progress.add(len(items), size)
+        self._last_handoff = progress.finish()
+
+    def expired(self, hash_key):
+        return self._storage.ttl(hash_key) == 0
+
+    def handoffItem(self, hash_key, value):
+        # [key, base64 value], plus the seconds it has left when it expires.
+        item = [hash_key, base64.b64encode(value).decode()]
+        ttl = self._storage.ttl(hash_key)
+        if ttl is not None:
+            item.append(ttl)
+        return item
+
+    def handoffStore(self, items):
+        for item in items:
+            if not self.set_storage(item[0], base64.b64decode(item[1]), *item[2:]):
+                return False
+        return True
 
     def leave(self):
         self.stop_workers()
         self.inform_predecessor()
         self.inform_successor()
-        # for key, value in self.get_storage():
-        #     self.put_data(self.get_successor().get_address(), key, value)
+        self.pushKeys(self.get_successor())
         self.set_predecessor(finger(str(self.get_address())))
         self.set_fingertable(0,finger(str(self.get_address())))
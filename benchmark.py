@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import argparse
+import http.client
+import random
+import threading
+import time
+import tracemalloc
+import configurations as configs
+import hashing
+from address import nodeAddress
+from baseNode import baseNode
+from finger import finger
+from keyindex import keyIndex
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return (time.perf_counter() - start) / iterations
+
+def bench_hashing(args):
+    hashing.configure(args.m_bits, args.hash)
+    # A node with a full finger table, no network: every lookupStep only pays
+    # for identifier hashing and range arithmetic.
+    node = baseNode(nodeAddress("10.0.0.1:{}".format(configs.DEFAULT_PORT)))
+    for idx in range(configs.M_BITS):
+        node.set_fingertable(idx, finger(nodeAddress("10.0.{}.{}:{}".format(idx // 250, idx % 250 + 2, configs.DEFAULT_PORT))))
+    keys = ["bench-key-{}".format(i) for i in range(args.keys)]
+
+    def lookup(i):
+        node.lookupStep(node.getKeyHash(keys[i % len(keys)]))
+
+    def rebuild(i):
+        finger(str(node.get_fingertable(i % configs.M_BITS).get_address())).get_identity()
+
+    lookup_cost = timed(lookup, args.iterations)
+    rebuild_cost = timed(rebuild, args.iterations)
+    print("M_BITS={} keys={} iterations={}".format(configs.M_BITS, len(keys), args.iterations))
+    print("lookupStep + key hash : {:8.2f} us/lookup".format(lookup_cost * 1e6))
+    print("finger from address   : {:8.2f} us/finger".format(rebuild_cost * 1e6))
+
+def measured(build):
+    # Returns what build() returns and the bytes of Python objects it left
+    # allocated.
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, size
+
+def bench_keyindex(args):
+    # The storage index as a dict of hex digests to (segment, offset, length)
+    # tuples against keyIndex over binary digests.
+    hashing.configure(hashing.digest_bits(args.hash), args.hash)
+    digests = [hashing.HASH_FUNCTIONS[args.hash]("bench-key-{}".format(i).encode()).digest()
+               for i in range(args.keys)]
+
+    def build_dict():
+        return { d.hex(): (i % 64, i * 100, 100) for i, d in enumerate(digests) }
+
+    def build_index():
+        index = keyIndex(len(digests[0]), width=2)
+        for i, d in enumerate(digests):
+            index.put(d, ((i % 64) << 40 | i * 100, 100))
+        return index
+
+    table, dict_bytes = measured(build_dict)
+    index = build_index()
+    index_bytes = index.nbytes()
+    probes = [random.choice(digests) for i in range(args.iterations)]
+    hex_probes = [d.hex() for d in probes]
+
+    dict_cost = timed(lambda i: table.get(hex_probes[i]), args.iterations)
+    index_cost = timed(lambda i: index.get(probes[i]), args.iterations)
+    storage_cost = timed(lambda i: index.get(bytes.fromhex(hex_probes[i])), args.iterations)
+    print("hash={} keys={} iterations={}".format(args.hash, len(digests), args.iterations))
+    print("dict of hex digests   : {:8.1f} bytes/key {:12,.0f} lookups/s".format(
+        dict_bytes / len(digests), 1 / dict_cost))
+    print("keyIndex              : {:8.1f} bytes/key {:12,.0f} lookups/s".format(
+        index_bytes / len(digests), 1 / index_cost))
+    print("keyIndex from hex key : {:8.1f} bytes/key {:12,.0f} lookups/s".format(
+        index_bytes / len(digests), 1 / storage_cost))
+
+def bench_rps(args):
+    # GET /storage/<key> on a running node from several keep-alive
+    # connections, each in its own thread.
+    host, port = args.address.rsplit(":", 1)
+    keys = ["bench-key-{}".format(i) for i in range(args.keys)]
+    conn = http.client.HTTPConnection(host, int(port))
+    for key in keys:
+        conn.request("PUT", "/storage/" + key, b"v" * args.value_bytes)
+        conn.getresponse().read()
+    conn.close()
+
+    counts = [0] * args.clients
+    errors = [0] * args.clients
+    deadline = time.perf_counter() + args.seconds
+
+    def client(n):
+        conn = http.client.HTTPConnection(host, int(port))
+        i = n
+        while time.perf_counter() < deadline:
+            conn.request("GET", "/storage/" + keys[i % len(keys)])
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status == 200:
+                counts[n] += 1
+            else:
+                errors[n] += 1
+            i += args.clients
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print("{} clients={} keys={} value={}B seconds={:.1f}".format(
+        args.address, args.clients, len(keys), args.value_bytes, elapsed))
+    print("GET /storage          : {:12,.0f} requests/s {:8} errors".format(sum(counts) / elapsed, sum(errors)))
+
+def arg_parser():
+    parser = argparse.ArgumentParser(prog="benchmark", description="DHT node microbenchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    hashing = sub.add_parser("hashing", help="identifier hashing cost per lookup")
+    hashing.add_argument("--m-bits", type=int, default=32,
+            help="identifier space width, default 32")
+    hashing.add_argument("--hash", default=configs.HASH_FUNCTION,
+            help="ring hash function, default %s" % configs.HASH_FUNCTION)
+    hashing.add_argument("--iterations", type=int, default=100000)
+    hashing.add_argument("--keys", type=int, default=1000,
+            help="distinct keys looked up, default 1000")
+    hashing.set_defaults(func=bench_hashing)
+
+    index = sub.add_parser("keyindex", help="storage key index memory and lookup speed")
+    index.add_argument("--hash", default=configs.HASH_FUNCTION,
+            help="hash function producing the digests, default %s" % configs.HASH_FUNCTION)
+    index.add_argument("--keys", type=int, default=1000000,
+            help="keys in the index, default 1000000")
+    index.add_argument("--iterations", type=int, default=1000000)
+    index.set_defaults(func=bench_keyindex)
+
+    rps = sub.add_parser("rps", help="GET /storage requests per second against a running node")
+    rps.add_argument("address", help="host:port of the node")
+    rps.add_argument("--clients", type=int, default=4,
+            help="concurrent keep-alive connections, default 4")
+    rps.add_argument("--seconds", type=float, default=5)
+    rps.add_argument("--keys", type=int, default=100,
+            help="distinct keys read, default 100")
+    rps.add_argument("--value-bytes", type=int, default=100)
+    rps.set_defaults(func=bench_rps)
+
+    return parser
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    args.func(args)
@@ -4,10 +4,72 @@
 #--------------------------------------------------------------------------------
 #KEY                        VALUE               DESCRIPTION
 #--------------------------------------------------------------------------------
-M_BITS                      = 2
+M_BITS                      = 2                 # identifier bits, at most the digest size of HASH_FUNCTION
 DHT_SIZE                    = (2**M_BITS)       # Maximum nodes can be in network
 DEFAULT_PORT                = 49152
 START_PORT_FROM             = DEFAULT_PORT
 PORT_NUMBER_RANGE           = 65535
 DIE_AFTER_SECONDS_DEFAULT   = 3 * 60            # kill server after this seconds
 INTERVAL                    = 1                 # in seconds
+HASH_FUNCTION               = "md5"             # md5, sha1, blake2b or xxhash (needs the xxhash package)
+TEST_NODE_COUNT             = 16                # upper bound on the nodes started by test.py
+RPC_TIMEOUT                 = 5                 # in seconds, per inter-node request
+POOL_MAX_IDLE_PER_PEER      = 4                 # idle keep-alive connections kept per peer
+POOL_IDLE_TIMEOUT           = 30                # in seconds, before an idle connection is dropped
+SERVER_KEEPALIVE_TIMEOUT    = 60                # in seconds, server side idle connection timeout
+PEER_DEAD_TIMEOUT           = 3                 # in seconds, a failed peer is skipped for this long
+FIX_FINGERS_MODE            = "round-robin"     # "round-robin" or "all" fingers per INTERVAL
+FIX_FINGERS_BUDGET          = 1                 # fingers refreshed per INTERVAL in round-robin mode
+LOOKUP_MODE                 = "recursive"       # "recursive" or "iterative" findSuccessor
+LOOKUP_MAX_HOPS             = 32                # upper bound on hops of an iterative lookup
+LOOKUP_HOP_TIMEOUT          = 2                 # in seconds, per hop of an iterative lookup
+ROUTE_CACHE_SIZE            = 256               # key ranges remembered by the routing cache, 0 disables it
+ROUTE_CACHE_TTL             = 30                # in seconds, before a cached route is resolved again
+HASH_CACHE_SIZE             = 65536             # memoized key hashes
+VIRTUAL_NODES               = 1                 # virtual nodes per process
+NODE_WEIGHT                 = 1.0               # multiplies VIRTUAL_NODES for bigger machines
+SUCCESSOR_LIST_SIZE         = 3                 # successors remembered for fail-over
+REPLICATION_FACTOR          = 1                 # copies of each key, the owner included
+WRITE_QUORUM                = 1                 # copies written before a PUT succeeds
+READ_FROM_REPLICAS          = False             # spread GETs over the owner and its replicas
+REPLICATION_WORKERS         = 4                 # threads sending replicas, per node
+HANDOFF_BATCH_SIZE          = 256               # keys per batch when handing keys over on join/leave
+HANDOFF_GRACE               = 3                 # in seconds, a successor keeps handed-over keys after the new node notifies it
+BATCH_MAX_KEYS              = 1024              # keys accepted by one _mget/_mput request
+BATCH_WORKERS               = 8                 # threads fanning a batch out to the owners, per node
+SERVER_ENGINE               = "threading"       # "threading", "pooled" or "asyncio" HTTP server
+ASYNC_WORKERS               = 32                # threads running blocking routes for the asyncio engine
+SERVER_WORKERS              = 32                # worker threads of the pooled engine
+SERVER_ACCEPT_QUEUE         = 128               # connections waiting for a worker before new ones get 503
+ADMIT_INTERNAL_SLOTS        = 12                # concurrent lookup and data hops from peers, pooled engine
+ADMIT_CLIENT_SLOTS          = 12                # concurrent client /storage requests, pooled engine
+ADMIT_ADMIN_SLOTS           = 4                 # concurrent admin, debug and handoff requests, pooled engine
+SERVER_RETRY_AFTER          = 1                 # in seconds, Retry-After sent with 503
+SERVER_IDLE_POLL            = 0.1               # in seconds, how often an idle keep-alive worker checks for waiting connections
+SERVER_MAINTENANCE_WORKERS  = 4                 # worker threads of the pooled engine kept for ring maintenance
+SERVER_PEEK_BYTES           = 1024              # bytes of a parked connection read to find the route of its next request
+STORAGE_ENGINE              = "memory"          # "memory", "log" (write-ahead log and snapshots) or "mmap" (segment files)
+STORAGE_DIR                 = "data"            # directory of the log storage, one subdirectory per node
+STORAGE_FSYNC               = "batched"         # "always", "batched" or "never" fsync of the log
+STORAGE_FSYNC_INTERVAL      = 1                 # in seconds, between batched fsyncs
+STORAGE_SNAPSHOT_BYTES      = 64 * 1024 * 1024  # log size that triggers a snapshot
+STORAGE_SEGMENT_BYTES       = 64 * 1024 * 1024  # preallocated size of an mmap storage segment
+STORAGE_COMPACT_RATIO       = 0.5               # compact an mmap segment once less than this share of it is live
+STORAGE_COMPACT_INTERVAL    = 30                # in seconds, between checks for segments to compact
+CACHE_BYTES                 = 0                 # byte budget of a node in cache mode, 0 keeps every key
+CACHE_EVICTION              = "lru"             # "lru", "lfu" or "ttl", which key cache mode evicts first
+CACHE_DEFAULT_TTL           = 0                 # in seconds, TTL of keys put without one in cache mode, 0 for none
+STREAM_CHUNK_BYTES          = 64 * 1024         # size of the pieces a streamed value is relayed in
+STREAM_MIN_BYTES            = 1024 * 1024       # PUT values above this size, or of unknown size, are streamed to their owner
+WIRE_ENABLED                = False             # ring maintenance over the binary protocol, falling back to HTTP
+WIRE_PORT_OFFSET            = 10000             # the binary protocol listens on the HTTP port plus this
+WIRE_WORKERS                = 16                # threads running binary protocol lookups, which may wait on further hops
+WIRE_MAINTENANCE_WORKERS    = 4                 # threads running the binary protocol requests that never wait on other nodes
+WIRE_RETRY_INTERVAL         = 30                # in seconds, before a peer without the binary protocol is tried again
+WIRE_MAX_FRAME              = 1024 * 1024       # largest binary protocol payload accepted
+METRICS_BUCKETS             = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)   # latency histogram bounds, in seconds
+TRACE_SAMPLE_RATE           = 0.0               # fraction of client requests traced from the node they enter at, opt in with --trace-sample
+TRACE_BUFFER_SPANS          = 4096              # spans kept per virtual node for /traces
+PROFILE_INTERVAL            = 0.01              # in seconds, between the stack samples of /debug/profile
+PROFILE_MAX_SECONDS         = 60                # longest profile /debug/profile takes
+PROFILE_TIMINGS             = False             # time findSuccessor, closestPrecedingNode and storage access
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import http.client
+import threading
+import time
+import configurations as configs
+
+class rpcResponse:
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+class responseStream:
+    """The body of a pooled response, read in chunks as the caller relays it.
+    The connection goes back to the pool once the body is read to its end,
+    and is closed if the caller gives up before that."""
+
+    def __init__(self, pool, address, conn, resp):
+        self._pool = pool
+        self._address = address
+        self._conn = conn
+        self._resp = resp
+        self.length = resp.length
+
+    def chunks(self, size=None):
+        size = size or configs.STREAM_CHUNK_BYTES
+        while True:
+            data = self._resp.read(size)
+            if not data:
+                break
+            yield data
+        self._finish(self._resp.will_close)
+
+    def _finish(self, close):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if close:
+            conn.close()
+        else:
+            self._pool._release(self._address, conn)
+
+    def close(self):
+        self._finish(True)
+
+# What a peer closing an idle keep-alive connection looks like to the next
+# request on it; nothing of a response has arrived yet. A timeout is not
+# one of these: the peer may have got the request and be slow to answer.
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+class connectionPool:
+    """Per-peer pool of persistent HTTP/1.1 connections.
+
+    Idle connections are kept for at most `idle_timeout` seconds and at most
+    `max_idle` of them are kept per peer. A request that fails on a reused
+    connection (the peer closed it while idle) is retried once on a fresh one.
+    A body given as an iterable of chunks can only be sent once, so it
+    always goes out on a fresh connection.
+    """
+
+    def __init__(self, max_idle=None, idle_timeout=None, timeout=None):
+        self._max_idle = configs.POOL_MAX_IDLE_PER_PEER if max_idle is None else max_idle
+        self._idle_timeout = configs.POOL_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self._timeout = configs.RPC_TIMEOUT if timeout is None else timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def _acquire(self, address, fresh=False):
+        if fresh:
+            return http.client.HTTPConnection(address, timeout=self._timeout), False
+        now = time.monotonic()
+        stale = []
+        conn = None
+        with self._lock:
+            if now - self._last_sweep > self._idle_timeout:
+                stale.extend(self._sweep(now))
+            idle = self._idle.get(address)
+            while idle:
+                candidate, last_used = idle.pop()
+                if now - last_used > self._idle_timeout:
+                    stale.append(candidate)
+                    continue
+                conn = candidate
+                break
+        for c in stale:
+            c.close()
+        if conn is not None:
+            return conn, True
+        return http.client.HTTPConnection(address, timeout=self._timeout), False
+
+    def _release(self, address, conn):
+        with self._lock:
+            idle = self._idle.setdefault(address, [])
+            if len(idle) < self._max_idle:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def _sweep(self, now):
+        # Called with the lock held; returns the evicted connections so they
+        # can be closed outside of it.
+        self._last_sweep = now
+        evicted = []
+        for address in list(self._idle):
+            keep = []
+            for conn, last_used in self._idle[address]:
+                if now - last_used > self._idle_timeout:
+                    evicted.append(conn)
+                else:
+                    keep.append((conn, last_used))
+            if keep:
+                self._idle[address] = keep
+            else:
+                del self._idle[address]
+        return evicted
+
+    def request(self, address, method, path, body=None, headers=None, timeout=None, stream=False):
+        # With stream, the body of a 200 response is left unread and returned
+        # as a responseStream.
+        address = str(address)
+        headers = headers or {}
+        fresh = body is not None and not isinstance(body, (str, bytes, bytearray, memoryview))
+        while True:
+            conn, reused = self._acquire(address, fresh)
+            conn.timeout = self._timeout if timeout is None else timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(conn.timeout)
+            try:
+                try:
+                    conn.request(method, path, body, headers)
+                    resp = conn.getresponse()
+                except STALE_CONNECTION_ERRORS:
+                    # The peer closed an idle connection before it read the
+                    # request: send it once more, on a new connection.
+                    conn.close()
+                    if reused:
+                        fresh = True
+                        continue
+                    raise
+                if stream and resp.status == 200:
+                    return rpcResponse(resp.status, resp.headers, responseStream(self, address, conn, resp))
+                data = resp.read()
+            except Exception:
+                # Includes an exception raised by a body iterable, when the
+                # request is abandoned midway.
+                conn.close()
+                raise
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(address, conn)
+            return rpcResponse(resp.status, resp.headers, data)
+
+    def discard(self, address):
+        with self._lock:
+            idle = self._idle.pop(str(address), [])
+        for conn, _ in idle:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
@@ -5,8 +5,15 @@ from address import nodeAddress
 from hashing import consistent_hashing
 
 class finger:
+    __slots__ = ("_identity", "_address")
+
     def __init__(self, address):
-        self._identity = consistent_hashing(address)
+        # Reuse the identity already computed by a nodeAddress; plain strings
+        # (fingers rebuilt from JSON) go through the memoized hash.
+        if isinstance(address, nodeAddress):
+            self._identity = address.__hash__()
+        else:
+            self._identity = consistent_hashing(address)
         self._address = address
 
     def this(self):
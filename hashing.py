@@ -1,17 +1,71 @@
 #!/usr/bin/env python3
 
-from hashlib import md5
+import hashlib
+from functools import lru_cache
 import configurations as configs
 
-def hash_to_hex(strInput):
-    x = md5(str(strInput).encode())
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Hash functions that can place nodes and keys on the ring. Only the spread of
+# the digest matters here, so a fast non-cryptographic hash is fine when the
+# deployment does not need collision resistance.
+HASH_FUNCTIONS = {
+    "md5":      hashlib.md5,
+    "sha1":     hashlib.sha1,
+    "blake2b":  lambda data=b"": hashlib.blake2b(data, digest_size=20),
+}
+if xxhash is not None:
+    HASH_FUNCTIONS["xxhash"] = xxhash.xxh128
+
+def digest_bits(name):
+    return HASH_FUNCTIONS[name]().digest_size * 8
+
+def configure(m_bits=None, hash_name=None):
+    # Sets the identifier space width and the ring hash function. Every node
+    # of a ring must use the same settings.
+    m_bits = configs.M_BITS if m_bits is None else m_bits
+    hash_name = configs.HASH_FUNCTION if hash_name is None else hash_name
+    if hash_name not in HASH_FUNCTIONS:
+        if hash_name == "xxhash":
+            raise ValueError("The xxhash hash function needs the 'xxhash' package")
+        raise ValueError("Unknown hash function '{}'".format(hash_name))
+    if m_bits < 1 or m_bits > digest_bits(hash_name):
+        raise ValueError("M_BITS must be between 1 and {} for {}".format(digest_bits(hash_name), hash_name))
+
+    configs.M_BITS = m_bits
+    configs.DHT_SIZE = 2**m_bits
+    configs.HASH_FUNCTION = hash_name
+    _hash_to_hex.cache_clear()
+    _consistent_hashing.cache_clear()
+
+# Key hashes are memoized in bounded LRU caches keyed on the string form of
+# the input: nodeAddress objects compare equal by ring identity, which is not
+# enough to share a digest.
+
+@lru_cache(maxsize=configs.HASH_CACHE_SIZE)
+def _hash_to_hex(strInput):
+    x = HASH_FUNCTIONS[configs.HASH_FUNCTION](strInput.encode())
     return x.hexdigest()
 
+@lru_cache(maxsize=configs.HASH_CACHE_SIZE)
+def _consistent_hashing(strInput):
+    x = int(_hash_to_hex(strInput), 16) % (configs.DHT_SIZE)
+    return x
+
+def hash_to_hex(strInput):
+    return _hash_to_hex(str(strInput))
+
 def hex_to_int(strInput):
     result = hash_to_hex(strInput)
     x = int(result,16)
     return x
 
 def consistent_hashing(strInput):
-    x= hex_to_int(strInput) % (configs.DHT_SIZE)
-    return x
+    return _consistent_hashing(str(strInput))
+
+def hex_to_identity(hexdigest):
+    # Ring identity of a key stored under its hash_to_hex digest.
+    return int(hexdigest, 16) % (configs.DHT_SIZE)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import configurations as configs
+
+class peerHealth:
+    """Cached liveness of remote peers.
+
+    The table is fed by the outcome of real requests and by the probes of the
+    stabilize and checkPredecessor workers. A peer marked dead is skipped by
+    ordinary requests until `dead_timeout` seconds have passed, after which it
+    is given another chance.
+    """
+
+    def __init__(self, dead_timeout=None):
+        self._dead_timeout = configs.PEER_DEAD_TIMEOUT if dead_timeout is None else dead_timeout
+        self._peers = {}
+        self._lock = threading.Lock()
+
+    def mark_alive(self, address):
+        with self._lock:
+            self._peers[str(address)] = (True, time.monotonic())
+
+    def mark_dead(self, address):
+        with self._lock:
+            self._peers[str(address)] = (False, time.monotonic())
+
+    def is_alive(self, address):
+        entry = self._peers.get(str(address))
+        if entry is None:
+            return True
+        alive, since = entry
+        if alive:
+            return True
+        return time.monotonic() - since > self._dead_timeout
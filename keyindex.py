@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+from array import array
+
+EMPTY = 0
+USED = 1
+DELETED = 2
+
+class keyIndex:
+    """Open-addressing hash table from fixed-size binary digests to tuples of
+    `width` unsigned 64-bit integers.
+
+    Digests are stored back to back in one bytearray and values in one
+    array('Q'), so an entry costs key_size + 8 * width + 1 bytes per slot
+    instead of a str, a tuple and a dict entry. Digests are already
+    uniform, so the first slot comes straight from their leading bytes;
+    collisions are resolved by linear probing. Deleted slots are reused by
+    later inserts and dropped when the table is rebuilt.
+    """
+
+    MAX_LOAD = 0.7
+
+    def __init__(self, key_size, width=1, capacity=1024):
+        self._key_size = key_size
+        self._width = width
+        self._count = 0
+        size = 1
+        while size < capacity:
+            size *= 2
+        self._allocate(size)
+
+    def _allocate(self, capacity):
+        self._capacity = capacity
+        self._mask = capacity - 1
+        self._keys = bytearray(capacity * self._key_size)
+        self._values = array("Q", bytes(8 * capacity * self._width))
+        self._states = bytearray(capacity)
+        self._filled = 0
+
+    def _probe(self, digest):
+        # Returns (True, slot holding digest) or (False, slot to insert it in).
+        if len(digest) != self._key_size:
+            raise ValueError("Expected a %d byte digest" % self._key_size)
+        size = self._key_size
+        keys = self._keys
+        states = self._states
+        mask = self._mask
+        slot = int.from_bytes(digest[:8], "little") & mask
+        free = -1
+        while True:
+            state = states[slot]
+            if state == EMPTY:
+                return False, slot if free < 0 else free
+            if state == USED:
+                if keys.startswith(digest, slot * size):
+                    return True, slot
+            elif free < 0:
+                free = slot
+            slot = (slot + 1) & mask
+
+    def get(self, digest):
+        found, slot = self._probe(digest)
+        if not found:
+            return None
+        start = slot * self._width
+        return tuple(self._values[start:start + self._width])
+
+    def __contains__(self, digest):
+        return self._probe(digest)[0]
+
+    def put(self, digest, values):
+        found, slot = self._probe(digest)
+        if not found:
+            if self._states[slot] == EMPTY:
+                if self._filled + 1 > self._capacity * self.MAX_LOAD:
+                    self._rebuild()
+                    found, slot = self._probe(digest)
+                self._filled += 1
+            start = slot * self._key_size
+            self._keys[start:start + self._key_size] = digest
+            self._states[slot] = USED
+            self._count += 1
+        start = slot * self._width
+        for i, value in enumerate(values):
+            self._values[start + i] = value
+
+    def delete(self, digest):
+        found, slot = self._probe(digest)
+        if not found:
+            return False
+        self._states[slot] = DELETED
+        self._count -= 1
+        return True
+
+    def _rebuild(self):
+        # Grows the table when it is mostly live entries; otherwise only
+        # clears out the deleted slots.
+        capacity = self._capacity
+        if self._count + 1 > capacity * self.MAX_LOAD / 2:
+            capacity *= 2
+        entries = list(self.items())
+        self._allocate(capacity)
+        self._count = 0
+        for digest, values in entries:
+            self.put(digest, values)
+
+    def items(self):
+        size = self._key_size
+        width = self._width
+        for slot, state in enumerate(self._states):
+            if state == USED:
+                yield (bytes(self._keys[slot * size:(slot + 1) * size]),
+                       tuple(self._values[slot * width:(slot + 1) * width]))
+
+    def keys(self):
+        return [digest for digest, _ in self.items()]
+
+    def __len__(self):
+        return self._count
+
+    def nbytes(self):
+        return len(self._keys) + len(self._states) + self._values.itemsize * len(self._values)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import bisect
+import threading
+import configurations as configs
+
+# name: (type, help). Families are written out in this order.
+FAMILIES = {
+    "chord_http_requests_total":            ("counter", "HTTP requests served, by route and status code."),
+    "chord_http_request_duration_seconds":  ("histogram", "Time spent serving an HTTP request, by route."),
+    "chord_rpc_duration_seconds":           ("histogram", "Latency of outbound RPCs that got an answer, by transport and RPC."),
+    "chord_rpc_failures_total":             ("counter", "Outbound RPCs that failed in transport, by transport and RPC."),
+    "chord_lookups_total":                  ("counter", "Lookups started on this node."),
+    "chord_lookup_hops":                    ("histogram", "Remote hops taken by the lookups started on this node."),
+    "chord_forwards_total":                 ("counter", "Requests handed on to another node, by kind."),
+    "chord_route_cache_hits_total":         ("counter", "Owners found in the routing cache."),
+    "chord_route_cache_misses_total":       ("counter", "Owners not found in the routing cache."),
+    "chord_stabilize_duration_seconds":     ("histogram", "Time taken by one round of stabilize."),
+    "chord_storage_keys":                   ("gauge", "Keys held by this node, replicas included."),
+    "chord_cache_bytes":                    ("gauge", "Bytes of values held by the memory-bounded cache."),
+    "chord_cache_hits_total":               ("counter", "Reads answered by the memory-bounded cache."),
+    "chord_cache_misses_total":             ("counter", "Reads the memory-bounded cache had no value for."),
+    "chord_cache_evictions_total":          ("counter", "Keys evicted from the memory-bounded cache, by reason."),
+    "chord_admission_active":               ("gauge", "Requests being served, by admission class."),
+    "chord_admission_rejected_total":       ("counter", "Requests turned away by admission control, by class."),
+    "chord_timed_calls_total":              ("counter", "Calls to the functions timed with --timings."),
+    "chord_timed_seconds_total":            ("counter", "Time spent in the functions timed with --timings."),
+}
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                          for name, value in labels) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def histogram_samples(name, labels, bounds, counts, total, count):
+    # Samples of one histogram from per-bucket counts, the last of which
+    # counts the values above every bound.
+    samples = []
+    cumulative = 0
+    for bound, n in zip(list(bounds) + [float("inf")], counts):
+        cumulative += n
+        samples.append((name + "_bucket", labels + (("le", format_value(float(bound))),), cumulative))
+    samples.append((name + "_sum", labels, total))
+    samples.append((name + "_count", labels, count))
+    return samples
+
+class metricsRegistry:
+    """Counters and histograms of one node, written out in the Prometheus
+    text exposition format.
+
+    Recording is a dictionary update under a lock; totals that other parts
+    of the node already keep (lookup hops, caches, storage) are not recorded
+    twice but sampled when the metrics are rendered.
+    """
+
+    def __init__(self, buckets=None):
+        self._buckets = tuple(configs.METRICS_BUCKETS if buckets is None else buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [[0] * (len(self._buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            samples = [(name, labels, value) for (name, labels), value in self._counters.items()]
+            for (name, labels), (counts, total, count) in self._histograms.items():
+                samples += histogram_samples(name, labels, self._buckets, counts, total, count)
+        return samples
+
+    def render(self, extra=()):
+        # extra: further (name, labels, value) samples sampled by the caller.
+        families = {}
+        for name, labels, value in self.samples() + list(extra):
+            family = name
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and FAMILIES.get(name[:-len(suffix)], ("",))[0] == "histogram":
+                    family = name[:-len(suffix)]
+            families.setdefault(family, []).append((name, labels, value))
+        lines = []
+        for family in sorted(families, key=lambda f: (list(FAMILIES).index(f) if f in FAMILIES else len(FAMILIES), f)):
+            kind, help = FAMILIES.get(family, ("untyped", ""))
+            lines.append("# HELP %s %s" % (family, help))
+            lines.append("# TYPE %s %s" % (family, kind))
+            # Keep the buckets of each histogram together and in order.
+            samples = sorted(families[family], key=lambda s: [p for p in s[1] if p[0] != "le"])
+            for name, labels, value in samples:
+                lines.append("%s%s %s" % (name, format_labels(labels), format_value(value)))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import threading
+import time
+import configurations as configs
+
+# One profile at a time: two samplers would only slow each other down.
+_profiling = threading.Lock()
+
+def thread_label(name):
+    # Threads of one pool or worker kind share a root in the flame graph.
+    return re.sub(r"[-_]\d+$", "", name).replace(";", ":")
+
+def frame_label(code):
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+def sample_stacks(seconds, interval=None):
+    """Samples the stack of every other thread of the process each interval
+    seconds for `seconds`. Returns { collapsed stack: samples }, or None when
+    another profile is running.
+
+    A collapsed stack is the thread name and then the frames from the
+    outermost in, separated by ";", as flame graph tools read them.
+    """
+    interval = configs.PROFILE_INTERVAL if interval is None else interval
+    if not _profiling.acquire(blocking=False):
+        return None
+    try:
+        me = threading.get_ident()
+        # Samples are counted by thread name and the ids of the code objects
+        # on the stack, and only labelled at the end, to keep each sample
+        # short; holding on to the code objects keeps their ids unique.
+        codes = {}
+        samples = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = { thread.ident: thread.name for thread in threading.enumerate() }
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    codes[id(code)] = code
+                    stack.append(id(code))
+                    frame = frame.f_back
+                key = (names.get(ident, "unknown"), tuple(stack))
+                samples[key] = samples.get(key, 0) + 1
+            time.sleep(interval)
+    finally:
+        _profiling.release()
+    counts = {}
+    for (name, stack), count in samples.items():
+        key = ";".join([thread_label(name)] + [frame_label(codes[code]) for code in reversed(stack)])
+        counts[key] = counts.get(key, 0) + count
+    return counts
+
+def collapsed(counts):
+    return "".join("%s %d\n" % (stack, count) for stack, count in sorted(counts.items()))
+
+class hotTimers:
+    """Calls to and time spent in the functions wrapped by instrument()."""
+
+    def __init__(self):
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            entry = self._timings.get(name)
+            if entry is None:
+                entry = self._timings[name] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def wrap(self, name, fn):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - started)
+        return timed
+
+    def serialize(self):
+        with self._lock:
+            return { name: { "calls": calls, "total_ms": round(total * 1000, 3),
+                             "mean_us": round(total / calls * 1e6, 3), "max_us": round(longest * 1e6, 3) }
+                     for name, (calls, total, longest) in sorted(self._timings.items()) }
+
+    def samples(self):
+        with self._lock:
+            samples = []
+            for name, (calls, total, _) in sorted(self._timings.items()):
+                samples.append(("chord_timed_calls_total", (("function", name),), calls))
+                samples.append(("chord_timed_seconds_total", (("function", name),), total))
+            return samples
+
+def instrument(timers, target, names, prefix=""):
+    # Shadows the methods of target with timed ones on the instance itself,
+    # so that objects left alone pay nothing.
+    for name in names:
+        setattr(target, name, timers.wrap(prefix + name, getattr(target, name)))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+from collections import OrderedDict
+from utility import inrange_right
+import configurations as configs
+
+class routeCache:
+    """LRU cache of ring ranges (start, owner] to the node owning them.
+
+    Entries are keyed by the owner's identity and expire after `ttl` seconds.
+    A lookup scans the (small, bounded) set of ranges, so hot key ranges are
+    resolved locally without any routing hop.
+    """
+
+    def __init__(self, size=None, ttl=None):
+        self._size = configs.ROUTE_CACHE_SIZE if size is None else size
+        self._ttl = configs.ROUTE_CACHE_TTL if ttl is None else ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, id):
+        now = time.monotonic()
+        with self._lock:
+            for owner_id, (start, owner, expires, replicas) in self._entries.items():
+                if inrange_right(int(id), start, owner_id):
+                    if expires < now:
+                        del self._entries[owner_id]
+                        break
+                    self._entries.move_to_end(owner_id)
+                    self._hits += 1
+                    return owner
+            self._misses += 1
+        return None
+
+    def put(self, start, owner):
+        if self._size <= 0:
+            return
+        with self._lock:
+            previous = self._entries.get(owner.get_identity())
+            replicas = previous[3] if previous != None else ()
+            self._entries[owner.get_identity()] = (start, owner, time.monotonic() + self._ttl, replicas)
+            self._entries.move_to_end(owner.get_identity())
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+    def set_replicas(self, address, replicas):
+        # Remembers where the owner at `address` keeps copies of its range.
+        with self._lock:
+            for owner_id, (start, owner, expires, _) in self._entries.items():
+                if str(owner.get_address()) == str(address):
+                    self._entries[owner_id] = (start, owner, expires, tuple(replicas))
+                    return
+
+    def get_replicas(self, address):
+        with self._lock:
+            for owner_id, (start, owner, expires, replicas) in self._entries.items():
+                if str(owner.get_address()) == str(address):
+                    return list(replicas)
+        return []
+
+    def invalidate(self, id):
+        with self._lock:
+            for owner_id, (start, owner, expires, replicas) in list(self._entries.items()):
+                if inrange_right(int(id), start, owner_id):
+                    del self._entries[owner_id]
+
+    def invalidate_address(self, address):
+        with self._lock:
+            for owner_id, (start, owner, expires, replicas) in list(self._entries.items()):
+                if str(owner.get_address()) == str(address):
+                    del self._entries[owner_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def serialize(self):
+        with self._lock:
+            return { "entries": len(self._entries), "hits": self._hits, "misses": self._misses }
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+class lookupStats:
+    """Histogram of the number of remote hops taken by lookups started on this node."""
+
+    def __init__(self):
+        self._hops = {}
+        self._lookups = 0
+        self._total_hops = 0
+        self._lock = threading.Lock()
+
+    def record(self, hops):
+        with self._lock:
+            self._lookups += 1
+            self._total_hops += hops
+            self._hops[hops] = self._hops.get(hops, 0) + 1
+
+    def histogram(self):
+        # (lookups, total hops, { hops: lookups }).
+        with self._lock:
+            return self._lookups, self._total_hops, dict(self._hops)
+
+    def serialize(self):
+        with self._lock:
+            mean = (self._total_hops / self._lookups) if self._lookups else 0.0
+            result = {
+                "lookups": self._lookups,
+                "mean_hops": round(mean, 3),
+                "max_hops": max(self._hops) if self._hops else 0,
+                "hops": { str(k): v for k, v in sorted(self._hops.items()) },
+            }
+        return result
+
+class handoffProgress:
+    """Progress and throughput of one bulk key transfer."""
+
+    def __init__(self, direction, peer):
+        self._direction = direction
+        self._peer = str(peer)
+        self._keys = 0
+        self._bytes = 0
+        self._start = time.monotonic()
+        self._end = None
+
+    def add(self, keys, size):
+        self._keys += keys
+        self._bytes += size
+        print("Handoff ({}) with {}: {} keys, {} bytes so far.".format(
+            self._direction, self._peer, self._keys, self._bytes))
+
+    def finish(self):
+        self._end = time.monotonic()
+        result = self.serialize()
+        print("Handoff ({}) with {} done: {} keys, {} bytes in {:.3f}s ({:.1f} keys/s).".format(
+            self._direction, self._peer, result["keys"], result["bytes"], result["seconds"], result["keys_per_second"]))
+        return result
+
+    def serialize(self):
+        seconds = (self._end or time.monotonic()) - self._start
+        result = {
+            "direction": self._direction,
+            "peer": self._peer,
+            "keys": self._keys,
+            "bytes": self._bytes,
+            "seconds": round(seconds, 3),
+            "keys_per_second": round(self._keys / seconds, 1) if seconds > 0 else 0.0,
+        }
+        return result
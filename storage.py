@@ -0,0 +1,808 @@
+#!/usr/bin/env python3
+
+import heapq
+import itertools
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from keyindex import keyIndex
+import configurations as configs
+import hashing
+
+class memoryStorage:
+    """Key-value store of a node, keyed by the hex digest of the key.
+
+    The interface every storage backend implements: get, put, delete,
+    ttl, keys, items and len. Only cacheStorage honours the ttl given to
+    put; the other backends keep keys until they are deleted. This one
+    keeps everything in a dict and loses it when the process exits.
+    """
+
+    persistent = False
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = value
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def ttl(self, key):
+        return None
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def items(self):
+        return list(self._data.items())
+
+    def __len__(self):
+        return len(self._data)
+
+    def serialize(self):
+        return { "engine": "memory", "keys": len(self._data) }
+
+    def close(self):
+        pass
+
+# Log record: crc32 of the rest, operation, key length, value length, then
+# the key and the value. Snapshots are logs of PUTs only.
+RECORD = struct.Struct(">IBHI")
+OP_PUT = 1
+OP_DELETE = 2
+
+def encode_record(op, key, value=b""):
+    key = key.encode("utf-8")
+    body = RECORD.pack(0, op, len(key), len(value))[4:] + key + value
+    return struct.pack(">I", zlib.crc32(body)) + body
+
+def scan_records(buffer, end=None):
+    # Returns (offset, op, key, value offset, value length) for each record
+    # of buffer up to `end` or the first torn or corrupt record, and the
+    # offset where the valid records end.
+    view = memoryview(buffer)
+    end = len(view) if end is None else end
+    records = []
+    offset = 0
+    while offset + RECORD.size <= end:
+        crc, op, key_len, value_len = RECORD.unpack_from(view, offset)
+        record_end = offset + RECORD.size + key_len + value_len
+        if op not in (OP_PUT, OP_DELETE) or record_end > end or \
+                zlib.crc32(view[offset + 4:record_end]) != crc:
+            break
+        key_start = offset + RECORD.size
+        key = bytes(view[key_start:key_start + key_len]).decode("utf-8")
+        records.append((offset, op, key, key_start + key_len, value_len))
+        offset = record_end
+    view.release()
+    return records, offset
+
+def read_log(path):
+    # Returns the (op, key, value) records of a log file and the offset
+    # where its valid records end.
+    with open(path, "rb") as f:
+        data = f.read()
+    records, end = scan_records(data)
+    return [(op, key, data[start:start + length]) for _, op, key, start, length in records], end
+
+class logStorage(memoryStorage):
+    """memoryStorage made durable by a write-ahead log and snapshots.
+
+    Every put and delete is appended to wal-<generation> before it is
+    applied. Once the log grows past `snapshot_bytes`, a new generation's
+    log is started and a snapshot of the data is written in the background
+    as snapshot-<generation>; older files are removed once it is complete.
+    Opening the store loads the latest complete snapshot and replays only
+    the logs from its generation on.
+
+    fsync is "always" (every write), "batched" (every `fsync_interval`
+    seconds, by a background thread) or "never" (left to the OS; files are
+    still synced on snapshot and close).
+    """
+
+    persistent = True
+
+    def __init__(self, path, fsync=None, fsync_interval=None, snapshot_bytes=None):
+        memoryStorage.__init__(self)
+        self._path = path
+        self._fsync = configs.STORAGE_FSYNC if fsync is None else fsync
+        self._fsync_interval = configs.STORAGE_FSYNC_INTERVAL if fsync_interval is None else fsync_interval
+        self._snapshot_bytes = configs.STORAGE_SNAPSHOT_BYTES if snapshot_bytes is None else snapshot_bytes
+        if self._fsync not in ("always", "batched", "never"):
+            raise ValueError("Unknown fsync policy: %s" % self._fsync)
+        self._snapshot_thread = None
+        self._dirty = False
+        self._closed = False
+        os.makedirs(path, exist_ok=True)
+        self._load()
+        if self._fsync == "batched":
+            self._syncer = threading.Thread(target=self._sync_periodically, name="log-sync")
+            self._syncer.daemon = True
+            self._syncer.start()
+
+    def _file(self, kind, generation):
+        return os.path.join(self._path, "%s-%d" % (kind, generation))
+
+    def _generations(self, kind):
+        pattern = re.compile(r"^%s-(\d+)$" % kind)
+        found = [pattern.match(name) for name in os.listdir(self._path)]
+        return sorted(int(m.group(1)) for m in found if m)
+
+    def _load(self):
+        started = time.monotonic()
+        snapshots = self._generations("snapshot")
+        base = snapshots[-1] if snapshots else 0
+        if snapshots:
+            records, _ = read_log(self._file("snapshot", base))
+            for op, key, value in records:
+                self._data[key] = value
+        replayed = 0
+        logs = [g for g in self._generations("wal") if g >= base]
+        for generation in logs:
+            path = self._file("wal", generation)
+            records, valid = read_log(path)
+            for op, key, value in records:
+                if op == OP_PUT:
+                    self._data[key] = value
+                else:
+                    self._data.pop(key, None)
+            replayed += len(records)
+            if os.path.getsize(path) > valid:
+                # A write torn by a crash; drop it so appends start clean.
+                print("Truncating torn log record in {}.".format(path))
+                os.truncate(path, valid)
+        self._generation = logs[-1] if logs else base
+        self._wal = open(self._file("wal", self._generation), "ab")
+        self._wal_size = self._wal.tell()
+        print("Loaded {} keys from {} (snapshot {}, {} log records) in {:.3f}s.".format(
+            len(self._data), self._path, base, replayed, time.monotonic() - started))
+
+    def _append(self, record):
+        # Called with the lock held.
+        self._wal.write(record)
+        self._wal.flush()
+        self._wal_size += len(record)
+        if self._fsync == "always":
+            os.fsync(self._wal.fileno())
+        else:
+            self._dirty = True
+
+    def _maybe_snapshot(self):
+        # Called with the lock held, once the write is applied to the data.
+        if self._wal_size > self._snapshot_bytes and \
+                (self._snapshot_thread is None or not self._snapshot_thread.is_alive()):
+            self._start_snapshot()
+
+    def put(self, key, value, ttl=None):
+        record = encode_record(OP_PUT, key, value)
+        with self._lock:
+            if self._closed:
+                return False
+            self._append(record)
+            self._data[key] = value
+            self._maybe_snapshot()
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            if self._closed or key not in self._data:
+                return False
+            self._append(encode_record(OP_DELETE, key))
+            del self._data[key]
+            self._maybe_snapshot()
+        return True
+
+    def _start_snapshot(self):
+        # Called with the lock held: switch writes to the next generation's
+        # log, then write what the data looked like at the switch.
+        os.fsync(self._wal.fileno())
+        self._wal.close()
+        self._generation += 1
+        self._wal = open(self._file("wal", self._generation), "ab")
+        self._wal_size = 0
+        data = dict(self._data)
+        self._snapshot_thread = threading.Thread(target=self._write_snapshot,
+                args=(self._generation, data), name="log-snapshot")
+        self._snapshot_thread.daemon = True
+        self._snapshot_thread.start()
+
+    def _write_snapshot(self, generation, data):
+        started = time.monotonic()
+        path = self._file("snapshot", generation)
+        with open(path + ".tmp", "wb") as f:
+            for key, value in data.items():
+                f.write(encode_record(OP_PUT, key, value))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        for kind in ("snapshot", "wal"):
+            for old in self._generations(kind):
+                if old < generation:
+                    os.remove(self._file(kind, old))
+        print("Snapshot {} of {} keys written in {:.3f}s.".format(
+            generation, len(data), time.monotonic() - started))
+
+    def sync(self):
+        with self._lock:
+            if self._dirty and not self._closed:
+                os.fsync(self._wal.fileno())
+                self._dirty = False
+
+    def _sync_periodically(self):
+        while not self._closed:
+            time.sleep(self._fsync_interval)
+            self.sync()
+
+    def serialize(self):
+        with self._lock:
+            return { "engine": "log", "keys": len(self._data), "path": self._path,
+                     "generation": self._generation, "log_bytes": self._wal_size,
+                     "fsync": self._fsync }
+
+    def close(self):
+        thread = self._snapshot_thread
+        if thread is not None:
+            thread.join()
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self._wal.close()
+
+class segmentStorage:
+    """Values kept in memory-mapped segment files instead of on the heap.
+
+    Records (the log format above, with deletes as tombstones) are appended
+    to the active segment, a file of `segment_bytes` preallocated and mapped
+    into memory. A keyIndex maps the binary digest of each key to the
+    segment, offset and length of its latest value, and get returns a
+    memoryview of the mapping, so a value is served without being copied.
+
+    Overwritten and deleted values are garbage. A background thread
+    compacts every inactive segment whose live share falls below
+    `compact_ratio`: it copies the live records to the active segment,
+    then removes the file. The mapping is closed only once no memoryview
+    of it is still in use.
+
+    fsync follows the same policies as logStorage.
+    """
+
+    persistent = True
+
+    def __init__(self, path, fsync=None, fsync_interval=None, segment_bytes=None,
+                 compact_ratio=None, compact_interval=None):
+        self._path = path
+        self._fsync = configs.STORAGE_FSYNC if fsync is None else fsync
+        self._fsync_interval = configs.STORAGE_FSYNC_INTERVAL if fsync_interval is None else fsync_interval
+        self._segment_bytes = configs.STORAGE_SEGMENT_BYTES if segment_bytes is None else segment_bytes
+        self._compact_ratio = configs.STORAGE_COMPACT_RATIO if compact_ratio is None else compact_ratio
+        self._compact_interval = configs.STORAGE_COMPACT_INTERVAL if compact_interval is None else compact_interval
+        if self._fsync not in ("always", "batched", "never"):
+            raise ValueError("Unknown fsync policy: %s" % self._fsync)
+        self._index = keyIndex(hashing.digest_bits(configs.HASH_FUNCTION) // 8, width=2)
+        self._segments = {}
+        self._used = {}
+        self._live = {}
+        self._tombstones = {}
+        self._retired = []
+        self._active = None
+        self._position = 0
+        self._dirty = False
+        self._closed = False
+        self._compactions = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._load()
+        self._maintainer = threading.Thread(target=self._maintain, name="mmap-maintainer")
+        self._maintainer.daemon = True
+        self._maintainer.start()
+
+    def _file(self, number):
+        return os.path.join(self._path, "segment-%d" % number)
+
+    def _map(self, number, size=None):
+        # Maps an existing segment, or creates one of `size` bytes.
+        with open(self._file(number), "r+b" if size is None else "w+b") as f:
+            if size is not None:
+                if hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(f.fileno(), 0, size)
+                else:
+                    f.truncate(size)
+            self._segments[number] = mmap.mmap(f.fileno(), 0)
+        self._used[number] = 0
+        self._live[number] = 0
+        self._tombstones[number] = 0
+        return self._segments[number]
+
+    def _load(self):
+        started = time.monotonic()
+        pattern = re.compile(r"^segment-(\d+)$")
+        found = [pattern.match(name) for name in os.listdir(self._path)]
+        numbers = sorted(int(m.group(1)) for m in found if m)
+        for number in numbers:
+            if os.path.getsize(self._file(number)) == 0:
+                # Created by a crash before it was preallocated.
+                os.remove(self._file(number))
+                continue
+            mm = self._map(number)
+            records, end = scan_records(mm)
+            for offset, op, key, value_offset, length in records:
+                self._forget(key)
+                if op == OP_PUT:
+                    self._place(key, number, value_offset, length)
+                    self._live[number] += value_offset + length - offset
+                else:
+                    self._tombstones[number] += value_offset - offset
+            self._used[number] = end
+            if any(mm[end:end + RECORD.size]):
+                # A write torn by a crash; clear it so appends start clean.
+                print("Clearing torn record in {}.".format(self._file(number)))
+                mm[end:] = bytes(len(mm) - end)
+        if self._segments:
+            self._active = max(self._segments)
+            self._position = self._used[self._active]
+        print("Loaded {} keys from {} ({} segments) in {:.3f}s.".format(
+            len(self._index), self._path, len(self._segments), time.monotonic() - started))
+
+    def _forget(self, key):
+        # Called with the lock held: the current value of key becomes garbage.
+        location = self._locate(key)
+        if location is not None:
+            number, value_offset, length = location
+            self._index.delete(bytes.fromhex(key))
+            self._live[number] -= RECORD.size + len(key.encode("utf-8")) + length
+
+    # The index holds binary digests; the segment and value offset are packed
+    # into one integer.
+
+    def _locate(self, key):
+        location = self._index.get(bytes.fromhex(key))
+        if location is None:
+            return None
+        return location[0] >> 40, location[0] & (2**40 - 1), location[1]
+
+    def _place(self, key, number, value_offset, length):
+        self._index.put(bytes.fromhex(key), (number << 40 | value_offset, length))
+
+    def _append(self, record):
+        # Called with the lock held. Returns the segment and offset written.
+        if self._active is None or self._position + len(record) > len(self._segments[self._active]):
+            if self._active is not None:
+                self._segments[self._active].flush()
+            number = max(self._segments) + 1 if self._segments else 0
+            self._map(number, max(self._segment_bytes, len(record)))
+            self._active = number
+            self._position = 0
+        mm = self._segments[self._active]
+        offset = self._position
+        mm[offset:offset + len(record)] = record
+        self._position += len(record)
+        self._used[self._active] = self._position
+        if self._fsync == "always":
+            start = offset - offset % mmap.PAGESIZE
+            mm.flush(start, self._position - start)
+        else:
+            self._dirty = True
+        return self._active, offset
+
+    def _store(self, key, value):
+        # Called with the lock held.
+        record = encode_record(OP_PUT, key, value)
+        number, offset = self._append(record)
+        self._forget(key)
+        self._place(key, number, offset + len(record) - len(value), len(value))
+        self._live[number] += len(record)
+
+    def _bury(self, key):
+        # Called with the lock held: appends a tombstone for key.
+        record = encode_record(OP_DELETE, key)
+        number, _ = self._append(record)
+        self._tombstones[number] += len(record)
+
+    def get(self, key):
+        with self._lock:
+            location = self._locate(key)
+            if location is None:
+                return None
+            number, offset, length = location
+            return memoryview(self._segments[number])[offset:offset + length]
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            if self._closed:
+                return False
+            self._store(key, value)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            if self._closed or self._locate(key) is None:
+                return False
+            self._bury(key)
+            self._forget(key)
+        return True
+
+    def ttl(self, key):
+        return None
+
+    def keys(self):
+        with self._lock:
+            return [digest.hex() for digest in self._index.keys()]
+
+    def items(self):
+        return [(key, self.get(key)) for key in self.keys()]
+
+    def __len__(self):
+        return len(self._index)
+
+    def _maintain(self):
+        last_compaction = time.monotonic()
+        while not self._closed:
+            time.sleep(self._fsync_interval if self._fsync == "batched" else 1)
+            if self._fsync == "batched":
+                self.sync()
+            if time.monotonic() - last_compaction >= self._compact_interval:
+                last_compaction = time.monotonic()
+                self.compact()
+
+    def sync(self):
+        with self._lock:
+            if self._dirty and not self._closed:
+                self._segments[self._active].flush()
+                self._dirty = False
+
+    def compact(self):
+        # Tombstones count as live, except in the oldest segment: there is no
+        # older value left for them to shadow. Oldest first, so they go.
+        with self._lock:
+            oldest = min(self._segments, default=None)
+            candidates = [n for n in sorted(self._segments) if n != self._active and
+                          self._live[n] + (self._tombstones[n] if n != oldest else 0) <
+                          self._used[n] * self._compact_ratio]
+        for number in candidates:
+            self._compact_segment(number)
+        self._release_retired()
+
+    def _compact_segment(self, number):
+        started = time.monotonic()
+        mm = self._segments[number]
+        # Inactive segments are never written again, so they can be
+        # scanned without the lock; each record is moved under it.
+        records, _ = scan_records(mm, self._used[number])
+        moved = 0
+        for offset, op, key, value_offset, length in records:
+            with self._lock:
+                if self._closed:
+                    return
+                if op == OP_PUT:
+                    if self._locate(key) == (number, value_offset, length):
+                        self._store(key, mm[value_offset:value_offset + length])
+                        moved += 1
+                elif self._locate(key) is None and min(self._segments) < number:
+                    # Still shadows an older value in an earlier segment.
+                    self._bury(key)
+        with self._lock:
+            # The copies must be on disk before the originals go.
+            self._segments[self._active].flush()
+            del self._segments[number], self._used[number], self._live[number], self._tombstones[number]
+            os.remove(self._file(number))
+            self._retired.append(mm)
+            self._compactions += 1
+        print("Compacted segment {}: {} live values moved in {:.3f}s.".format(
+            number, moved, time.monotonic() - started))
+
+    def _release_retired(self):
+        with self._lock:
+            for mm in list(self._retired):
+                try:
+                    mm.close()
+                except BufferError:
+                    # A value read from it is still being used.
+                    continue
+                self._retired.remove(mm)
+
+    def serialize(self):
+        with self._lock:
+            return { "engine": "mmap", "keys": len(self._index), "index_bytes": self._index.nbytes(),
+                     "path": self._path,
+                     "segments": len(self._segments), "active": self._active,
+                     "used_bytes": sum(self._used.values()), "live_bytes": sum(self._live.values()),
+                     "retired": len(self._retired), "compactions": self._compactions,
+                     "fsync": self._fsync }
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for mm in self._segments.values():
+                mm.flush()
+
+class lruPolicy:
+    """Evicts the least recently used key."""
+
+    def __init__(self):
+        self._order = OrderedDict()
+
+    def add(self, key, expires):
+        self._order[key] = None
+        self._order.move_to_end(key)
+
+    def touch(self, key):
+        if key in self._order:
+            self._order.move_to_end(key)
+
+    def remove(self, key):
+        self._order.pop(key, None)
+
+    def victim(self):
+        return next(iter(self._order), None)
+
+class lfuPolicy:
+    """Evicts the least frequently used key, the oldest one on a tie.
+
+    The heap holds (uses, sequence, key) and is updated lazily: entries whose
+    use count is out of date are skipped, and the heap is rebuilt once they
+    outnumber the keys.
+    """
+
+    def __init__(self):
+        self._uses = {}
+        self._heap = []
+        self._sequence = itertools.count()
+
+    def _push(self, key):
+        heapq.heappush(self._heap, (self._uses[key], next(self._sequence), key))
+        if len(self._heap) > 2 * len(self._uses) + 64:
+            self._heap = [(uses, next(self._sequence), key) for key, uses in self._uses.items()]
+            heapq.heapify(self._heap)
+
+    def add(self, key, expires):
+        self._uses[key] = self._uses.get(key, 0) + 1
+        self._push(key)
+
+    def touch(self, key):
+        if key in self._uses:
+            self._uses[key] += 1
+            self._push(key)
+
+    def remove(self, key):
+        self._uses.pop(key, None)
+
+    def victim(self):
+        while self._heap:
+            uses, _, key = self._heap[0]
+            if self._uses.get(key) == uses:
+                return key
+            heapq.heappop(self._heap)
+        return None
+
+class ttlPolicy:
+    """Evicts the key closest to expiring; keys without a TTL go last, the
+    oldest first.
+
+    Like lfuPolicy's, the heap keeps the entry of every write until it
+    reaches the top; it is rebuilt once stale entries outnumber the keys.
+    """
+
+    def __init__(self):
+        self._expires = {}
+        self._heap = []
+        self._sequence = itertools.count()
+
+    def add(self, key, expires):
+        expires = float("inf") if expires is None else expires
+        self._expires[key] = expires
+        heapq.heappush(self._heap, (expires, next(self._sequence), key))
+        if len(self._heap) > 2 * len(self._expires) + 64:
+            self._heap = [(expires, next(self._sequence), key) for key, expires in self._expires.items()]
+            heapq.heapify(self._heap)
+
+    def touch(self, key):
+        pass
+
+    def remove(self, key):
+        self._expires.pop(key, None)
+
+    def victim(self):
+        while self._heap:
+            expires, _, key = self._heap[0]
+            if self._expires.get(key) == expires:
+                return key
+            heapq.heappop(self._heap)
+        return None
+
+EVICTION_POLICIES = { "lru": lruPolicy, "lfu": lfuPolicy, "ttl": ttlPolicy }
+
+class cacheStorage:
+    """Bounds another backend to a byte budget, for nodes used as a cache.
+
+    A key costs the length of its key and value. When a put goes over
+    `budget` bytes, keys are evicted from the inner backend in the order of
+    the eviction policy (lru, lfu or ttl) until it fits; a value larger
+    than the whole budget is refused. A key given a ttl is dropped once it
+    expires: on access, or when a later put finds it expired.
+    """
+
+    def __init__(self, inner, budget=None, policy=None, default_ttl=None):
+        self._inner = inner
+        self._budget = configs.CACHE_BYTES if budget is None else budget
+        policy = configs.CACHE_EVICTION if policy is None else policy
+        if policy not in EVICTION_POLICIES:
+            raise ValueError("Unknown eviction policy: %s" % policy)
+        self._policy_name = policy
+        self._policy = EVICTION_POLICIES[policy]()
+        self._default_ttl = configs.CACHE_DEFAULT_TTL if default_ttl is None else default_ttl
+        self._sizes = {}
+        self._expires = {}
+        self._expiry_heap = []
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._refused = 0
+        self._evictions = { "capacity": 0, "expired": 0 }
+        self._lock = threading.Lock()
+        self.persistent = inner.persistent
+        for key in inner.keys():
+            value = inner.get(key)
+            if value is not None:
+                self._account(key, len(key) + len(value), None)
+        self._evict(time.time())
+
+    def _account(self, key, size, expires):
+        # Called with the lock held.
+        self._bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        self._policy.add(key, expires)
+        if expires is None:
+            self._expires.pop(key, None)
+        else:
+            self._expires[key] = expires
+            heapq.heappush(self._expiry_heap, (expires, key))
+            # A rewritten key leaves its old entry behind; see ttlPolicy.
+            if len(self._expiry_heap) > 2 * len(self._expires) + 64:
+                self._expiry_heap = [(expires, key) for key, expires in self._expires.items()]
+                heapq.heapify(self._expiry_heap)
+
+    def _forget(self, key):
+        # Called with the lock held.
+        self._bytes -= self._sizes.pop(key, 0)
+        self._expires.pop(key, None)
+        self._policy.remove(key)
+
+    def _drop(self, key, reason=None):
+        # Called with the lock held.
+        self._inner.delete(key)
+        self._forget(key)
+        if reason is not None:
+            self._evictions[reason] += 1
+
+    def _expired(self, key, now):
+        expires = self._expires.get(key)
+        return expires is not None and expires <= now
+
+    def _evict(self, now):
+        # Called with the lock held: expired keys go first, then the
+        # policy's victims while the budget is exceeded.
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expires, key = heapq.heappop(self._expiry_heap)
+            if self._expires.get(key) == expires:
+                self._drop(key, "expired")
+        while self._bytes > self._budget:
+            victim = self._policy.victim()
+            if victim is None:
+                break
+            self._drop(victim, "capacity")
+
+    def get(self, key):
+        with self._lock:
+            if self._expired(key, time.time()):
+                self._drop(key, "expired")
+                self._misses += 1
+                return None
+            value = self._inner.get(key)
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._policy.touch(key)
+            return value
+
+    def put(self, key, value, ttl=None):
+        ttl = self._default_ttl if ttl is None else ttl
+        size = len(key) + len(value)
+        with self._lock:
+            if size > self._budget:
+                self._refused += 1
+                return False
+            now = time.time()
+            # The key being written is never its own victim, and keeps its
+            # old accounting until the inner backend has taken the write.
+            self._policy.remove(key)
+            growth = size - self._sizes.get(key, 0)
+            self._bytes += growth
+            try:
+                self._evict(now)
+            finally:
+                self._bytes -= growth
+            stored = False
+            try:
+                stored = self._inner.put(key, value)
+            finally:
+                if stored:
+                    self._account(key, size, now + ttl if ttl else None)
+                elif key in self._sizes:
+                    self._policy.add(key, self._expires.get(key))
+        return stored
+
+    def delete(self, key):
+        with self._lock:
+            if key not in self._sizes:
+                return False
+            self._drop(key)
+        return True
+
+    def ttl(self, key):
+        # Seconds left before key expires, or None.
+        with self._lock:
+            expires = self._expires.get(key)
+        if expires is None:
+            return None
+        return max(0.0, expires - time.time())
+
+    def keys(self):
+        return self._inner.keys()
+
+    def items(self):
+        return self._inner.items()
+
+    def __len__(self):
+        return len(self._inner)
+
+    def cache_stats(self):
+        with self._lock:
+            self._evict(time.time())
+            return { "policy": self._policy_name, "budget_bytes": self._budget,
+                     "used_bytes": self._bytes, "keys": len(self._sizes),
+                     "hits": self._hits, "misses": self._misses, "refused": self._refused,
+                     "evictions": dict(self._evictions) }
+
+    def serialize(self):
+        result = self._inner.serialize()
+        result["cache"] = self.cache_stats()
+        return result
+
+    def close(self):
+        self._inner.close()
+
+def open_storage(engine, data_dir, address, cache_bytes=0, eviction=None):
+    # One directory per virtual node, named after its address. A non-zero
+    # cache_bytes bounds the backend to that many bytes.
+    name = re.sub(r"[^\w.-]", "_", str(address))
+    if engine == "memory":
+        storage = memoryStorage()
+    elif engine == "log":
+        storage = logStorage(os.path.join(data_dir, name))
+    elif engine == "mmap":
+        storage = segmentStorage(os.path.join(data_dir, name))
+    else:
+        raise ValueError("Unknown storage engine: %s" % engine)
+    if cache_bytes:
+        storage = cacheStorage(storage, cache_bytes, eviction)
+    return storage
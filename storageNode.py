@@ -1,165 +1,520 @@
 #!/usr/bin/env python3
 
 import argparse
+import base64
+import binascii
+import http.client
 import os
 import json
 import re
 import signal
 import socket
 import socketserver
+import random
 import threading
+import time
 from threading import Thread, Lock
 from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
 from baseNode import baseNode
 import configurations as configs
-from address import nodeAddress, networkAddress
+import hashing
+from address import nodeAddress, networkAddress, vnode_address
+from connection import connectionPool, responseStream
+from streams import bodyReader, bodyError, write_chunked
+from storage import open_storage
+from asyncengine import asyncHttpServer
+from admission import pooledHttpServer
+from wire import wireClient, wireServer
 from state import nodeState
+from profiler import sample_stacks, collapsed
+import tracing
 
 node = None
+nodes = {}
 
 class NodeHttpHandler(BaseHTTPRequestHandler):
     global node
 
+    # Keep-alive: peers reuse pooled connections for their RPCs, so every
+    # response must carry a Content-length or be chunked, and every request
+    # body must be consumed, even when the request is rejected.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    timeout = configs.SERVER_KEEPALIVE_TIMEOUT
+
     def log_message(self, format, *args):
         pass
 
-#region RESTFul actions
-    def do_PUT(self):
-        if node.get_state() == False:
-            self.send_whole_response(500, "I have sim-crashed")
+    # The span of the request being served, when it is traced.
+    trace = None
+
+    def log_request(self, code='-', size='-'):
+        # Called by send_response; the status is kept for the metrics.
+        self.status = code
+
+    def send_response(self, code, message=None):
+        super().send_response(code, message)
+        if self.trace is not None:
+            self.send_header(tracing.TRACE_HEADER, self.trace.trace_id)
+
+    def get_node(self):
+        # Peers address a virtual node with the X-Vnode header; plain client
+        # requests go to virtual node 0, which routes them.
+        vnode = self.headers.get("X-Vnode")
+        if vnode is None:
+            return node
+        try:
+            return nodes.get(int(vnode))
+        except ValueError:
+            return None
+
+    def get_nodes(self):
+        # Membership and crash simulation requests without X-Vnode apply to
+        # every virtual node of this process.
+        if self.headers.get("X-Vnode") is None:
+            return list(nodes.values())
+        target = self.get_node()
+        return [target] if target is not None else []
+
+    def unknown_vnode(self):
+        self.send_whole_response(404, "Unknown virtual node: " + str(self.headers.get("X-Vnode")))
 
-        elif self.path.startswith("/storage"):
-            content_length = int(self.headers.get('content-length', 0))
-            key = self.extract_key_from_path(self.path)
-            value = self.rfile.read(content_length)
-            result = node.putKeyValue(key, value)
-            if result is None or result == False:
-                data = { "result": "Could not put data with key ({}) to the network.".format(key) }
-                self.send_whole_response(404, data)
-            else:
-                data = { "result": "Value with key ({}) is stored to the network successfully.".format(key) }
-                self.send_whole_response(200, data)
+#region RESTFul actions
+    # Requests are routed on the first segment of their path through the
+    # tables at the end of the class. A route is a handler called as
+    # handler(self, node, argument, query, body), where argument is the
+    # rest of the path and query the part after "?"; routes registered as
+    # "segment/argument" take a fixed second segment. Only routes marked
+    # for it are served while the node is sim-crashed.
 
     def do_GET(self):
-        if self.path.startswith("/node-info"):
-            node_info_json = json.dumps(node.get_node_info(), indent=2)
-            self.send_whole_response(200, node_info_json, content_type="application/json")
-
-        elif self.path.startswith("/ping"):
-            if node.running() == False:
-                self.send_whole_response(404, False)
-            # elif node.get_state() == False:
-            #     self.send_whole_response(404, False)
-            else:
-                self.send_whole_response(200, node.ping())
+        self.dispatch(self.GET_ROUTES, None)
 
-        elif self.path.startswith("/isStable"):
-            self.send_whole_response(200, node.is_stable())
+    def do_POST(self):
+        self.dispatch(self.POST_ROUTES, bodyReader(self.rfile, self.headers).read())
 
-        elif node.get_state() == False:
+    def do_PUT(self):
+        # Routes read the body themselves, so a large value can be relayed
+        # as it arrives; whatever is left of it is drained afterwards.
+        body = bodyReader(self.rfile, self.headers)
+        try:
+            self.dispatch(self.PUT_ROUTES, body)
+            body.drain()
+        except bodyError as e:
+            print("Dropped a PUT on {}: {}".format(self.path, e))
+            self.close_connection = True
+
+    def dispatch(self, routes, body):
+        segment, argument, query = self.split_path(self.path)
+        name = segment if segment in routes else segment + "/" + argument
+        route = routes.get(name)
+        node = self.get_node()
+        if node is None:
+            self.unknown_vnode()
+        elif node.get_state() == False and (route is None or not route[1]):
             self.send_whole_response(500, "I have sim-crashed")
+        elif route is None:
+            self.send_whole_response(404, "Unknown path: " + self.path)
+        else:
+            self.status = 500
+            self.trace = self.start_trace(node, "/" + name, name in self.TRACE_ROUTES)
+            token = tracing.activate(self.trace) if self.trace is not None else None
+            started = time.perf_counter()
+            try:
+                route[0](self, node, argument, query, body)
+            finally:
+                node.record_request(self.command, "/" + name, int(self.status), time.perf_counter() - started)
+                if self.trace is not None:
+                    tracing.deactivate(token)
+                    self.trace.finish(int(self.status))
+                    self.trace = None
+
+    def start_trace(self, node, name, root):
+        # Requests sent on by a traced request carry its trace id; client
+        # requests on the routes in TRACE_ROUTES start a new trace.
+        trace_id = self.headers.get(tracing.TRACE_HEADER)
+        if not tracing.valid_id(trace_id):
+            if not root or random.random() >= configs.TRACE_SAMPLE_RATE:
+                return None
+            trace_id = None
+        parent_id = self.headers.get(tracing.PARENT_HEADER)
+        return node.server_span(self.command + " " + name, self.client_address[0], trace_id,
+                                parent_id if tracing.valid_id(parent_id) else None)
+
+    def get_node_info(self, node, argument, query, body):
+        node_info = node.get_node_info()
+        if len(nodes) > 1:
+            node_info["vnodes"] = [n.get_identity() for n in nodes.values()]
+        if hasattr(self.server, "admission"):
+            node_info["admission"] = self.server.admission.serialize()
+        node_info_json = json.dumps(node_info, indent=2)
+        self.send_whole_response(200, node_info_json, content_type="application/json")
+
+    def get_ping(self, node, argument, query, body):
+        if node.running() == False:
+            self.send_whole_response(404, False)
+        else:
+            self.send_whole_response(200, node.ping())
 
-        elif self.path.startswith("/storage"):
-            key = self.extract_key_from_path(self.path)
-            result = node.getKey(key)
-            if result is None:
-                #data = { "result": "No content with key ({}) could be found.".format(key) }
-                self.send_whole_response(404, "No object with key '%s' on this node" % key)
-            else:
-                #data = { 'Key': str(key), 'value': str(result) }
-                #result = result.decode("utf-8")
-                self.send_whole_response(200, result,'text/plain')
-
-        elif self.path.startswith("/join"):
-            null_data = { "result": None }
-            id = self.extract_joinKey_from_path(self.path)
-
-            result = node.findSuccessor(id)
-
-            if result is None:
-                self.send_whole_response(404, null_data)
-            else:
-                self.send_whole_response(200, result.serialize())
-
-        elif self.path.startswith("/findsuccessor"):
-            null_data = { "result": None }
-
-            if node.running() == False:
-                self.send_whole_response(404, null_data)
-
-            id = self.extract_findsuccessorKey_from_path(self.path)
-            result = node.findSuccessor(id)
-            if result is None:
-                self.send_whole_response(404, null_data)
-            else:
-                self.send_whole_response(200, result.serialize())
-
-        elif self.path.startswith("/findpredecessor"):
-            null_data = { "result": None }
-            
-            if node.running() == False:
-                self.send_whole_response(404, null_data)
-
-            id = self.extract_findpredecessorKey_from_path(self.path)
-            result = node.get_predecessor()
-            if result is None:
-                self.send_whole_response(404, null_data)
-            else:
-                self.send_whole_response(200, result.serialize())
-
-        elif self.path.startswith("/fingertable"):
-            self.send_whole_response(200, node.get_fingertable())
+    def get_is_stable(self, node, argument, query, body):
+        self.send_whole_response(200, node.is_stable())
 
-        elif self.path.startswith("/neighbors"):
-            self.send_whole_response(200, node.get_neighbors())
+    def get_cache_stats(self, node, argument, query, body):
+        stats = node.get_cache_stats()
+        if stats is None:
+            self.send_whole_response(404, "Cache mode is off")
+        else:
+            self.send_whole_response(200, stats)
+
+    def get_metrics(self, node, argument, query, body):
+        extra = []
+        if hasattr(self.server, "admission"):
+            admission = self.server.admission.serialize()
+            for klass, count in admission["active"].items():
+                extra.append(("chord_admission_active", (("class", klass),), count))
+            for klass, count in admission["rejected"].items():
+                extra.append(("chord_admission_rejected_total", (("class", klass),), count))
+        self.send_whole_response(200, node.render_metrics(extra), "text/plain; version=0.0.4")
+
+    def get_traces(self, node, argument, query, body):
+        # /traces lists the traces started here; /traces?trace=ID gives the
+        # spans of one, and with follow=1 those recorded on the other nodes
+        # it went through as well.
+        params = parse_qs(query)
+        trace_id = params.get("trace", [None])[0]
+        if trace_id is None:
+            try:
+                limit = int(params.get("limit", ["20"])[0])
+            except ValueError:
+                limit = 20
+            self.send_whole_response(200, node.get_traces(limit))
+        elif not tracing.valid_id(trace_id):
+            self.send_whole_response(400, "Malformed trace id")
+        else:
+            self.send_whole_response(200, node.collectTrace(trace_id, self.query_flag(query, "follow")))
+
+    def get_profile(self, node, argument, query, body):
+        # Samples every thread of the process for ?seconds=N (default 5)
+        # and answers with their collapsed stacks.
+        try:
+            seconds = float(parse_qs(query).get("seconds", ["5"])[0])
+        except ValueError:
+            seconds = -1
+        if not 0 < seconds <= configs.PROFILE_MAX_SECONDS:
+            self.send_whole_response(400, "seconds must be between 0 and %d" % configs.PROFILE_MAX_SECONDS)
+            return
+        counts = sample_stacks(seconds)
+        if counts is None:
+            self.send_whole_response(409, "A profile is already running")
+        else:
+            self.send_whole_response(200, collapsed(counts))
 
+    def get_timings(self, node, argument, query, body):
+        timings = node.get_timings()
+        if timings is None:
+            self.send_whole_response(404, "Timings are off, see --timings")
         else:
-            self.send_whole_response(404, "Unknown path: " + self.path)
+            self.send_whole_response(200, timings)
+
+    def get_storage(self, node, key, query, body):
+        result = node.getKey(key, stream=True)
+        if result is None:
+            self.send_whole_response(404, "No object with key '%s' on this node" % key)
+        elif isinstance(result, responseStream):
+            self.send_stream_response(200, result, 'text/plain')
+        else:
+            self.send_whole_response(200, result, 'text/plain')
+
+    def get_local_storage(self, node, key, query, body):
+        result = node.getLocalKey(key)
+        if self.query_flag(query, "check") and not node.isResponsible(node.getKeyHash(key)):
+            self.send_whole_response(421, "Key '%s' is not owned by this node" % key)
+        elif result is None:
+            self.send_whole_response(404, "No object with key '%s' on this node" % key,
+                    headers=self.replica_headers(node))
+        else:
+            self.send_whole_response(200, result, 'text/plain', headers=self.replica_headers(node))
 
-    def do_POST(self):
-        content_length = int(self.headers.get('content-length', 0))
-        if self.path == "/sim-recover":
-            node.set_state(nodeState.STABLE)
-            self.send_whole_response(200, "")
-            
-        elif self.path == "/sim-crash":
-            node.set_state(nodeState.CRASHED)
-            self.send_whole_response(200, "")
-
-        elif node.get_state() == False:
-            self.send_whole_response(500, "I have sim-crashed")
+    def get_replica_storage(self, node, key, query, body):
+        result = node.getLocalKey(key)
+        if result is None:
+            self.send_whole_response(404, "No object with key '%s' on this node" % key)
+        else:
+            self.send_whole_response(200, result, 'text/plain')
+
+    def get_join(self, node, id, query, body):
+        id = self.parse_id(id)
+        if id is None:
+            return
+        result = node.findSuccessor(id)
+        if result is None:
+            self.send_whole_response(404, { "result": None })
+        else:
+            self.send_whole_response(200, result.serialize())
+
+    def get_find_successor(self, node, id, query, body):
+        id = self.parse_id(id)
+        if id is None:
+            return
+        if node.running() == False:
+            self.send_whole_response(404, { "result": None })
+            return
+        result, hops, start = node.findSuccessorWithHops(id)
+        if result is None:
+            self.send_whole_response(404, { "result": None })
+        else:
+            data = result.serialize()
+            data["hops"] = hops
+            data["start"] = start
+            self.send_whole_response(200, data)
+
+    def get_find_next(self, node, id, query, body):
+        id = self.parse_id(id)
+        if id is None:
+            return
+        if node.running() == False:
+            self.send_whole_response(404, { "result": None })
+            return
+        done, result, start = node.lookupStep(id)
+        data = result.serialize()
+        data["done"] = done
+        data["start"] = start
+        self.send_whole_response(200, data)
+
+    def get_find_predecessor(self, node, argument, query, body):
+        result = node.get_predecessor() if node.running() != False else None
+        if result is None:
+            self.send_whole_response(404, { "result": None })
+        else:
+            self.send_whole_response(200, result.serialize())
 
-        elif self.path.startswith("/notify"):
-            value = self.rfile.read(content_length).decode('utf-8')
-            node.notify(value)
+    def get_neighborhood(self, node, argument, query, body):
+        self.send_whole_response(200, node.get_neighborhood())
 
-        elif self.path.startswith("/informPredecessor"):
-            value = self.rfile.read(content_length).decode('utf-8')
-            node.changeSuccessor(value)
+    def get_fingertable(self, node, argument, query, body):
+        self.send_whole_response(200, node.get_fingertable())
 
-        elif self.path.startswith("/informSuccessor"):
-            value = self.rfile.read(content_length).decode('utf-8')
-            node.changePredecessor(value)
+    def get_lookup_stats(self, node, argument, query, body):
+        self.send_whole_response(200, node.get_lookup_stats())
 
-        elif self.path.startswith("/leave"):
-            node.leave()
-            self.send_whole_response(200, "")
+    def get_neighbors(self, node, argument, query, body):
+        self.send_whole_response(200, node.get_neighbors())
 
-        elif self.path.startswith("/join"):
-            nprime = re.sub(r'^/join\?nprime=([\w:-]+)$', r'\1', self.path)
-            node.join(nprime)
-            self.send_whole_response(200, "")
+    def put_storage(self, node, key, query, body):
+        try:
+            ttl = self.extract_ttl(self.path)
+        except ValueError:
+            self.send_whole_response(400, "TTL must be a non-negative number of seconds")
+            return
+        if body.length is not None and body.length <= configs.STREAM_MIN_BYTES:
+            result = node.putKeyValue(key, body.read(), ttl)
+        else:
+            result = node.putKeyStream(key, body, ttl)
+        if result is None or result == False:
+            data = { "result": "Could not put data with key ({}) to the network.".format(key) }
+            self.send_whole_response(404, data)
+        else:
+            data = { "result": "Value with key ({}) is stored to the network successfully.".format(key) }
+            self.send_whole_response(200, data)
+
+    def put_local_storage(self, node, key, query, body):
+        # Internal: the sender already resolved this node as the owner.
+        try:
+            ttl = self.extract_ttl(self.path)
+        except ValueError:
+            self.send_whole_response(400, "TTL must be a non-negative number of seconds")
+            return
+        if self.query_flag(query, "check") and not node.isResponsible(node.getKeyHash(key)):
+            self.send_whole_response(421, "Key '%s' is not owned by this node" % key)
+        elif node.storeKeyValue(key, body.read(), ttl):
+            self.send_whole_response(200, { "result": "stored" }, headers=self.replica_headers(node))
+        else:
+            self.send_whole_response(500, { "result": None })
+
+    def put_replica_storage(self, node, key, query, body):
+        try:
+            ttl = self.extract_ttl(self.path)
+        except ValueError:
+            self.send_whole_response(400, "TTL must be a non-negative number of seconds")
+            return
+        if node.insertLocalKeyVal(key, body.read(), ttl):
+            self.send_whole_response(200, { "result": "stored" })
+        else:
+            self.send_whole_response(500, { "result": None })
+
+    def post_sim_recover(self, node, argument, query, body):
+        for target in self.get_nodes():
+            target.set_state(nodeState.STABLE)
+        self.send_whole_response(200, "")
+
+    def post_sim_crash(self, node, argument, query, body):
+        for target in self.get_nodes():
+            target.set_state(nodeState.CRASHED)
+        self.send_whole_response(200, "")
+
+    def post_notify(self, node, argument, query, body):
+        node.notify(body.decode('utf-8'))
+        self.send_whole_response(200, "")
+
+    def post_inform_predecessor(self, node, argument, query, body):
+        node.changeSuccessor(body.decode('utf-8'))
+        self.send_whole_response(200, "")
+
+    def post_inform_successor(self, node, argument, query, body):
+        node.changePredecessor(body.decode('utf-8'))
+        self.send_whole_response(200, "")
+
+    def post_mget(self, node, argument, query, body):
+        request = self.parse_batch(body, "keys", list)
+        if request is not None:
+            results = node.multiGet(request["keys"])
+            items = { key: self.encode_value(results.get(key), request) for key in request["keys"] }
+            missing = [key for key, value in items.items() if value is None]
+            self.send_whole_response(200, { "items": items, "missing": missing })
+
+    def post_mput(self, node, argument, query, body):
+        request = self.parse_batch(body, "items", dict)
+        items = self.decode_values(request) if request is not None else None
+        if items is not None:
+            failed = node.multiPut(items, request.get("ttl"))
+            data = { "stored": len(items) - len(failed), "failed": failed }
+            self.send_whole_response(404 if failed else 200, data)
+
+    def post_local_mget(self, node, argument, query, body):
+        # Internal: one owner's share of a client _mget.
+        request = self.parse_internal(body, "keys", list)
+        if request is None:
+            return
+        owned, moved = self.split_owned(node, request["keys"], request.get("check"))
+        items = {}
+        for key in owned:
+            value = node.getLocalKey(key)
+            items[key] = None if value is None else base64.b64encode(value).decode()
+        self.send_whole_response(200, { "items": items, "moved": moved },
+                headers=self.replica_headers(node))
+
+    def post_local_mput(self, node, argument, query, body):
+        # Internal: one owner's share of a client _mput.
+        request = self.parse_internal(body, "items", dict)
+        items = self.decode_internal(request)
+        if items is None:
+            return
+        owned, moved = self.split_owned(node, list(items), request.get("check"))
+        items = { key: items[key] for key in owned }
+        if node.storeBatch(items, request.get("ttl")):
+            self.send_whole_response(200, { "stored": owned, "moved": moved },
+                    headers=self.replica_headers(node))
+        else:
+            self.send_whole_response(500, { "result": None })
+
+    def post_replica_mput(self, node, argument, query, body):
+        request = self.parse_internal(body, "items", dict)
+        items = self.decode_internal(request)
+        if items is None:
+            return
+        if all(node.insertLocalKeyVal(key, value, request.get("ttl"))
+               for key, value in items.items()):
+            self.send_whole_response(200, { "result": "stored" })
+        else:
+            self.send_whole_response(500, { "result": None })
+
+    def post_handoff_pull(self, node, argument, query, body):
+        request = self.parse_internal(body, "identity", int)
+        if request is None:
+            return
+        self.send_whole_response(200, node.handoffBatch(request["identity"], request.get("offset", 0)))
+
+    def post_handoff_release(self, node, argument, query, body):
+        request = self.parse_internal(body, "identity", int)
+        if request is None:
+            return
+        node.handoffRelease(request["identity"])
+        self.send_whole_response(200, "")
+
+    def post_handoff_push(self, node, argument, query, body):
+        request = self.parse_internal(body, "items", list)
+        if request is None:
+            return
+        try:
+            stored = node.handoffStore(request["items"])
+        except (TypeError, ValueError, IndexError):
+            self.send_whole_response(400, "Expected [hash key, base64 value, ...] items")
+            return
+        self.send_whole_response(200 if stored else 500, "")
+
+    def post_leave(self, node, argument, query, body):
+        for target in self.get_nodes():
+            target.leave()
+        self.send_whole_response(200, "")
+
+    def post_join(self, node, argument, query, body):
+        nprime = query[len("nprime="):] if query.startswith("nprime=") else query
+        for target in self.get_nodes():
+            target.join(nprime)
+        self.send_whole_response(200, "")
+
+    # segment: (handler, served while sim-crashed)
+    GET_ROUTES = {
+        "node-info":        (get_node_info, True),
+        "ping":             (get_ping, True),
+        "isStable":         (get_is_stable, True),
+        "cache-stats":      (get_cache_stats, True),
+        "metrics":          (get_metrics, True),
+        "traces":           (get_traces, True),
+        "debug/profile":    (get_profile, True),
+        "debug/timings":    (get_timings, True),
+        "storage":          (get_storage, False),
+        "local-storage":    (get_local_storage, False),
+        "replica-storage":  (get_replica_storage, False),
+        "join":             (get_join, False),
+        "findsuccessor":    (get_find_successor, False),
+        "findnext":         (get_find_next, False),
+        "findpredecessor":  (get_find_predecessor, False),
+        "neighborhood":     (get_neighborhood, False),
+        "fingertable":      (get_fingertable, False),
+        "lookup-stats":     (get_lookup_stats, False),
+        "neighbors":        (get_neighbors, False),
+    }
+
+    # Client requests that start a trace at the node they enter at.
+    TRACE_ROUTES = ("storage", "storage/_mget", "storage/_mput")
+
+    PUT_ROUTES = {
+        "storage":          (put_storage, False),
+        "local-storage":    (put_local_storage, False),
+        "replica-storage":  (put_replica_storage, False),
+    }
+
+    POST_ROUTES = {
+        "sim-recover":              (post_sim_recover, True),
+        "sim-crash":                (post_sim_crash, True),
+        "notify":                   (post_notify, False),
+        "informPredecessor":        (post_inform_predecessor, False),
+        "informSuccessor":          (post_inform_successor, False),
+        "storage/_mget":            (post_mget, False),
+        "storage/_mput":            (post_mput, False),
+        "local-storage/_mget":      (post_local_mget, False),
+        "local-storage/_mput":      (post_local_mput, False),
+        "replica-storage/_mput":    (post_replica_mput, False),
+        "handoff/pull":             (post_handoff_pull, False),
+        "handoff/release":          (post_handoff_release, False),
+        "handoff/push":             (post_handoff_push, False),
+        "leave":                    (post_leave, False),
+        "join":                     (post_join, False),
+    }
 #end region
 
 #region methods
-    def send_whole_response(self, code, content, content_type="text/plain"):
+    def send_whole_response(self, code, content, content_type="text/plain", headers=None):
         if isinstance(content, str):
             content = content.encode("utf-8")
             if not content_type:
                 content_type = "text/plain"
             if content_type.startswith("text/"):
                 content_type += "; charset=utf-8"
-        elif isinstance(content, bytes):
+        elif isinstance(content, (bytes, memoryview)):
+            # A memoryview is a value mapped by the storage, sent without a copy.
             if not content_type:
                 content_type = "application/octet-stream"
         elif isinstance(content, object):
@@ -171,33 +526,153 @@ class NodeHttpHandler(BaseHTTPRequestHandler):
         self.send_response(code)
         self.send_header('Content-type', content_type)
         self.send_header('Content-length',len(content))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
         self.wfile.write(content)
 
-    def check_route(self, route):
-        if (self.path == node): 
-            return False
-        if self.path.lower().startswith(route.lower()):
-            return True
-        return False
-
-    def extract_key_from_path(self, path):
-        return re.sub(r'/storage/?(\w+)', r'\1', path)
-
-    def extract_joinKey_from_path(self, path):
-        return re.sub(r'/join/?(\w+)', r'\1', path)
-
-    def extract_findsuccessorKey_from_path(self, path):
-        result = re.sub(r'/findsuccessor/?(\w+)', r'\1', path)
-        return result
-
-    def extract_findpredecessorKey_from_path(self, path):
-        return re.sub(r'/findpredecessor/?(\w+)', r'\1', path)
-
-    def extract_info_from_route(self, path, specialPart):
-        regEx = r'{0}?(\w+)'.format(specialPart)
-        result = re.sub(regEx, r'\1', path)
-        return result
+    def send_stream_response(self, code, stream, content_type="application/octet-stream"):
+        # Relays a connection.responseStream chunk by chunk, with chunked
+        # encoding when its length is unknown. Once the headers are out an
+        # error can only be reported by closing the connection early.
+        chunked = stream.length is None and self.request_version == "HTTP/1.1"
+        self.send_response(code)
+        self.send_header('Content-type', content_type)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        elif stream.length is not None:
+            self.send_header('Content-length', stream.length)
+        else:
+            self.close_connection = True
+        self.end_headers()
+        try:
+            if chunked:
+                write_chunked(self.wfile, stream.chunks())
+            else:
+                for data in stream.chunks():
+                    self.wfile.write(data)
+        except (http.client.HTTPException, OSError):
+            self.close_connection = True
+        finally:
+            stream.close()
+
+    def replica_headers(self, node):
+        # Tells the sender where this owner keeps copies of its range.
+        replicas = node.get_replica_targets()
+        if not replicas:
+            return None
+        return { "X-Replicas": ",".join(str(r.get_address()) for r in replicas) }
+
+    def parse_batch(self, body, field, kind):
+        # Validates the body of a client _mget/_mput request. On a malformed
+        # one the error response is sent and None returned.
+        try:
+            request = json.loads(body)
+        except ValueError:
+            request = None
+        if not isinstance(request, dict) or not isinstance(request.get(field), kind):
+            self.send_whole_response(400, "Expected a JSON object with '%s'" % field)
+            return None
+        if request.get("encoding", "utf-8") not in ("utf-8", "base64"):
+            self.send_whole_response(400, "Unknown encoding: %s" % request["encoding"])
+            return None
+        keys = request[field]
+        if len(keys) > configs.BATCH_MAX_KEYS:
+            self.send_whole_response(413, "At most %d keys per request" % configs.BATCH_MAX_KEYS)
+            return None
+        if not all(isinstance(key, str) and re.fullmatch(r'\w+', key) for key in keys):
+            self.send_whole_response(400, "Keys must be non-empty words")
+            return None
+        ttl = request.get("ttl")
+        if ttl is not None and (isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl < 0):
+            self.send_whole_response(400, "TTL must be a non-negative number of seconds")
+            return None
+        return request
+
+    def parse_id(self, argument):
+        # The ring identifier a lookup asks about, or None, with 400 sent,
+        # when it is not a number.
+        try:
+            return int(argument)
+        except ValueError:
+            self.send_whole_response(400, "Expected a numeric identifier, got '%s'" % argument)
+            return None
+
+    def parse_internal(self, body, field, kind):
+        # The body of a batch or handoff request from a peer. On a malformed
+        # one 400 is sent and None returned.
+        try:
+            request = json.loads(body)
+        except ValueError:
+            request = None
+        if not isinstance(request, dict) or not isinstance(request.get(field), kind):
+            self.send_whole_response(400, "Expected a JSON object with '%s'" % field)
+            return None
+        return request
+
+    def decode_internal(self, request):
+        # The base64 values of a parsed internal _mput, or None, with 400
+        # sent, when one does not decode.
+        if request is None:
+            return None
+        try:
+            return { key: base64.b64decode(value, validate=True) for key, value in request["items"].items() }
+        except (TypeError, ValueError):
+            self.send_whole_response(400, "Values must be base64")
+            return None
+
+    def encode_value(self, value, request):
+        if value is None:
+            return None
+        if request.get("encoding") == "base64":
+            return base64.b64encode(value).decode()
+        return str(value, "utf-8", errors="replace")
+
+    def decode_values(self, request):
+        items = {}
+        try:
+            for key, value in request["items"].items():
+                if request.get("encoding") == "base64":
+                    items[key] = base64.b64decode(value, validate=True)
+                else:
+                    items[key] = value.encode("utf-8")
+        except (AttributeError, TypeError, binascii.Error):
+            self.send_whole_response(400, "Invalid value for key '%s'" % key)
+            return None
+        return items
+
+    def split_owned(self, node, keys, check):
+        # Without a check the sender vouches for the owner; with one, keys
+        # outside this node's range are sent back to be routed again.
+        if not check:
+            return keys, []
+        owned, moved = [], []
+        for key in keys:
+            (owned if node.isResponsible(node.getKeyHash(key)) else moved).append(key)
+        return owned, moved
+
+    def split_path(self, path):
+        # "/segment/argument?query" -> ("segment", "argument", "query")
+        path, _, query = path.partition("?")
+        segment, _, argument = path[1:].partition("/")
+        return segment, argument, query
+
+    def query_flag(self, query, name):
+        return bool(query) and parse_qs(query).get(name) == ["1"]
+
+    def extract_ttl(self, path):
+        # The ttl query parameter, or the X-TTL header of a client PUT, in
+        # seconds. Raises ValueError when it is not a non-negative number.
+        query = path.partition("?")[2]
+        ttl = parse_qs(query).get("ttl", [None])[0] if query else None
+        if ttl is None:
+            ttl = self.headers.get("X-TTL")
+        if ttl is None:
+            return None
+        ttl = float(ttl)
+        if not ttl >= 0 or ttl == float("inf"):
+            raise ValueError(ttl)
+        return ttl
 
 #end region
 
@@ -213,45 +688,169 @@ def arg_parser():
                 "in case we forget or fail to kill it, " +
                 "default %d (%d minutes)" % (configs.DIE_AFTER_SECONDS_DEFAULT, configs.DIE_AFTER_SECONDS_DEFAULT/60))
 
+    parser.add_argument("--m-bits", type=int, default = configs.M_BITS,
+            help="identifier space width in bits, the same on every node, default %d" % configs.M_BITS)
+
+    parser.add_argument("--hash", choices=sorted(set(hashing.HASH_FUNCTIONS) | {"xxhash"}),
+            default = configs.HASH_FUNCTION,
+            help="hash placing nodes and keys on the ring, the same on every node, default %s" % configs.HASH_FUNCTION)
+
+    parser.add_argument("--lookup-mode", choices=["recursive", "iterative"],
+            default = configs.LOOKUP_MODE,
+            help="how findSuccessor walks the ring, default %s" % configs.LOOKUP_MODE)
+
+    parser.add_argument("--engine", choices=["threading", "pooled", "asyncio"],
+            default = configs.SERVER_ENGINE,
+            help="thread per request, a fixed pool of workers with admission control, " +
+                "or an asyncio event loop doing lookups and storage requests " +
+                "without blocking, default %s" % configs.SERVER_ENGINE)
+
+    parser.add_argument("--storage", choices=["memory", "log", "mmap"],
+            default = configs.STORAGE_ENGINE,
+            help="keep keys in memory only, also in a write-ahead log with " +
+                "snapshots, or in memory-mapped segment files under --data-dir, " +
+                "default %s" % configs.STORAGE_ENGINE)
+
+    parser.add_argument("--data-dir", type=str, default = configs.STORAGE_DIR,
+            help="directory of the log storage, default %s" % configs.STORAGE_DIR)
+
+    parser.add_argument("--fsync", choices=["always", "batched", "never"],
+            default = configs.STORAGE_FSYNC,
+            help="when the log storage syncs its writes to disk, default %s" % configs.STORAGE_FSYNC)
+
+    parser.add_argument("--cache-bytes", type=int, default = configs.CACHE_BYTES,
+            help="run as a cache: bound each virtual node's storage to this many " +
+                "bytes, evicting keys to stay under it, default %d (off)" % configs.CACHE_BYTES)
+
+    parser.add_argument("--eviction", choices=["lru", "lfu", "ttl"],
+            default = configs.CACHE_EVICTION,
+            help="which key a cache evicts first: least recently used, least " +
+                "frequently used, or closest to expiring, default %s" % configs.CACHE_EVICTION)
+
+    parser.add_argument("--default-ttl", type=float, default = configs.CACHE_DEFAULT_TTL,
+            help="seconds before a key put without a TTL expires in a cache, " +
+                "default %g (never)" % configs.CACHE_DEFAULT_TTL)
+
+    parser.add_argument("--wire", action="store_true", default = configs.WIRE_ENABLED,
+            help="also serve a binary protocol on port + %d, and use it for ring " % configs.WIRE_PORT_OFFSET +
+                "maintenance with the peers that serve it too")
+
+    parser.add_argument("--timings", action="store_true", default = configs.PROFILE_TIMINGS,
+            help="count calls to and time spent in findSuccessor, closestPrecedingNode " +
+                "and storage access, shown by GET /debug/timings and /metrics")
+
+    parser.add_argument("--trace-sample", type=float, default = configs.TRACE_SAMPLE_RATE,
+            help="fraction of client requests traced from this node, default %g; " % configs.TRACE_SAMPLE_RATE +
+                "requests that come with an X-Trace-Id are always traced")
+
+    parser.add_argument("--vnodes", type=int, default = configs.VIRTUAL_NODES,
+            help="virtual nodes hosted by this process, default %d" % configs.VIRTUAL_NODES)
+
+    parser.add_argument("--weight", type=float, default = configs.NODE_WEIGHT,
+            help="scales the number of virtual nodes, so bigger machines take " +
+                "a larger share of the ring, default %.1f" % configs.NODE_WEIGHT)
+
+    parser.add_argument("--replicas", type=int, default = configs.REPLICATION_FACTOR,
+            help="copies of each key, the owner included, default %d" % configs.REPLICATION_FACTOR)
+
+    parser.add_argument("--write-quorum", type=int, default = configs.WRITE_QUORUM,
+            help="copies written before a PUT succeeds, default %d" % configs.WRITE_QUORUM)
+
+    parser.add_argument("--read-from-replicas", action="store_true",
+            default = configs.READ_FROM_REPLICAS,
+            help="spread GETs over the owner and its replicas")
+
     parser.add_argument("remote", type=str, nargs="*",
             help="addresses (host:port) of a DHT node")
 
     return parser
 
 class ThreadingHttpServer(socketserver.ThreadingMixIn, HTTPServer):
-    pass
+    # Handler threads idle on keep-alive connections until the peer hangs
+    # up; they must not keep the process alive once the server shut down.
+    daemon_threads = True
+
+    def process_request_thread(self, request, client_address):
+        threading.current_thread().name = "http-handler"
+        super().process_request_thread(request, client_address)
 
 def run_server(args):
     global server
     global node
 
+    configs.LOOKUP_MODE = args.lookup_mode
+    configs.REPLICATION_FACTOR = max(1, args.replicas)
+    configs.WRITE_QUORUM = max(1, min(args.write_quorum, configs.REPLICATION_FACTOR))
+    configs.READ_FROM_REPLICAS = args.read_from_replicas
+    configs.STORAGE_FSYNC = args.fsync
+    configs.CACHE_DEFAULT_TTL = max(0, args.default_ttl)
+    configs.TRACE_SAMPLE_RATE = min(1.0, max(0.0, args.trace_sample))
+
     host = networkAddress().get_host_address()
     print(host)
-    server = ThreadingHttpServer(('', args.port), NodeHttpHandler)
-    node = baseNode(nodeAddress("{}:{}".format(host, args.port)))
+    if args.engine == "asyncio":
+        server = asyncHttpServer(('', args.port), NodeHttpHandler, nodes)
+    elif args.engine == "pooled":
+        server = pooledHttpServer(('', args.port), NodeHttpHandler)
+    else:
+        server = ThreadingHttpServer(('', args.port), NodeHttpHandler)
+
+    wire_server = None
+    wire_client = None
+    if args.wire:
+        wire_server = wireServer(('', args.port + configs.WIRE_PORT_OFFSET), nodes)
+        wire_client = wireClient()
+
+    # All virtual nodes share the servers and the connection pools.
+    host_port = "{}:{}".format(host, args.port)
+    pool = connectionPool()
+    for i in range(max(1, round(args.vnodes * args.weight))):
+        address = vnode_address(host_port, i)
+        storage = open_storage(args.storage, args.data_dir, address, args.cache_bytes, args.eviction)
+        nodes[i] = baseNode(nodeAddress(address), pool=pool, storage=storage, wire_client=wire_client)
+        if args.timings:
+            nodes[i].enable_timings()
+    node = nodes[0]
     remoteAddress = args.remote
 
     def server_main():
-        print("Starting server on address {} with identity {}.".format(node.get_address(), node.get_identity()))
+        for vnode in nodes.values():
+            print("Starting server on address {} with identity {}.".format(vnode.get_address(), vnode.get_identity()))
         if remoteAddress:
             print("connect to {} to join network.".format(remoteAddress))
+        if wire_server is not None:
+            print("Binary protocol on port {}.".format(wire_server.server_address[1]))
+            wire_thread = threading.Thread(target=wire_server.serve_forever, name="wire-server")
+            wire_thread.daemon = True
+            wire_thread.start()
 
         server.serve_forever()
         print("Server has shut down")
 
+    def start_nodes():
+        # Virtual node 0 joins the given ring (or starts a new one); the
+        # others join through it when there is no remote to join.
+        remote = remoteAddress[0] if remoteAddress else None
+        node.start(remote)
+        for vnode in list(nodes.values())[1:]:
+            vnode.start(remote or host_port)
+
     def shutdown_server_on_signal(signum, frame):
         print("We get signal (%s). Asking server to shut down" % signum)
-        node.leave()
-        node.dispose()
+        for vnode in nodes.values():
+            vnode.leave()
+            vnode.dispose()
+        if wire_server is not None:
+            wire_server.shutdown()
         server.shutdown()
 
     # Start server in a new thread, because server HTTPServer.serve_forever()
     # and HTTPServer.shutdown() must be called from separate threads
-    thread = threading.Thread(target=server_main)
+    thread = threading.Thread(target=server_main, name="http-server")
     thread.daemon = True
     thread.start()
 
-    join_thread = threading.Thread(target=node.start, args=(remoteAddress))
+    join_thread = threading.Thread(target=start_nodes, name="join")
     join_thread.daemon = True
     join_thread.start()
 
@@ -279,4 +878,8 @@ if __name__ == "__main__":
 
     parser = arg_parser()
     args = parser.parse_args()
+    try:
+        hashing.configure(args.m_bits, args.hash)
+    except ValueError as e:
+        parser.error(str(e))
     run_server(args)
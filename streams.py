@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import configurations as configs
+
+class bodyError(Exception):
+    """The client sent a malformed body or went away while sending it. Kept
+    apart from OSError so that relaying the body does not blame the peer it
+    is relayed to."""
+
+class bodyReader:
+    """Reads the body of an HTTP request from the handler's rfile, framed by
+    Content-Length or by chunked transfer encoding.
+
+    chunks() hands the body out STREAM_CHUNK_BYTES at a time, so it can be
+    relayed without ever holding all of it; read() returns it whole.
+    """
+
+    def __init__(self, rfile, headers):
+        self._rfile = rfile
+        self.chunked = "chunked" in headers.get("Transfer-Encoding", "").lower()
+        self.length = None if self.chunked else int(headers.get("Content-Length") or 0)
+        # Bytes left in the body, or in the current chunk of a chunked one.
+        self._left = 0 if self.chunked else self.length
+        self._done = not self.chunked and self.length == 0
+
+    def _next_chunk(self):
+        line = self._rfile.readline(1024)
+        try:
+            size = int(line.split(b";", 1)[0], 16)
+        except ValueError:
+            raise bodyError("Malformed chunk size: %r" % line)
+        if size == 0:
+            # The last chunk; skip the trailers up to the blank line.
+            while self._rfile.readline(65536) not in (b"\r\n", b"\n", b""):
+                pass
+        return size
+
+    def read1(self, size=None):
+        # Up to size bytes of the body, b"" once it is all read.
+        try:
+            return self._read1(size)
+        except OSError as e:
+            raise bodyError(str(e))
+
+    def _read1(self, size):
+        if self._done:
+            return b""
+        if self._left == 0:
+            self._left = self._next_chunk()
+            if self._left == 0:
+                self._done = True
+                return b""
+        wanted = min(size or configs.STREAM_CHUNK_BYTES, self._left)
+        data = self._rfile.read(wanted)
+        if len(data) < wanted:
+            raise bodyError("Request body ended early")
+        self._left -= len(data)
+        if self._left == 0:
+            if self.chunked:
+                self._rfile.readline(16)
+            else:
+                self._done = True
+        return data
+
+    def chunks(self, size=None):
+        while True:
+            data = self.read1(size)
+            if not data:
+                return
+            yield data
+
+    def read(self):
+        if self.chunked:
+            return b"".join(self.chunks())
+        return self.read1(self._left)
+
+    def drain(self):
+        for _ in self.chunks():
+            pass
+
+def write_chunked(wfile, chunks):
+    # Sends chunks with chunked transfer encoding, then the last chunk.
+    for data in chunks:
+        if data:
+            wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+    wfile.write(b"0\r\n\r\n")
@@ -91,6 +91,7 @@ class TestNodes:
 		self.default_port = configs.START_PORT_FROM
 		self.unstable_nodes = {}
 		self.host_address = networkAddress().get_host_address()
+		self.node_count = min(configs.DHT_SIZE, configs.TEST_NODE_COUNT)
 
 	def generate_key(self, default):
 		port = configs.START_PORT_FROM if default == 0 else (random.randrange(configs.START_PORT_FROM + 1, configs.PORT_NUMBER_RANGE))
@@ -109,7 +110,7 @@ class TestNodes:
 
 	def start_stand_alone(self):
 		i = 0
-		while i < configs.DHT_SIZE:
+		while i < self.node_count:
 			port = self.generate_ports(default = 0 if i == 0 else 1)
 			self._threads[i] = threading.Thread(target=self._run_stand_alone, args=[port])
 			print("Port number: {} - counter {}".format(port, i))
@@ -172,7 +173,7 @@ class TestNodes:
 		print()
 
 	def check_leave_statbility(self):
-		keys = random.sample(list(self.generated_keys), 1 if configs.DHT_SIZE==1 else int(configs.DHT_SIZE/2))
+		keys = random.sample(list(self.generated_keys), 1 if self.node_count==1 else int(self.node_count/2))
 		left_keys = { k : self.generated_keys[k] for k in set(self.generated_keys) - set(keys) }
 		running = True
 		r = Request()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+# Tests for the addresses of virtual nodes. Run with
+# "python -m pytest test_address.py" or "python test_address.py".
+
+import unittest
+from address import nodeAddress, vnode_address, split_vnode
+
+class vnodeAddressTest(unittest.TestCase):
+
+    def test_vnode_zero_keeps_the_plain_address(self):
+        self.assertEqual(vnode_address("127.0.0.1:3000", 0), "127.0.0.1:3000")
+        self.assertEqual(split_vnode("127.0.0.1:3000"), ("127.0.0.1:3000", 0))
+
+    def test_round_trip(self):
+        for host_port in ("127.0.0.1:3000", "node-7.example:8080", "[::1]:3000"):
+            for index in (0, 1, 15):
+                address = vnode_address(host_port, index)
+                self.assertEqual(split_vnode(address), (host_port, index))
+        self.assertEqual(vnode_address("127.0.0.1:3000", 3), "127.0.0.1:3000#3")
+
+    def test_accepts_address_objects(self):
+        address = nodeAddress(vnode_address(nodeAddress("127.0.0.1:3000"), 2))
+        self.assertEqual(split_vnode(address), ("127.0.0.1:3000", 2))
+
+    def test_malformed_index(self):
+        with self.assertRaises(ValueError):
+            split_vnode("127.0.0.1:3000#x")
+
+if __name__ == "__main__":
+    unittest.main()
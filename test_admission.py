@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Tests for the admission control of the pooled server engine. Run with
+# "python -m pytest test_admission.py" or "python test_admission.py".
+
+import http.client
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler
+from admission import pooledHttpServer, route_class, MAINTENANCE, INTERNAL, CLIENT, ADMIN
+
+class routeClassTest(unittest.TestCase):
+
+    def test_ring_maintenance(self):
+        for path in ("/ping", "/notify", "/neighborhood", "/findpredecessor",
+                     "/informPredecessor", "/informSuccessor", "/ping?probe=1"):
+            self.assertEqual(route_class(path), MAINTENANCE, path)
+
+    def test_internal_hops(self):
+        for path in ("/findsuccessor/123", "/findnext/123", "/local-storage/key?check=1",
+                     "/local-storage/_mget", "/replica-storage/key", "/replica-storage/_mput"):
+            self.assertEqual(route_class(path), INTERNAL, path)
+
+    def test_client_requests(self):
+        for path in ("/storage/key", "/storage/_mget", "/storage/key?ttl=5"):
+            self.assertEqual(route_class(path), CLIENT, path)
+
+    def test_everything_else_limited(self):
+        for path in ("/debug/profile?seconds=30", "/traces?follow=1", "/join?nprime=a:1", "/leave",
+                     "/handoff/pull", "/metrics", "/node-info", "/pingpong", "/storagex/key",
+                     "/unknown", "/"):
+            self.assertEqual(route_class(path), ADMIN, path)
+
+class stubHandler(BaseHTTPRequestHandler):
+    # Answers every request with 200; /debug/profile only once the test
+    # lets it go.
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.startswith("/debug/profile"):
+            self.server.release.wait(10)
+        self.send_whole_response(200, "ok")
+
+    def send_whole_response(self, code, content, content_type="text/plain", headers=None):
+        data = content.encode("utf-8")
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class pooledServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = pooledHttpServer(("127.0.0.1", 0), stubHandler, workers=8)
+        self.server.release = threading.Event()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, path, timeout=5):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=timeout)
+        try:
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status
+        finally:
+            conn.close()
+
+    def test_held_profiles_do_not_block_ping(self):
+        statuses = []
+        def profile():
+            statuses.append(self.get("/debug/profile?seconds=30", timeout=15))
+        profiles = [threading.Thread(target=profile) for _ in range(8)]
+        for thread in profiles:
+            thread.start()
+        # The profiles over the admin slots are turned away at once.
+        deadline = time.monotonic() + 5
+        while len(statuses) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(statuses, [503] * 4)
+
+        started = time.monotonic()
+        self.assertEqual(self.get("/ping", timeout=2), 200)
+        self.assertEqual(self.get("/notify", timeout=2), 200)
+        self.assertLess(time.monotonic() - started, 1)
+
+        self.server.release.set()
+        for thread in profiles:
+            thread.join()
+        self.assertEqual(sorted(statuses), [200] * 4 + [503] * 4)
+
+if __name__ == "__main__":
+    unittest.main()
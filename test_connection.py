@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Tests for the keep-alive connection pool used between nodes. Run with
+# "python -m pytest test_connection.py" or "python test_connection.py".
+
+import socket
+import threading
+import unittest
+from connection import connectionPool
+
+class scriptedServer:
+    """Accepts connections and reads one request head on each, then does
+    what the test asked for: "answer" (200, the connection left open and
+    then closed, as a peer dropping an idle keep-alive connection),
+    "close" (closed without an answer) or "hang" (never answers)."""
+
+    def __init__(self, actions):
+        self._actions = list(actions)
+        self._socket = socket.create_server(("127.0.0.1", 0))
+        self.address = "127.0.0.1:%d" % self._socket.getsockname()[1]
+        self.accepted = 0
+        self._held = []
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _serve(self):
+        for action in self._actions:
+            try:
+                sock, _ = self._socket.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            data = b""
+            while b"\r\n\r\n" not in data:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            if action == "answer":
+                sock.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+                sock.shutdown(socket.SHUT_RDWR)
+                sock.close()
+            elif action == "close":
+                sock.close()
+            else:
+                self._held.append(sock)
+
+    def close(self):
+        self._socket.close()
+        for sock in self._held:
+            sock.close()
+
+class connectionPoolTest(unittest.TestCase):
+
+    def serve(self, actions):
+        server = scriptedServer(actions)
+        self.addCleanup(server.close)
+        return server
+
+    def test_stale_connection_retried_on_a_fresh_one(self):
+        server = self.serve(["answer", "answer"])
+        pool = connectionPool(timeout=2)
+        self.addCleanup(pool.close)
+        self.assertEqual(pool.request(server.address, "GET", "/ping").status, 200)
+        # The pool kept the first connection, which the server has closed
+        # since: the request goes out on it, fails, and is sent again.
+        resp = pool.request(server.address, "GET", "/ping")
+        self.assertEqual((resp.status, resp.body), (200, b"ok"))
+        self.assertEqual(server.accepted, 2)
+
+    def test_fresh_connection_failure_not_retried(self):
+        server = self.serve(["close", "answer"])
+        pool = connectionPool(timeout=2)
+        self.addCleanup(pool.close)
+        with self.assertRaises(ConnectionError):
+            pool.request(server.address, "GET", "/ping")
+        self.assertEqual(server.accepted, 1)
+
+    def test_timeout_not_retried(self):
+        server = self.serve(["answer", "hang", "answer"])
+        pool = connectionPool(timeout=0.2)
+        self.addCleanup(pool.close)
+        pool.request(server.address, "GET", "/ping")
+        # The stale connection is retried on a fresh one, which then times
+        # out; the peer may have the request, so it is not sent a third time.
+        with self.assertRaises(socket.timeout):
+            pool.request(server.address, "GET", "/ping")
+        self.assertEqual(server.accepted, 2)
+
+if __name__ == "__main__":
+    unittest.main()
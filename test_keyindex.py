@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+# Behaviour tests for keyIndex, the open-addressing table behind the mmap
+# storage engine. Run with "python -m pytest test_keyindex.py" or
+# "python test_keyindex.py".
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from hashing import hash_to_hex
+from keyindex import keyIndex
+from storage import segmentStorage
+
+KEY_SIZE = 20
+
+def colliding(count, prefix=b"\x05" * 8):
+    # Digests sharing their leading 8 bytes start probing at the same slot.
+    return [prefix + i.to_bytes(KEY_SIZE - 8, "big") for i in range(count)]
+
+def random_digests(count, seed=1):
+    rng = random.Random(seed)
+    return [bytes(rng.getrandbits(8) for _ in range(KEY_SIZE)) for _ in range(count)]
+
+class keyIndexTest(unittest.TestCase):
+
+    def test_colliding_digests_found_by_probing(self):
+        index = keyIndex(KEY_SIZE, width=2, capacity=16)
+        digests = colliding(6)
+        for i, digest in enumerate(digests):
+            index.put(digest, (i, i * 10))
+        self.assertEqual(len(index), 6)
+        for i, digest in enumerate(digests):
+            self.assertEqual(index.get(digest), (i, i * 10))
+        self.assertIsNone(index.get(colliding(7)[6]))
+
+    def test_probing_continues_past_deleted_slots(self):
+        index = keyIndex(KEY_SIZE, capacity=16)
+        digests = colliding(5)
+        for i, digest in enumerate(digests):
+            index.put(digest, (i,))
+        self.assertTrue(index.delete(digests[1]))
+        self.assertFalse(index.delete(digests[1]))
+        self.assertIsNone(index.get(digests[1]))
+        self.assertNotIn(digests[1], index)
+        # Entries placed after the deleted slot are still reached.
+        for i in (0, 2, 3, 4):
+            self.assertEqual(index.get(digests[i]), (i,))
+        self.assertEqual(len(index), 4)
+
+    def test_deleted_slot_reused(self):
+        index = keyIndex(KEY_SIZE, capacity=16)
+        digests = colliding(4)
+        for i, digest in enumerate(digests):
+            index.put(digest, (i,))
+        index.delete(digests[1])
+        # An existing entry past the deleted slot is updated in place, not
+        # inserted a second time.
+        index.put(digests[3], (30,))
+        self.assertEqual(len(index), 3)
+        self.assertEqual(sorted(index.items()), sorted([(digests[0], (0,)), (digests[2], (2,)), (digests[3], (30,))]))
+        index.put(digests[1], (10,))
+        self.assertEqual(index.get(digests[1]), (10,))
+        self.assertEqual(len(index), 4)
+
+    def test_churn_clears_deleted_slots_without_growing(self):
+        index = keyIndex(KEY_SIZE, capacity=16)
+        size = index.nbytes()
+        for digest in random_digests(500):
+            index.put(digest, (1,))
+            index.delete(digest)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.nbytes(), size)
+        self.assertEqual(index.keys(), [])
+
+    def test_resize_keeps_every_entry(self):
+        index = keyIndex(KEY_SIZE, width=2, capacity=16)
+        size = index.nbytes()
+        digests = random_digests(2000)
+        for i, digest in enumerate(digests):
+            index.put(digest, (i, 2**63 + i))
+        self.assertGreater(index.nbytes(), size)
+        self.assertEqual(len(index), 2000)
+        for i, digest in enumerate(digests):
+            self.assertEqual(index.get(digest), (i, 2**63 + i))
+        for digest in digests[::2]:
+            index.delete(digest)
+        self.assertEqual(dict(index.items()), dict((d, (i, 2**63 + i)) for i, d in enumerate(digests) if i % 2))
+
+    def test_wrong_digest_size_rejected(self):
+        index = keyIndex(KEY_SIZE)
+        with self.assertRaises(ValueError):
+            index.put(b"short", (1,))
+        with self.assertRaises(ValueError):
+            index.get(b"\x00" * (KEY_SIZE + 1))
+
+class indexRebuildTest(unittest.TestCase):
+    # segmentStorage keeps the index only in memory and rebuilds it from
+    # the segment files when it opens them.
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix="keyindex-")
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def open(self):
+        return segmentStorage(self.path, fsync="never", segment_bytes=64 * 1024, compact_interval=3600)
+
+    def test_index_rebuilt_from_segments(self):
+        store = self.open()
+        # More keys than the initial capacity, so the index is resized
+        # while it is rebuilt.
+        keys = [hash_to_hex("key%d" % i) for i in range(3000)]
+        expected = {}
+        for key in keys:
+            store.put(key, key.encode())
+            expected[key] = key.encode()
+        for key in keys[::5]:
+            store.put(key, b"overwritten")
+            expected[key] = b"overwritten"
+        for key in keys[1::5]:
+            store.delete(key)
+            del expected[key]
+        self.assertGreater(len([name for name in os.listdir(self.path) if name.startswith("segment-")]), 1)
+        store.close()
+
+        store = self.open()
+        self.assertEqual(len(store), len(expected))
+        self.assertEqual(sorted(store.keys()), sorted(expected))
+        for key, value in expected.items():
+            self.assertEqual(bytes(store.get(key)), value)
+        for key in keys[1::5]:
+            self.assertIsNone(store.get(key))
+        store.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+# Behaviour tests for the persistent storage engines: what a node finds
+# when it opens its data directory again after a clean close or a crash.
+# Run with "python -m pytest test_storage.py" or "python test_storage.py".
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from hashing import hash_to_hex
+from storage import memoryStorage, logStorage, segmentStorage, cacheStorage, encode_record, OP_PUT
+
+class logStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix="logstorage-")
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def open(self, **kwargs):
+        kwargs.setdefault("fsync", "never")
+        return logStorage(self.path, **kwargs)
+
+    def files(self, kind):
+        return sorted(name for name in os.listdir(self.path) if name.startswith(kind + "-"))
+
+    def test_log_replayed_on_reopen(self):
+        store = self.open()
+        store.put("a", b"1")
+        store.put("b", b"2")
+        store.put("c", b"3")
+        store.put("a", b"4")
+        store.delete("b")
+        store.close()
+
+        store = self.open()
+        self.assertEqual(store.get("a"), b"4")
+        self.assertIsNone(store.get("b"))
+        self.assertEqual(store.get("c"), b"3")
+        self.assertEqual(sorted(store.keys()), ["a", "c"])
+        store.close()
+
+    def test_snapshot_and_later_log_recovered(self):
+        # A tiny snapshot threshold makes nearly every write start a new
+        # generation, so the data ends up split between a snapshot and the
+        # log written after it.
+        store = self.open(snapshot_bytes=256)
+        expected = {}
+        for i in range(100):
+            key, value = "key%d" % i, b"value%d" % i
+            store.put(key, value)
+            expected[key] = value
+        for i in range(0, 100, 3):
+            store.delete("key%d" % i)
+            del expected["key%d" % i]
+        store.close()
+        snapshots = self.files("snapshot")
+        self.assertEqual(len(snapshots), 1)
+        # Logs older than the snapshot were removed with it.
+        generation = int(snapshots[0].split("-")[1])
+        self.assertTrue(all(int(name.split("-")[1]) >= generation for name in self.files("wal")))
+
+        store = self.open()
+        store.put("late", b"after reopen")
+        store.close()
+        expected["late"] = b"after reopen"
+
+        store = self.open()
+        self.assertEqual(dict(store.items()), expected)
+        store.close()
+
+    def test_torn_final_record_truncated(self):
+        store = self.open()
+        store.put("a", b"1")
+        store.put("b", b"2")
+        store.close()
+        wal = os.path.join(self.path, self.files("wal")[-1])
+        valid = os.path.getsize(wal)
+        # A crash in the middle of appending a record.
+        with open(wal, "ab") as f:
+            f.write(encode_record(OP_PUT, "c", b"torn value")[:-4])
+
+        store = self.open()
+        self.assertEqual(dict(store.items()), { "a": b"1", "b": b"2" })
+        self.assertEqual(os.path.getsize(wal), valid)
+        # Appends after the truncation are read back.
+        store.put("c", b"3")
+        store.close()
+
+        store = self.open()
+        self.assertEqual(dict(store.items()), { "a": b"1", "b": b"2", "c": b"3" })
+        store.close()
+
+    def test_corrupt_final_record_dropped(self):
+        store = self.open()
+        store.put("a", b"1")
+        store.put("b", b"2")
+        store.close()
+        wal = os.path.join(self.path, self.files("wal")[-1])
+        with open(wal, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes((last[0] ^ 0xff,)))
+
+        store = self.open()
+        self.assertEqual(dict(store.items()), { "a": b"1" })
+        store.close()
+
+class segmentStorageTest(unittest.TestCase):
+    # Values of one size, so a segment holds exactly SEGMENT_RECORDS of them.
+    VALUE_BYTES = 200
+    SEGMENT_RECORDS = 4
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix="segmentstorage-")
+        self.record_bytes = len(encode_record(OP_PUT, hash_to_hex("k"), self.value("")))
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def open(self):
+        # Compaction runs only when a test asks for it.
+        store = segmentStorage(self.path, fsync="never", segment_bytes=self.SEGMENT_RECORDS * self.record_bytes,
+                               compact_ratio=0.5, compact_interval=3600)
+        self.stores.append(store)
+        return store
+
+    def value(self, text):
+        return text.encode().ljust(self.VALUE_BYTES, b".")
+
+    def segments(self):
+        return sorted(int(name.split("-")[1]) for name in os.listdir(self.path) if name.startswith("segment-"))
+
+    def contents(self, store):
+        return { key: bytes(value) for key, value in store.items() }
+
+    def test_compaction_after_overwrite_and_delete_survives_reload(self):
+        store = self.open()
+        keys = [hash_to_hex("key%d" % i) for i in range(12)]
+        for key in keys:
+            store.put(key, self.value("first " + key))
+        expected = {}
+        for i, key in enumerate(keys):
+            if i % 3 == 0:
+                store.delete(key)
+            else:
+                store.put(key, self.value("second " + key))
+                expected[key] = self.value("second " + key)
+        # Segments 0-2 hold only overwritten values, deleted ones and
+        # tombstones now.
+        self.assertEqual(self.contents(store), expected)
+        store.compact()
+        self.assertTrue(all(number >= 3 for number in self.segments()))
+        self.assertEqual(store.serialize()["compactions"], 3)
+        self.assertEqual(self.contents(store), expected)
+        store.close()
+
+        store = self.open()
+        self.assertEqual(self.contents(store), expected)
+        for i in range(0, 12, 3):
+            self.assertIsNone(store.get(keys[i]))
+
+    def test_tombstone_kept_while_it_shadows_an_older_segment(self):
+        store = self.open()
+        deleted = hash_to_hex("deleted")
+        fillers = [hash_to_hex("filler%d" % i) for i in range(3)]
+        others = [hash_to_hex("other%d" % i) for i in range(3)]
+        # Segment 0: the value to delete and three that stay live.
+        store.put(deleted, self.value("old"))
+        for key in fillers:
+            store.put(key, self.value(key))
+        # Segment 1: the tombstone and three values overwritten right away.
+        store.delete(deleted)
+        for key in others:
+            store.put(key, self.value(key))
+        for key in others:
+            store.put(key, self.value("new " + key))
+        store.compact()
+        self.assertEqual(self.segments(), [0, 2])
+        store.close()
+
+        store = self.open()
+        self.assertIsNone(store.get(deleted))
+        expected = dict((key, self.value(key)) for key in fillers)
+        expected.update((key, self.value("new " + key)) for key in others)
+        self.assertEqual(self.contents(store), expected)
+
+    def test_torn_record_cleared(self):
+        store = self.open()
+        first = hash_to_hex("first")
+        store.put(first, self.value("first"))
+        store.close()
+        torn = encode_record(OP_PUT, hash_to_hex("torn"), self.value("torn"))
+        with open(os.path.join(self.path, "segment-0"), "r+b") as f:
+            f.seek(self.record_bytes)
+            f.write(torn[:-10])
+
+        store = self.open()
+        self.assertEqual(self.contents(store), { first: self.value("first") })
+        second = hash_to_hex("second")
+        store.put(second, self.value("second"))
+        store.close()
+
+        store = self.open()
+        self.assertEqual(self.contents(store), { first: self.value("first"), second: self.value("second") })
+
+class failingStorage(memoryStorage):
+    # Raises on a put of b"fail", as a backend with a full disk would.
+    def put(self, key, value, ttl=None):
+        if value == b"fail":
+            raise OSError("No space left on device")
+        return memoryStorage.put(self, key, value, ttl)
+
+class cacheStorageTest(unittest.TestCase):
+
+    def test_rewrites_do_not_grow_the_heaps(self):
+        for policy in ("lru", "lfu", "ttl"):
+            cache = cacheStorage(memoryStorage(), budget=1000, policy=policy, default_ttl=3600)
+            for i in range(20000):
+                cache.put("k%d" % (i % 10), b"%05d" % i)
+            self.assertEqual(cache.cache_stats()["keys"], 10)
+            self.assertEqual(cache.cache_stats()["used_bytes"], 10 * 7)
+            self.assertLess(len(cache._expiry_heap), 100)
+            self.assertLess(len(getattr(cache._policy, "_heap", [])), 100)
+
+    def test_evicts_in_policy_order(self):
+        cache = cacheStorage(memoryStorage(), budget=30, policy="lru")
+        for key in ("a", "b", "c"):
+            cache.put(key, b"123456789")
+        cache.get("a")
+        cache.put("d", b"123456789")
+        self.assertEqual(sorted(cache.keys()), ["a", "c", "d"])
+        self.assertEqual(cache.cache_stats()["evictions"]["capacity"], 1)
+
+    def test_expired_keys_dropped(self):
+        cache = cacheStorage(memoryStorage(), budget=1000, policy="ttl")
+        cache.put("short", b"1", ttl=0.01)
+        cache.put("long", b"2", ttl=3600)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("short"))
+        self.assertEqual(cache.get("long"), b"2")
+        self.assertEqual(cache.cache_stats()["evictions"]["expired"], 1)
+
+    def test_failed_write_keeps_accounting(self):
+        cache = cacheStorage(failingStorage(), budget=100, policy="lru")
+        cache.put("a", b"1234")
+        with self.assertRaises(OSError):
+            cache.put("a", b"fail")
+        self.assertEqual(cache.get("a"), b"1234")
+        self.assertEqual(cache.cache_stats()["used_bytes"], 5)
+        # Still known to the policy, so still evicted when room is needed.
+        cache.put("b", b"x" * 98)
+        self.assertIsNone(cache.get("a"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Tests for the request body readers of the threaded and asyncio engines.
+# Run with "python -m pytest test_streams.py" or "python test_streams.py".
+
+import asyncio
+import io
+import unittest
+from email.message import Message
+from asyncengine import asyncBodyReader
+from streams import bodyReader, bodyError, write_chunked
+
+def headers(**fields):
+    message = Message()
+    for name, value in fields.items():
+        message[name.replace("_", "-")] = value
+    return message
+
+CHUNKED = headers(Transfer_Encoding="chunked")
+
+class bodyReaderTest(unittest.TestCase):
+
+    def test_chunked_body_joined(self):
+        rfile = io.BytesIO(b"5\r\nhello\r\n1;name=value\r\n \r\n5\r\nworld\r\n0\r\n\r\nNEXT")
+        body = bodyReader(rfile, CHUNKED)
+        self.assertIsNone(body.length)
+        self.assertEqual(body.read(), b"hello world")
+        # The next request on the connection is left unread.
+        self.assertEqual(rfile.read(), b"NEXT")
+
+    def test_chunks_split_to_size(self):
+        body = bodyReader(io.BytesIO(b"a\r\n0123456789\r\n3\r\nabc\r\n0\r\n\r\n"), CHUNKED)
+        self.assertEqual(list(body.chunks(4)), [b"0123", b"4567", b"89", b"abc"])
+        self.assertEqual(body.read1(), b"")
+
+    def test_trailers_skipped(self):
+        rfile = io.BytesIO(b"2\r\nok\r\n0\r\nX-Checksum: 1\r\nX-Other: 2\r\n\r\nNEXT")
+        self.assertEqual(bodyReader(rfile, CHUNKED).read(), b"ok")
+        self.assertEqual(rfile.read(), b"NEXT")
+
+    def test_round_trip_with_write_chunked(self):
+        wfile = io.BytesIO()
+        parts = [b"x" * 100, b"", b"y" * 3, b"z"]
+        write_chunked(wfile, parts)
+        self.assertEqual(bodyReader(io.BytesIO(wfile.getvalue()), CHUNKED).read(), b"".join(parts))
+
+    def test_malformed_chunk_size(self):
+        body = bodyReader(io.BytesIO(b"zz\r\nhello\r\n0\r\n\r\n"), CHUNKED)
+        with self.assertRaises(bodyError):
+            body.read()
+
+    def test_body_ending_early(self):
+        body = bodyReader(io.BytesIO(b"a\r\nshort"), CHUNKED)
+        with self.assertRaises(bodyError):
+            body.read()
+        body = bodyReader(io.BytesIO(b"short"), headers(Content_Length="10"))
+        with self.assertRaises(bodyError):
+            body.read()
+
+    def test_content_length(self):
+        rfile = io.BytesIO(b"helloNEXT")
+        body = bodyReader(rfile, headers(Content_Length="5"))
+        self.assertEqual(body.length, 5)
+        self.assertEqual(list(body.chunks(2)), [b"he", b"ll", b"o"])
+        self.assertEqual(rfile.read(), b"NEXT")
+        self.assertEqual(bodyReader(io.BytesIO(b"NEXT"), headers()).read(), b"")
+
+class asyncBodyReaderTest(unittest.TestCase):
+
+    def read(self, data, fields, until_eof=False, size=None):
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            body = asyncBodyReader(reader, fields, until_eof)
+            chunks = [chunk async for chunk in body.chunks(size)]
+            return chunks, await reader.read()
+        return asyncio.run(run())
+
+    def test_chunked_body(self):
+        chunks, rest = self.read(b"a\r\n0123456789\r\n3;ext\r\nabc\r\n0\r\nX-Trailer: 1\r\n\r\nNEXT",
+                                 CHUNKED, size=4)
+        self.assertEqual(chunks, [b"0123", b"4567", b"89", b"abc"])
+        self.assertEqual(rest, b"NEXT")
+
+    def test_content_length_and_eof(self):
+        self.assertEqual(self.read(b"helloNEXT", headers(Content_Length="5")), ([b"hello"], b"NEXT"))
+        self.assertEqual(self.read(b"to the end", headers(), until_eof=True, size=4),
+                         ([b"to t", b"he e", b"nd"], b""))
+        self.assertEqual(self.read(b"NEXT", headers()), ([], b"NEXT"))
+
+    def test_body_ending_early(self):
+        with self.assertRaises(asyncio.IncompleteReadError):
+            self.read(b"a\r\nshort", CHUNKED)
+
+if __name__ == "__main__":
+    unittest.main()
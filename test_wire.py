@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Tests for the frames and payload fields of the binary ring maintenance
+# protocol. Run with "python -m pytest test_wire.py" or "python test_wire.py".
+
+import unittest
+import wire
+from wire import payloadReader, pack_id, pack_address, pack_trace, pack_u8, pack_u16
+
+class stubFinger:
+    def __init__(self, address):
+        self._address = address
+
+    def get_address(self):
+        return self._address
+
+class stubNode:
+    # The state wire.handle reads for the ops answered from local state.
+    def __init__(self, predecessor, successors):
+        self._predecessor = predecessor
+        self._successors = successors
+
+    def get_state(self):
+        return True
+
+    def running(self):
+        return True
+
+    def get_predecessor(self):
+        return self._predecessor
+
+    def get_successor_list(self):
+        return self._successors
+
+class payloadTest(unittest.TestCase):
+
+    def test_ids(self):
+        for id in (None, 0, 1, 255, 256, 2**160 - 1):
+            self.assertEqual(payloadReader(pack_id(id)).id(), id)
+        self.assertEqual(pack_id(None), b"\x00")
+        self.assertEqual(pack_id("258"), b"\x02\x01\x02")
+
+    def test_ipv4_addresses_packed(self):
+        for address in ("127.0.0.1:3000", "10.1.2.3:65535#7"):
+            data = pack_address(address)
+            self.assertEqual(data[0], 1)
+            self.assertEqual(len(data), 1 + wire.IPV4_ADDRESS.size)
+            self.assertEqual(payloadReader(data).address(), address)
+
+    def test_other_addresses_as_text(self):
+        for address in ("node-1.example:3000", "node-1.example:3000#2", "[::1]:3000", "1.2.3.4:http"):
+            data = pack_address(address)
+            self.assertEqual(data[0], 2)
+            self.assertEqual(payloadReader(data).address(), address)
+        self.assertIsNone(payloadReader(pack_address(None)).address())
+
+    def test_fields_read_in_order(self):
+        data = pack_trace("a1b2", "c3") + pack_u8(1) + pack_address("127.0.0.1:3001") + \
+                pack_u16(70000) + pack_id(12345)
+        reader = payloadReader(data)
+        self.assertEqual((reader.text(), reader.text()), ("a1b2", "c3"))
+        self.assertEqual(reader.u8(), 1)
+        self.assertEqual(reader.address(), "127.0.0.1:3001")
+        # Hop counts saturate rather than wrap.
+        self.assertEqual(reader.u16(), 0xFFFF)
+        self.assertEqual(reader.id(), 12345)
+
+    def test_truncated_and_malformed_payloads(self):
+        cases = [(b"", payloadReader.id), (pack_id(2**64)[:-1], payloadReader.id),
+                 (pack_address("127.0.0.1:3000")[:-1], payloadReader.address),
+                 (pack_address("node-1.example:3000")[:-2], payloadReader.address),
+                 (b"\x09", payloadReader.address)]
+        for data, field in cases:
+            with self.assertRaises(ValueError):
+                field(payloadReader(data))
+
+class frameTest(unittest.TestCase):
+
+    def test_frame_headers(self):
+        payload = pack_id(42)
+        frame = wire.REQUEST.pack(len(payload), 0xFFFFFFFF, wire.FIND_SUCCESSOR | wire.TRACED, 3) + payload
+        length, request_id, op, vnode = wire.REQUEST.unpack(frame[:wire.REQUEST.size])
+        self.assertEqual((length, request_id, op & ~wire.TRACED, vnode), (len(payload), 0xFFFFFFFF, wire.FIND_SUCCESSOR, 3))
+        self.assertTrue(op & wire.TRACED)
+        self.assertEqual(payloadReader(frame[wire.REQUEST.size:]).id(), 42)
+
+        frame = wire.RESPONSE.pack(0, 7, wire.NOT_FOUND)
+        self.assertEqual(len(frame), wire.RESPONSE.size)
+        self.assertEqual(wire.RESPONSE.unpack(frame), (0, 7, wire.NOT_FOUND))
+
+    def test_ops_fit_beside_the_trace_flag(self):
+        self.assertTrue(all(op < wire.TRACED for op in wire.OP_NAMES))
+
+    def test_neighborhood_answer(self):
+        node = stubNode(stubFinger("127.0.0.1:3000"), [stubFinger("127.0.0.1:3001#1"), stubFinger("node-2:3002")])
+        status, data = wire.handle(node, wire.NEIGHBORHOOD, payloadReader(b""))
+        self.assertEqual(status, wire.OK)
+        reader = payloadReader(data)
+        self.assertEqual(reader.address(), "127.0.0.1:3000")
+        self.assertEqual([reader.address() for _ in range(reader.u8())], ["127.0.0.1:3001#1", "node-2:3002"])
+
+        status, data = wire.handle(stubNode(None, []), wire.FIND_PREDECESSOR, payloadReader(b""))
+        self.assertEqual((status, data), (wire.NOT_FOUND, b""))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import contextvars
+import random
+import re
+import threading
+import time
+from collections import deque
+import configurations as configs
+
+# A traced request carries X-Trace-Id, and X-Parent-Span naming the span of
+# the call that sent it. Spans are kept where they were recorded, in each
+# node's traceBuffer; /traces?trace=ID collects them back from the peers the
+# client spans point at.
+TRACE_HEADER = "X-Trace-Id"
+PARENT_HEADER = "X-Parent-Span"
+
+# The server span of the request being handled, in this thread or task.
+_current = contextvars.ContextVar("trace_span", default=None)
+
+def new_id():
+    return "%016x" % random.getrandbits(64)
+
+def valid_id(value):
+    return value is not None and re.fullmatch(r"[0-9a-fA-F]{1,32}", value) is not None
+
+def current():
+    return _current.get()
+
+def activate(span):
+    return _current.set(span)
+
+def deactivate(token):
+    _current.reset(token)
+
+class traceSpan:
+    """One timed step of a trace: a request served by this node ("server")
+    or a call it made to a peer ("client")."""
+
+    def __init__(self, buffer, trace_id, parent_id, kind, name, peer):
+        self._buffer = buffer
+        self.trace_id = trace_id
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.name = name
+        self.peer = None if peer is None else str(peer)
+        self.start = time.time()
+        self._started = time.perf_counter()
+
+    def headers(self):
+        # Sent with the call this span times, so the peer's spans hang off it.
+        return { TRACE_HEADER: self.trace_id, PARENT_HEADER: self.span_id }
+
+    def finish(self, outcome):
+        self._buffer.record({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "node": self._buffer.node,
+            "kind": self.kind,
+            "name": self.name,
+            "peer": self.peer,
+            "start": round(self.start, 6),
+            "duration_ms": round((time.perf_counter() - self._started) * 1000, 3),
+            "outcome": outcome,
+        })
+
+class traceBuffer:
+    """The last TRACE_BUFFER_SPANS spans recorded by one node."""
+
+    def __init__(self, node, size=None):
+        self.node = str(node)
+        self._spans = deque(maxlen=configs.TRACE_BUFFER_SPANS if size is None else size)
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self, trace_id):
+        with self._lock:
+            return [span for span in self._spans if span["trace_id"] == trace_id]
+
+    def recent(self, limit):
+        # The requests that started a trace on this node, newest first.
+        with self._lock:
+            roots = [span for span in self._spans if span["kind"] == "server" and span["parent_id"] is None]
+        return roots[::-1][:limit]
+
+def span_tree(spans):
+    # Orders spans by start time and gives each its depth below the root.
+    spans = sorted(spans, key=lambda span: span["start"])
+    parents = { span["span_id"]: span.get("parent_id") for span in spans }
+    for span in spans:
+        depth, parent = 0, span.get("parent_id")
+        while parent in parents and depth < len(spans):
+            depth, parent = depth + 1, parents[parent]
+        span["depth"] = depth
+    return spans
@@ -10,3 +10,13 @@ def inrange(c, a, b):
 	if a < b:
 		return a <= c and c < b
 	return a < c or c <= b
+
+# Helper function to determine if a key falls within the half-open range (a, b].
+# When a == b the range covers the whole ring.
+def inrange_right(c, a, b):
+	a = a % (configs.DHT_SIZE)
+	b = b % (configs.DHT_SIZE)
+	c = c % (configs.DHT_SIZE)
+	if a < b:
+		return a < c and c <= b
+	return a < c or c <= b
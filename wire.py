@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+
+import itertools
+import socket
+import struct
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+import configurations as configs
+import tracing
+
+# Binary protocol for ring maintenance between nodes, served next to the
+# HTTP server on port + WIRE_PORT_OFFSET. Both sides open with MAGIC; then
+# every message is a frame header followed by `length` bytes of payload.
+# Requests carry an id chosen by the client and responses echo it, so one
+# connection carries many requests at once and answers come back in any
+# order.
+MAGIC = b"CHRD\x01"
+REQUEST = struct.Struct(">IIBH")    # length, request id, op, virtual node
+RESPONSE = struct.Struct(">IIB")    # length, request id, status
+IPV4_ADDRESS = struct.Struct(">4sHH")  # host, port, virtual node
+
+PING = 1
+FIND_SUCCESSOR = 2
+FIND_NEXT = 3
+FIND_PREDECESSOR = 4
+NEIGHBORHOOD = 5
+NOTIFY = 6
+INFORM_PREDECESSOR = 7
+INFORM_SUCCESSOR = 8
+
+OP_NAMES = {
+    PING: "ping",
+    FIND_SUCCESSOR: "findsuccessor",
+    FIND_NEXT: "findnext",
+    FIND_PREDECESSOR: "findpredecessor",
+    NEIGHBORHOOD: "neighborhood",
+    NOTIFY: "notify",
+    INFORM_PREDECESSOR: "informPredecessor",
+    INFORM_SUCCESSOR: "informSuccessor",
+}
+
+# Ops whose handler may wait on further hops to other nodes. They run on
+# their own workers, so that a burst of lookups, or lookups waiting on each
+# other around the ring, cannot hold up the pings and notifies that keep
+# the ring together.
+FORWARDING_OPS = (FIND_SUCCESSOR,)
+
+# Set on the op of a request whose payload starts with the trace id and
+# parent span of a traced request (see tracing.py).
+TRACED = 0x80
+
+OK = 0
+NOT_FOUND = 1
+ERROR = 2
+
+STATUS_NAMES = { OK: "ok", NOT_FOUND: "not_found", ERROR: "error" }
+
+# Returned instead of a reply when the peer does not speak the protocol and
+# has to be asked over HTTP.
+UNAVAILABLE = object()
+
+class wireUnavailable(Exception):
+    pass
+
+def pack_id(id):
+    # A length byte and the identifier in big-endian; length 0 is None.
+    if id is None:
+        return b"\x00"
+    id = int(id)
+    data = id.to_bytes(max(1, (id.bit_length() + 7) // 8), "big")
+    return bytes((len(data),)) + data
+
+def pack_address(address):
+    # Tag 0 is None, tag 1 a packed IPv4 host:port#vnode, tag 2 any other
+    # address as text.
+    if address is None:
+        return b"\x00"
+    address = str(address)
+    host_port, _, vnode = address.partition("#")
+    host, _, port = host_port.rpartition(":")
+    try:
+        packed = socket.inet_aton(host)
+        if socket.inet_ntoa(packed) == host and port.isdigit() and (not vnode or vnode.isdigit()):
+            return b"\x01" + IPV4_ADDRESS.pack(packed, int(port), int(vnode or 0))
+    except (OSError, struct.error):
+        pass
+    data = address.encode("utf-8")
+    return b"\x02" + struct.pack(">H", len(data)) + data
+
+def pack_text(text):
+    data = text.encode("utf-8")[:255]
+    return bytes((len(data),)) + data
+
+def pack_trace(trace_id, span_id):
+    return pack_text(trace_id) + pack_text(span_id)
+
+def pack_u8(value):
+    return struct.pack(">B", value)
+
+def pack_u16(value):
+    return struct.pack(">H", min(value, 0xFFFF))
+
+class payloadReader:
+    """Decodes the fields of a payload in order. Raises ValueError when the
+    payload is shorter than its fields."""
+
+    def __init__(self, data, status=OK):
+        self.status = status
+        self._data = data
+        self._offset = 0
+
+    def _take(self, size):
+        start = self._offset
+        if start + size > len(self._data):
+            raise ValueError("Truncated payload")
+        self._offset = start + size
+        return self._data[start:start + size]
+
+    def u8(self):
+        return self._take(1)[0]
+
+    def u16(self):
+        return struct.unpack(">H", self._take(2))[0]
+
+    def id(self):
+        size = self.u8()
+        return int.from_bytes(self._take(size), "big") if size else None
+
+    def text(self):
+        return self._take(self.u8()).decode("utf-8")
+
+    def address(self):
+        tag = self.u8()
+        if tag == 0:
+            return None
+        if tag == 1:
+            host, port, vnode = IPV4_ADDRESS.unpack(self._take(IPV4_ADDRESS.size))
+            address = "%s:%d" % (socket.inet_ntoa(host), port)
+            return address + ("#%d" % vnode if vnode else "")
+        if tag == 2:
+            return self._take(self.u16()).decode("utf-8")
+        raise ValueError("Unknown address tag %d" % tag)
+
+def recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionResetError("Connection closed by peer")
+        data += chunk
+    return bytes(data)
+
+class wireConnection:
+    """One multiplexed connection to a peer process. Callers wait on their
+    own request id while a reader thread hands out the responses."""
+
+    def __init__(self, host_port, timeout):
+        host, port = host_port.rsplit(":", 1)
+        self._sock = socket.create_connection((host, int(port) + configs.WIRE_PORT_OFFSET), timeout)
+        try:
+            self._sock.sendall(MAGIC)
+            if recv_exactly(self._sock, len(MAGIC)) != MAGIC:
+                raise wireUnavailable(host_port)
+        except BaseException:
+            self._sock.close()
+            raise
+        self._sock.settimeout(None)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.closed = False
+        reader = threading.Thread(target=self._read_responses, name="wire-reader-" + host_port)
+        reader.daemon = True
+        reader.start()
+
+    def call(self, vnode, op, payload, timeout):
+        future = Future()
+        with self._lock:
+            if self.closed:
+                raise ConnectionResetError("Connection closed")
+            request_id = next(self._ids) & 0xFFFFFFFF
+            self._pending[request_id] = future
+            try:
+                self._sock.sendall(REQUEST.pack(len(payload), request_id, op, vnode) + payload)
+            except OSError:
+                self._close()
+                raise
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            # Only an OSError from Python 3.11 on.
+            raise TimeoutError("No answer in %s seconds" % timeout)
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    def _read_responses(self):
+        try:
+            while True:
+                length, request_id, status = RESPONSE.unpack(recv_exactly(self._sock, RESPONSE.size))
+                if length > configs.WIRE_MAX_FRAME:
+                    raise ValueError("Frame of %d bytes" % length)
+                payload = recv_exactly(self._sock, length)
+                with self._lock:
+                    future = self._pending.pop(request_id, None)
+                if future is not None:
+                    future.set_result(payloadReader(payload, status))
+        except (OSError, ValueError):
+            pass
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        # Called with the lock held.
+        self.closed = True
+        try:
+            # Wakes up the reader thread blocked in recv.
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionResetError("Connection closed"))
+
+    def close(self):
+        with self._lock:
+            if not self.closed:
+                self._close()
+
+class wireClient:
+    """Client side of the protocol: one wireConnection per peer process.
+
+    A peer that refuses the connection or answers something other than
+    MAGIC is taken to serve HTTP only, and is not tried again for
+    WIRE_RETRY_INTERVAL seconds.
+    """
+
+    def __init__(self, timeout=None):
+        self._timeout = configs.RPC_TIMEOUT if timeout is None else timeout
+        self._connections = {}
+        self._connecting = {}
+        self._unavailable = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, host_port, timeout):
+        with self._lock:
+            conn = self._connections.get(host_port)
+            if conn is not None and not conn.closed:
+                return conn
+            if time.monotonic() < self._unavailable.get(host_port, 0):
+                raise wireUnavailable(host_port)
+            lock = self._connecting.setdefault(host_port, threading.Lock())
+        with lock:
+            with self._lock:
+                conn = self._connections.get(host_port)
+            if conn is not None and not conn.closed:
+                return conn
+            try:
+                conn = wireConnection(host_port, timeout)
+            except (OSError, wireUnavailable):
+                with self._lock:
+                    self._unavailable[host_port] = time.monotonic() + configs.WIRE_RETRY_INTERVAL
+                raise wireUnavailable(host_port)
+            with self._lock:
+                self._connections[host_port] = conn
+                self._unavailable.pop(host_port, None)
+            return conn
+
+    def call(self, host_port, vnode, op, payload=b"", timeout=None):
+        # Returns a payloadReader; raises wireUnavailable, or OSError when
+        # the peer failed.
+        timeout = self._timeout if timeout is None else timeout
+        return self._connection(host_port, timeout).call(vnode, op, payload, timeout)
+
+    def discard(self, host_port):
+        with self._lock:
+            conn = self._connections.pop(host_port, None)
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            conns, self._connections = self._connections, {}
+        for conn in conns.values():
+            conn.close()
+
+def address_of(entry):
+    return None if entry is None else entry.get_address()
+
+def handle(node, op, request):
+    # Runs one request against a virtual node, as the matching HTTP route
+    # would. Returns (status, payload).
+    if op == PING:
+        return (OK if node.running() else NOT_FOUND), b""
+    if node.get_state() == False:
+        return ERROR, b""
+    if op == NOTIFY:
+        node.notify(request.address())
+        return OK, b""
+    if op == INFORM_PREDECESSOR:
+        node.changeSuccessor(request.address())
+        return OK, b""
+    if op == INFORM_SUCCESSOR:
+        node.changePredecessor(request.address())
+        return OK, b""
+    if op == NEIGHBORHOOD:
+        pred = node.get_predecessor()
+        successors = node.get_successor_list()
+        return OK, b"".join([pack_address(address_of(pred)), pack_u8(len(successors))] +
+                            [pack_address(s.get_address()) for s in successors])
+    if not node.running():
+        return NOT_FOUND, b""
+    if op == FIND_SUCCESSOR:
+        result, hops, start = node.findSuccessorWithHops(request.id())
+        if result is None:
+            return NOT_FOUND, b""
+        return OK, pack_address(result.get_address()) + pack_u16(hops) + pack_id(start)
+    if op == FIND_NEXT:
+        done, result, start = node.lookupStep(request.id())
+        return OK, pack_u8(done) + pack_address(result.get_address()) + pack_id(start)
+    if op == FIND_PREDECESSOR:
+        pred = node.get_predecessor()
+        if pred is None:
+            return NOT_FOUND, b""
+        return OK, pack_address(pred.get_address())
+    return ERROR, b""
+
+class wireServer:
+    """Serves the binary protocol for the virtual nodes of this process.
+
+    Each connection has a reader thread; requests run on shared pools of
+    threads, WIRE_WORKERS for lookups, since those may wait on further
+    hops, and WIRE_MAINTENANCE_WORKERS for everything else, which is
+    answered from local state. Responses are written back as they complete.
+    """
+
+    def __init__(self, server_address, nodes, workers=None):
+        self.server_address = server_address
+        self.socket = socket.create_server(server_address, backlog=socket.SOMAXCONN)
+        self._nodes = nodes
+        self._executor = ThreadPoolExecutor(max_workers=configs.WIRE_WORKERS if workers is None else workers,
+                                            thread_name_prefix="wire-worker")
+        self._maintenance = ThreadPoolExecutor(max_workers=configs.WIRE_MAINTENANCE_WORKERS,
+                                               thread_name_prefix="wire-maintenance")
+        self._running = True
+
+    def serve_forever(self):
+        while self._running:
+            try:
+                sock, _ = self.socket.accept()
+            except OSError:
+                break
+            thread = threading.Thread(target=self._serve_connection, args=(sock,), name="wire-connection")
+            thread.daemon = True
+            thread.start()
+
+    def shutdown(self):
+        self._running = False
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        self._executor.shutdown(wait=False)
+        self._maintenance.shutdown(wait=False)
+
+    def _serve_connection(self, sock):
+        lock = threading.Lock()
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if recv_exactly(sock, len(MAGIC)) != MAGIC:
+                return
+            sock.sendall(MAGIC)
+            while self._running:
+                length, request_id, op, vnode = REQUEST.unpack(recv_exactly(sock, REQUEST.size))
+                if length > configs.WIRE_MAX_FRAME:
+                    return
+                payload = recv_exactly(sock, length)
+                executor = self._executor if op & ~TRACED in FORWARDING_OPS else self._maintenance
+                executor.submit(self._respond, sock, lock, request_id, op, vnode, payload)
+        except (OSError, RuntimeError):
+            # RuntimeError: the executor was shut down with the server.
+            pass
+        finally:
+            with lock:
+                sock.close()
+
+    def _respond(self, sock, lock, request_id, op, vnode, payload):
+        node = self._nodes.get(vnode)
+        span = token = None
+        try:
+            request = payloadReader(payload)
+            if op & TRACED:
+                op &= ~TRACED
+                trace_id, parent_id = request.text(), request.text()
+                if node is not None:
+                    span = node.server_span("wire " + OP_NAMES.get(op, str(op)), None, trace_id, parent_id)
+                    token = tracing.activate(span)
+            status, data = (NOT_FOUND, b"") if node is None else handle(node, op, request)
+        except ValueError:
+            status, data = ERROR, b""
+        except Exception:
+            traceback.print_exc()
+            status, data = ERROR, b""
+        if span is not None:
+            tracing.deactivate(token)
+            span.finish(STATUS_NAMES.get(status, status))
+        try:
+            with lock:
+                sock.sendall(RESPONSE.pack(len(data), request_id, status) + data)
+        except OSError:
+            pass